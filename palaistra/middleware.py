@@ -0,0 +1,148 @@
+# palaistra/palaistra/middleware.py
+"""
+Lightweight per-request performance instrumentation, cheap enough to leave
+on in production.
+
+`PerformanceMiddleware` times every request and reports it in a
+`Server-Timing` header, which browsers show in their developer tools. For a
+sample of them (`PERFORMANCE_SAMPLE_RATE`) it also counts and times the SQL
+queries, through an execute wrapper, and the template rendering, through
+the `TimedDjangoTemplates` backend, and adds them to the header:
+
+    Server-Timing: db;dur=3.1;desc="4 queries", tpl;dur=5.2, app;dur=14.8
+
+Unsampled requests only get `app;dur=14.8`.
+
+Requests slower than `PERFORMANCE_SLOW_REQUEST_MS` are logged as JSON to the
+`palaistra.performance` logger, with their slowest queries when sampled.
+
+The body of a streaming response is produced after the middleware returns,
+so its queries are not counted.
+"""
+import contextvars
+import heapq
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+# Django imports
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger('palaistra.performance')
+
+SAMPLE_RATE = getattr(settings, 'PERFORMANCE_SAMPLE_RATE', 1.0)
+SLOW_REQUEST_MS = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 500)
+# Queries logged with a slow request
+TOP_QUERIES = 5
+# Logged SQL is cut to this many characters
+SQL_LENGTH = 500
+
+# Metrics of the request being handled, when it is sampled
+_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.queries = []
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.query_time += duration
+            self.queries.append((duration, sql))
+
+    def top_queries(self):
+        return [
+            {'ms': round(duration * 1000, 2), 'sql': sql[:SQL_LENGTH]}
+            for duration, sql in heapq.nlargest(TOP_QUERIES, self.queries, key=lambda query: query[0])
+        ]
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _metrics.get()
+        if metrics is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing the rendering of the templates it
+    loads. Included templates render within their parent, so they are not
+    counted twice.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            elapsed = time.perf_counter() - start
+            response['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}'
+            self.log_if_slow(request, response, elapsed, None)
+            return response
+
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        elapsed = time.perf_counter() - start
+
+        response['Server-Timing'] = (
+            f'db;dur={metrics.query_time * 1000:.1f};desc="{metrics.query_count} queries", '
+            f'tpl;dur={metrics.template_time * 1000:.1f}, '
+            f'app;dur={elapsed * 1000:.1f}'
+        )
+        self.log_if_slow(request, response, elapsed, metrics)
+        return response
+
+    def log_if_slow(self, request, response, elapsed, metrics):
+        if elapsed * 1000 < SLOW_REQUEST_MS:
+            return
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 1),
+            'sampled': metrics is not None,
+        }
+        if metrics is not None:
+            record.update({
+                'queries': metrics.query_count,
+                'db_ms': round(metrics.query_time * 1000, 1),
+                'template_ms': round(metrics.template_time * 1000, 1),
+                'top_queries': metrics.top_queries(),
+            })
+        logger.warning(json.dumps(record))
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that it times the whole request
+    'palaistra.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +58,8 @@ ROOT_URLCONF = 'palaistra.urls'
 import os
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing the rendering for PerformanceMiddleware
+        'BACKEND': 'palaistra.middleware.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, "templates")],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -70,6 +73,23 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'palaistra.wsgi.application'
+
+# Share of the requests whose queries and templates are timed, see
+# palaistra/middleware.py; every request is checked against the threshold.
+PERFORMANCE_SAMPLE_RATE = 1.0
+PERFORMANCE_SLOW_REQUEST_MS = 500
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # One JSON object per slow request
+        'palaistra.performance': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
 # Get the environment from the DJANGO_ENV environment variable.
 # Default to 'development' for local work, 'production' is safer for servers.
 ENVIRONMENT = os.getenv('DJANGO_ENV', 'development')
@@ -85,6 +105,48 @@ DATABASES = {
     }
 }
 
+# SQLite tuned for concurrent requests, merged into the production database
+# settings. In WAL mode readers are not blocked by the writer; IMMEDIATE
+# transactions take the write lock when they begin, waiting up to
+# busy_timeout for it, instead of failing with "database is locked" when a
+# read turns into a write; and connections are kept between requests.
+# The mode applies to every atomic() block, SQLite has no per-transaction
+# setting Django can reach: the few that only read (the admin change form on
+# a GET, explain_hot_queries) queue behind writers too. Requests are not
+# atomic (no ATOMIC_REQUESTS), so plain reads run in autocommit, unaffected,
+# and the app's own atomic() blocks all write.
+SQLITE_CONCURRENT = {
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA busy_timeout=5000;'
+            'PRAGMA mmap_size=268435456;'
+            'PRAGMA cache_size=-20000;'
+            'PRAGMA temp_store=MEMORY;'
+        ),
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Holds the versioned fragments and pages of problems/fragments.py, hence
+# more entries than the default 300.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Seconds a cached fragment is kept; changes make it unreachable before then
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -134,3 +196,10 @@ MEDIA_URL = '/tiptap_uploads/'
 # The absolute path to the directory where media files are stored.
 # Make sure this directory exists and is writable by your Django application.
 MEDIA_ROOT = BASE_DIR / 'tiptap_uploads'
+
+# How the media files are sent. None sends them from Django; behind nginx,
+# 'X-Accel-Redirect' hands them off to the internal location
+# MEDIA_ACCEL_PREFIX aliasing MEDIA_ROOT, and behind Apache or lighttpd
+# 'X-Sendfile' hands off their path.
+MEDIA_SENDFILE_HEADER = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
@@ -8,5 +8,6 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         # The BASE_DIR is inherited from base.py
         'NAME': BASE_DIR / 'prod_db.sqlite3',
+        **SQLITE_CONCURRENT,
     }
 }
\ No newline at end of file
@@ -11,6 +11,16 @@ from .base import *
 #ALLOWED_HOSTS_str = os.getenv('DJANGO_ALLOWED_HOSTS')
 #ALLOWED_HOSTS = ALLOWED_HOSTS_str.split(',') if ALLOWED_HOSTS_str else []
 
+# --- Media files ---
+# Let the front proxy send the uploaded files, e.g. with nginx:
+#   location /protected-media/ { internal; alias /path/to/tiptap_uploads/; }
+# and DJANGO_MEDIA_SENDFILE_HEADER=X-Accel-Redirect.
+MEDIA_SENDFILE_HEADER = os.getenv('DJANGO_MEDIA_SENDFILE_HEADER') or None
+
+# --- Performance instrumentation ---
+# Time the queries and templates of a tenth of the requests
+PERFORMANCE_SAMPLE_RATE = float(os.getenv('DJANGO_PERFORMANCE_SAMPLE_RATE', '0.1'))
+
 # --- Production Database ---
 # Use a separate SQLite database for production to keep data isolated.
 DATABASES = {
@@ -18,6 +28,19 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         # The BASE_DIR is inherited from base.py
         'NAME': BASE_DIR / 'prod_db.sqlite3',
+        # WAL, busy timeout and persistent connections, see base.py
+        **SQLITE_CONCURRENT,
+    }
+}
+
+# --- Cache ---
+# Shared by the worker processes, so that they all see the version bumps of
+# problems/fragments.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
@@ -1,7 +1,9 @@
 # Django imports
 from django.contrib import admin
+from django.core.paginator import Paginator
 from django.forms import Textarea
-from django.urls import reverse
+from django.http import JsonResponse
+from django.urls import path, reverse
 
 # Local application imports
 from .forms import (
@@ -22,9 +24,11 @@ from .models import (
     Solution,
     TaggedProblem,
 )
+from . import search, tag_index
 
 from django.utils.html import format_html
 from django.templatetags.static import static
+from taggit.models import Tag
 
 class TiptapWidget(Textarea):
     """
@@ -70,6 +74,91 @@ class TaggedProblemInline(admin.TabularInline):
     verbose_name_plural = 'Tags'
     classes = ('collapse',)
 
+class TagListFilter(admin.SimpleListFilter):
+    """
+    Filters problems by tag. Small tag sets are listed in full; past
+    `max_listed` tags the filter shows a search box and pages through the
+    matching tags instead of loading all of them.
+    """
+    title = 'tags'
+    parameter_name = 'tag'
+    search_parameter_name = 'tag_q'
+    page_parameter_name = 'tag_page'
+    max_listed = 50
+    template = 'admin/problems/tag_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        self.search_term = params.pop(self.search_parameter_name, [''])[-1].strip()
+        self.page_number = params.pop(self.page_parameter_name, ['1'])[-1]
+        self.request_params = request.GET
+        super().__init__(request, params, model, model_admin)
+
+    def expected_parameters(self):
+        return [self.parameter_name, self.search_parameter_name, self.page_parameter_name]
+
+    def has_output(self):
+        # Keep the search box around when a search matches no tag
+        return self.is_searchable or super().has_output()
+
+    def lookups(self, request, model_admin):
+        tags = Tag.objects.order_by('name')
+        self.is_searchable = tags[self.max_listed:self.max_listed + 1].exists()
+        if not self.is_searchable:
+            return [(tag.pk, tag.name) for tag in tags]
+
+        if self.search_term:
+            tags = tags.filter(name__icontains=self.search_term)
+        self.page = Paginator(tags.only('pk', 'name'), self.max_listed).get_page(self.page_number)
+        choices = [(tag.pk, tag.name) for tag in self.page]
+        # Keep the selected tag visible whatever the page
+        selected = self.selected_tag_id()
+        if selected is not None and selected not in {pk for pk, _ in choices}:
+            choices += [(tag.pk, tag.name) for tag in Tag.objects.filter(pk=selected).only('pk', 'name')]
+        return choices
+
+    def selected_tag_id(self):
+        """
+        Returns the selected tag ID, or None if none is or the parameter is
+        not an ID.
+        """
+        try:
+            return int(self.value())
+        except (TypeError, ValueError):
+            return None
+
+    def queryset(self, request, queryset):
+        selected = self.selected_tag_id()
+        if selected is not None:
+            return queryset.filter(tags__id=selected)
+        return queryset
+
+    def page_query_string(self, page_number):
+        params = self.request_params.copy()
+        params[self.page_parameter_name] = page_number
+        return '?' + params.urlencode()
+
+    @property
+    def hidden_params(self):
+        """
+        The other changelist parameters, kept by the tag search form.
+        """
+        ignored = {self.search_parameter_name, self.page_parameter_name, 'p'}
+        return [
+            (name, value)
+            for name, values in self.request_params.lists() if name not in ignored
+            for value in values
+        ]
+
+    @property
+    def previous_page_query_string(self):
+        if self.page.has_previous():
+            return self.page_query_string(self.page.previous_page_number())
+
+    @property
+    def next_page_query_string(self):
+        if self.page.has_next():
+            return self.page_query_string(self.page.next_page_number())
+
 class ProblemAdmin(admin.ModelAdmin):
     def get_form(self, request, obj=None, **kwargs):
         # 1. Generate the URL on the server
@@ -92,8 +181,12 @@ class ProblemAdmin(admin.ModelAdmin):
         SolutionInline,
     )
     list_display = ('__str__', 'get_tags', 'pub_date')
-    list_filter = ('tags',)
+    list_filter = (TagListFilter,)
     search_fields = ('body',)
+    # Skip the second COUNT over the whole table on filtered pages, and the
+    # per-tag facet counts
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
     fieldsets = (
         (None, {
             'fields': ('body', 'pub_date')
@@ -104,10 +197,19 @@ class ProblemAdmin(admin.ModelAdmin):
         })
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('tags')
+
     def get_tags(self, obj):
         return ", ".join(t.name for t in obj.tags.all())
     get_tags.short_description = 'Tags'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Served by the full-text index instead of LIKE scans over the bodies
+        if not search.is_available() or search.to_match_query(search_term) is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=search.matching_ids(search_term)), False
+
 class DeckTagFilterInline(admin.TabularInline):
     form = DeckTagFilterForm
     formset = BaseDeckTagFilterFormSet
@@ -123,18 +225,58 @@ class DeckTagFilterInline(admin.TabularInline):
 class DeckAdmin(admin.ModelAdmin):
     inlines = (DeckTagFilterInline,)
     list_display = ('name', 'get_include_tags_list', 'get_exclude_tags_list')
+    readonly_fields = ('matching_problems',)
 
     class Media:
         js = (
             'admin/js/deck_admin.js',
         )
 
+    def get_urls(self):
+        urls = [
+            path(
+                'preview/',
+                self.admin_site.admin_view(self.preview_view),
+                name='problems_deck_preview',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def preview_view(self, request):
+        """
+        Counts the problems matching the tag filters being edited, from the
+        in-memory tag index. Expects comma-separated tag IDs in the
+        `include` and `exclude` parameters.
+        """
+        try:
+            include, exclude = (
+                [int(pk) for pk in request.GET.get(name, '').split(',') if pk]
+                for name in ('include', 'exclude')
+            )
+        except ValueError:
+            return JsonResponse({'error': 'Invalid tag IDs.'}, status=400)
+        return JsonResponse({'count': tag_index.index.count(include, exclude)})
+
+    def matching_problems(self, obj):
+        count = tag_index.deck_count(obj) if obj.pk else None
+        if count is None:
+            count = obj.problems.count() if obj.pk else 0
+        return format_html(
+            '<span id="deck-match-preview" data-preview-url="{}">{}</span> problems',
+            reverse('admin:problems_deck_preview'),
+            count,
+        )
+    matching_problems.short_description = 'Matching problems'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_filters()
+
     def get_include_tags_list(self, obj):
-        return ", ".join(t.name for t in obj.get_include_tags())
+        return ", ".join(t.name for t in obj.include_tags)
     get_include_tags_list.short_description = 'Include Tags'
 
     def get_exclude_tags_list(self, obj):
-        return ", ".join(t.name for t in obj.get_exclude_tags())
+        return ", ".join(t.name for t in obj.exclude_tags)
     get_exclude_tags_list.short_description = 'Exclude Tags'
 
 admin.site.register(Deck, DeckAdmin)
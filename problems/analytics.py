@@ -0,0 +1,219 @@
+# palaistra/problems/analytics.py
+"""
+Time distributions of finished attempts, per problem, tag, deck and day.
+
+Each finished attempt is added to the `TimeSketch` of its problem, of the
+problem's tags and decks, of the day it finished and to the overall one, when
+it finishes; deleting or editing it takes it out again. Reading percentiles
+then only reads a sketch, whatever the number of attempts.
+
+An attempt counts for the tags and decks its problem had when it finished,
+which it keeps in `Attempt.sketch_keys` to be taken out of exactly those
+sketches later. `backfill` rebuilds every sketch from the attempts with the
+current ones.
+"""
+from collections import defaultdict
+from datetime import date
+
+# Django imports
+from django.db import transaction
+from django.utils import timezone
+
+# Local application imports
+from . import fragments
+from .models import Attempt, DeckMembership, Problem, TaggedProblem, TimeSketch
+from .sketches import LogHistogram
+
+Scope = TimeSketch.Scope
+QUANTILES = (0.5, 0.9)
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def day_key(moment):
+    return timezone.localdate(moment).toordinal()
+
+
+def _shared_keys(problem_ids):
+    """
+    Returns the (scope, key) of the tag and deck sketches an attempt on each
+    problem counts in.
+    """
+    keys = {pk: [] for pk in problem_ids}
+    tags = TaggedProblem.objects.filter(content_object_id__in=problem_ids)
+    for problem_id, tag_id in tags.values_list('content_object_id', 'tag_id'):
+        keys[problem_id].append((Scope.TAG, tag_id))
+    memberships = DeckMembership.objects.filter(problem_id__in=problem_ids)
+    for problem_id, deck_id in memberships.values_list('problem_id', 'deck_id'):
+        keys[problem_id].append((Scope.DECK, deck_id))
+    return keys
+
+
+def _own_keys(problem_id, end_time):
+    return [(Scope.ALL, 0), (Scope.PROBLEM, problem_id), (Scope.DAY, day_key(end_time))]
+
+
+def merge_into_db(sketches, sign=1):
+    """
+    Adds (or with `sign=-1`, subtracts) a {(scope, key): LogHistogram}
+    mapping to the stored sketches.
+    """
+    if not sketches:
+        return
+    with transaction.atomic():
+        stored = {
+            (sketch.scope, sketch.key): sketch
+            for sketch in TimeSketch.objects.select_for_update().filter(
+                scope__in={scope for scope, _ in sketches},
+                key__in={key for _, key in sketches},
+            )
+        }
+        changed, created = [], []
+        for (scope, key), delta in sketches.items():
+            row = stored.get((scope, key))
+            if row is None:
+                if sign < 0:
+                    continue
+                row = TimeSketch(scope=scope, key=key)
+                created.append(row)
+            else:
+                changed.append(row)
+            sketch = row.sketch.merge(delta) if sign > 0 else row.sketch.subtract(delta)
+            row.count = sketch.count
+            row.data = sketch.to_dict()
+        TimeSketch.objects.bulk_update([row for row in changed if row.count], ['count', 'data'])
+        # Sketches left without attempts go away, as if never created
+        TimeSketch.objects.filter(pk__in=[row.pk for row in changed if not row.count]).delete()
+        TimeSketch.objects.bulk_create(created)
+        fragments.schedule_bump(fragments.STATS)
+
+
+def _sketches_of(problem_id, end_time, time_taken, shared_keys):
+    sketch = LogHistogram()
+    sketch.add(time_taken.total_seconds())
+    return {key: sketch for key in _own_keys(problem_id, end_time) + shared_keys}
+
+
+def _is_counted(state):
+    return state is not None and None not in state
+
+
+def record_attempt_change(attempt, before, after):
+    """
+    Moves an attempt between the sketches as it goes from state `before` to
+    state `after` (see `Attempt.stats_state`), None once deleted: only
+    finished, timed attempts are counted. It is taken out of the tag and
+    deck sketches it was put in, whatever its problem's tags and decks are
+    now, and put in the current ones.
+    """
+    if before == after:
+        return
+    problem_id = attempt.problem_id
+    if _is_counted(before):
+        shared = attempt.sketch_keys
+        if shared is None:
+            # Counted before the keys were kept
+            shared = _shared_keys([problem_id])[problem_id]
+        merge_into_db(_sketches_of(problem_id, *before, [tuple(key) for key in shared]), sign=-1)
+    stored = None
+    if _is_counted(after):
+        shared = _shared_keys([problem_id])[problem_id]
+        merge_into_db(_sketches_of(problem_id, *after, shared))
+        stored = [list(key) for key in shared]
+    if after is not None and attempt.sketch_keys != stored:
+        attempt.sketch_keys = stored
+        Attempt.objects.filter(pk=attempt.pk).update(sketch_keys=stored)
+
+
+def delete_sketch(scope, key):
+    TimeSketch.objects.filter(scope=scope, key=key).delete()
+    fragments.schedule_bump(fragments.STATS)
+
+
+def _create_sketches(sketches):
+    TimeSketch.objects.bulk_create(
+        [
+            TimeSketch(scope=scope, key=key, count=sketch.count, data=sketch.to_dict())
+            for (scope, key), sketch in sketches.items()
+        ],
+        batch_size=BACKFILL_CHUNK_SIZE,
+    )
+
+
+def backfill(chunk_size=BACKFILL_CHUNK_SIZE, progress=None):
+    """
+    Rebuilds every sketch from the finished attempts, walking the problems
+    by ID in chunks of `chunk_size`. A chunk's problem sketches are complete
+    once its attempts are read and are written right away, along with the
+    keys of its attempts; the tag, deck, day and overall ones stay in memory
+    until the end. Returns the number of attempts read.
+    """
+    TimeSketch.objects.all().delete()
+    problem_ids = Problem.objects.order_by('pk').values_list('pk', flat=True)
+    shared = defaultdict(LogHistogram)
+    last_pk, total = 0, 0
+    while True:
+        chunk = list(problem_ids.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        keys = _shared_keys(chunk)
+        own, counted = defaultdict(LogHistogram), []
+        attempts = Attempt.objects.filter(
+            problem_id__in=chunk, end_time__isnull=False, time_taken__isnull=False,
+        ).values_list('pk', 'problem_id', 'end_time', 'time_taken')
+        for pk, problem_id, end_time, time_taken in attempts:
+            seconds = time_taken.total_seconds()
+            for key in _own_keys(problem_id, end_time) + keys[problem_id]:
+                (own if key[0] == Scope.PROBLEM else shared)[key].add(seconds)
+            counted.append(Attempt(pk=pk, sketch_keys=[list(key) for key in keys[problem_id]]))
+            total += 1
+        _create_sketches(own)
+        Attempt.objects.bulk_update(counted, ['sketch_keys'], batch_size=BACKFILL_CHUNK_SIZE)
+        last_pk = chunk[-1]
+        if progress:
+            progress(total)
+    _create_sketches(shared)
+    fragments.schedule_bump(fragments.STATS)
+    return total
+
+
+def summary(sketch):
+    """
+    Returns the count, mean and quantiles of a sketch, in seconds.
+    """
+    return {
+        'count': sketch.count,
+        'mean': sketch.mean,
+        **{f'p{round(q * 100)}': sketch.quantile(q) for q in QUANTILES},
+    }
+
+
+def get_summaries(scope, keys):
+    """
+    Returns {key: summary} for the stored sketches of `scope`; keys without
+    finished attempts are left out.
+    """
+    rows = TimeSketch.objects.filter(scope=scope, key__in=keys)
+    return {row.key: summary(row.sketch) for row in rows}
+
+
+def merged_summary(scope, keys):
+    """
+    Returns the summary of the union of several sketches of `scope`.
+    """
+    sketch = LogHistogram()
+    for row in TimeSketch.objects.filter(scope=scope, key__in=keys):
+        sketch.merge(row.sketch)
+    return summary(sketch)
+
+
+def daily_volume(days=30):
+    """
+    Returns [(date, summary)] for the last `days` days, oldest first.
+    """
+    today = timezone.localdate().toordinal()
+    summaries = get_summaries(Scope.DAY, range(today - days + 1, today + 1))
+    empty = summary(LogHistogram())
+    return [
+        (date.fromordinal(key), summaries.get(key, empty))
+        for key in range(today - days + 1, today + 1)
+    ]
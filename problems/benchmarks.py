@@ -0,0 +1,91 @@
+# palaistra/problems/benchmarks.py
+"""
+Helpers shared by the benchmark management commands.
+"""
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Django imports
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+# Local application imports
+from . import fragments
+from .models import Problem
+from .pagination import encode_cursor
+from .views import ProblemListView
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Runs the block against a freshly migrated test database, destroyed on
+    exit, so benchmarks never touch the configured database.
+    """
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def median_ms(func, repeat):
+    """
+    Runs `func` `repeat` times and returns the median wall time in ms.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def peak_memory_kb(func):
+    """
+    Runs `func` once and returns the peak of the memory it allocated, in KB
+    (Python allocations only, as traced by tracemalloc).
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def last_problem_list_page_url():
+    """
+    Returns the URL of the last page of the problem list, through the cursor
+    of the "next" link of the page before it: the keyset pages have no
+    numbers to ask for the last one with.
+    """
+    url = reverse('problems:problem-list')
+    per_page = ProblemListView.paginate_by
+    count = Problem.objects.count()
+    if count <= per_page:
+        return url
+    # The oldest problem of the page before the last one
+    last_page_size = count % per_page or per_page
+    before = Problem.objects.order_by('pub_date', 'pk').only('pk', 'pub_date')[last_page_size]
+    return f"{url}?cursor={encode_cursor(before, 'next')}"
+
+
+def invalidate_cached_pages():
+    """
+    Bumps the versions the problem list and the deck pages are cached under,
+    as a change would: their next GETs render them instead of reading them
+    from the cache.
+    """
+    fragments.bump(fragments.PROBLEM_LIST)
+    fragments.bump(fragments.DECK_LIST)
@@ -0,0 +1,94 @@
+# palaistra/problems/conditional.py
+"""
+Conditional GETs of the problem and deck pages.
+
+A page's validators are the modification times of what it shows, read with
+one small query before the view runs: `updated_at` of a problem and of its
+statistics, or of a deck. The pages listing problems use the version of
+the problem list kept by `problems.fragments` instead, which costs no
+query and, unlike the latest `updated_at`, changes on deletions too. So do
+the statistics pages, with the version of the time sketches.
+
+The ETag is made of the times to the microsecond; Last-Modified, to the
+second, only serves the clients that do not send If-None-Match.
+"""
+from datetime import datetime, time, timezone
+from functools import wraps
+
+# Django imports
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.utils.timezone import localdate, make_aware
+
+# Local application imports
+from . import fragments
+from .models import Deck, Problem
+
+
+def conditional(get_validators, **cache_control):
+    """
+    Decorates a view to answer If-None-Match and If-Modified-Since with a
+    304, without running it. `get_validators(request, *args, **kwargs)`
+    returns the (ETag, last modified datetime) of the page, or None if its
+    object does not exist. `cache_control` is applied to every response of
+    the view to a GET.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            validators = get_validators(request, *args, **kwargs)
+            if validators is None:
+                response = view(request, *args, **kwargs)
+            else:
+                etag, last_modified = validators[0], int(validators[1].timestamp())
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                if response.status_code in (200, 304):
+                    response.headers.setdefault('ETag', etag)
+                    response.headers.setdefault('Last-Modified', http_date(last_modified))
+            if cache_control:
+                patch_cache_control(response, **cache_control)
+            return response
+        return wrapper
+    return decorator
+
+
+def _validators(times, *extra):
+    times = [time for time in times if time is not None]
+    tag = '-'.join([f'{int(time.timestamp() * 1e6):x}' for time in times] + [str(part) for part in extra])
+    return f'W/"{tag}"', max(times)
+
+
+def problem_validators(problem_id):
+    times = Problem.objects.last_modified(problem_id)
+    return None if times is None else _validators(times)
+
+
+def deck_validators(deck_id):
+    updated_at = Deck.objects.filter(pk=deck_id).values_list('updated_at', flat=True).first()
+    return None if updated_at is None else _validators([updated_at])
+
+
+def deck_list_validators():
+    # Decks are few; the count catches deletions
+    decks = Deck.objects.aggregate(updated_at=Max('updated_at'), count=Count('pk'))
+    return None if decks['updated_at'] is None else _validators([decks['updated_at']], decks['count'])
+
+
+def problem_list_validators():
+    version = fragments.get_version(fragments.PROBLEM_LIST)
+    return f'W/"{version:x}"', datetime.fromtimestamp(version / 1e9, timezone.utc)
+
+
+def stats_validators(*scopes):
+    """
+    Validators of a statistics page showing the sketches and `scopes`. The
+    per-day figures end today, so the page also changes at midnight.
+    """
+    versions = fragments.get_versions((fragments.STATS, 0), *[(scope, 0) for scope in scopes])
+    times = [datetime.fromtimestamp(version / 1e9, timezone.utc) for version in versions]
+    return _validators(times + [make_aware(datetime.combine(localdate(), time()))])
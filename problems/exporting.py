@@ -0,0 +1,165 @@
+# palaistra/problems/exporting.py
+"""
+Streaming export of the problem bank, in the format `problems.importing`
+reads back.
+
+Problems are read with a chunked `.iterator()`, their hints, solutions and
+tags prefetched a chunk at a time, and written one JSONL record at a time,
+so memory stays flat whatever the size of the bank. Records carry the
+problem's ID, which the importer uses to point the [[problem:ID]] links at
+the problems it creates, and its attempt statistics, which it ignores.
+
+An archive is a zip holding the records as `problems.jsonl` and the
+uploaded images they reference under `media/`, resized variants included,
+written incrementally through `ZipStream`: it can be sent as a
+`StreamingHttpResponse` or written to a file.
+"""
+import json
+import re
+from zipfile import ZIP_DEFLATED, ZipFile
+
+# Django imports
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+
+# Local application imports
+from .models import Hint, Problem, ProblemStats, Solution
+
+CHUNK_SIZE = 500
+ARCHIVE_RECORDS = 'problems.jsonl'
+ARCHIVE_MEDIA = 'media/'
+# Images are copied into the archive this many bytes at a time
+COPY_BUFFER_SIZE = 64 * 1024
+
+_IMAGE_SRC_PATTERN = re.compile(r'<img[^>]*\ssrc="([^"]+)"')
+_IMAGE_SRCSET_PATTERN = re.compile(r'<img[^>]*\ssrcset="([^"]+)"')
+
+
+def _seconds(duration):
+    return duration.total_seconds() if duration is not None else None
+
+
+def _stats(problem):
+    try:
+        stats = problem.stats
+    except ProblemStats.DoesNotExist:
+        return None
+    return {
+        'attempt_count': stats.attempt_count,
+        'completed_count': stats.completed_count,
+        'total_time': _seconds(stats.total_time),
+        'min_time': _seconds(stats.min_time),
+        'max_time': _seconds(stats.max_time),
+    }
+
+
+def to_record(problem):
+    record = {
+        'id': problem.pk,
+        'body': problem.body,
+        'hints': [hint.body for hint in problem.hints.all()],
+        'solutions': [solution.body for solution in problem.solutions.all()],
+        'tags': sorted(tag.name for tag in problem.tags.all()),
+        'pub_date': problem.pub_date.isoformat(),
+    }
+    if problem.book_source is not None:
+        record['book_source'] = {'title': problem.book_source.title, 'author': problem.book_source.author}
+    if problem.page_number is not None:
+        record['page_number'] = problem.page_number
+    if problem.problem_number is not None:
+        record['problem_number'] = problem.problem_number
+    stats = _stats(problem)
+    if stats is not None:
+        record['stats'] = stats
+    return record
+
+
+def export_records(chunk_size=CHUNK_SIZE):
+    """
+    Yields a record for every problem, in ID order, reading `chunk_size`
+    problems at a time.
+    """
+    problems = (
+        Problem.objects.order_by('pk')
+        .select_related('book_source', 'stats')
+        .prefetch_related(
+            Prefetch('hints', queryset=Hint.objects.order_by('pk')),
+            Prefetch('solutions', queryset=Solution.objects.order_by('pk')),
+            'tags',
+        )
+    )
+    for problem in problems.iterator(chunk_size=chunk_size):
+        yield to_record(problem)
+
+
+def to_jsonl(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def image_names(record):
+    """
+    Returns the storage names of the uploaded images a record references,
+    in `src` or as a `srcset` candidate.
+    """
+    names = []
+    for html in [record['body'], *record['hints'], *record['solutions']]:
+        urls = _IMAGE_SRC_PATTERN.findall(html)
+        for srcset in _IMAGE_SRCSET_PATTERN.findall(html):
+            urls += [candidate.split()[0] for candidate in srcset.split(',') if candidate.strip()]
+        for url in urls:
+            if url.startswith(settings.MEDIA_URL):
+                names.append(url[len(settings.MEDIA_URL):])
+    return names
+
+
+class ZipStream:
+    """
+    A write-only file that hands out what was written to it, so a
+    `ZipFile` can be streamed as it is built. Without `seek()`, `ZipFile`
+    writes each entry's sizes after its data.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def archive_chunks(chunk_size=CHUNK_SIZE):
+    """
+    Yields the bytes of an archive of the whole bank as it is written. Only
+    the names of the referenced images are held in memory until the
+    records are written.
+    """
+    stream = ZipStream()
+    with ZipFile(stream, 'w', ZIP_DEFLATED) as archive:
+        images = {}
+        with archive.open(ARCHIVE_RECORDS, 'w', force_zip64=True) as entry:
+            for record in export_records(chunk_size):
+                entry.write(to_jsonl(record).encode())
+                images.update(dict.fromkeys(image_names(record)))
+                yield stream.drain()
+        for name in images:
+            if not default_storage.exists(name):
+                continue
+            with default_storage.open(name) as source, \
+                    archive.open(ARCHIVE_MEDIA + name, 'w', force_zip64=True) as entry:
+                while data := source.read(COPY_BUFFER_SIZE):
+                    entry.write(data)
+                    yield stream.drain()
+    yield stream.drain()
@@ -0,0 +1,95 @@
+# palaistra/problems/fragments.py
+"""
+Versioned caching of rendered problem fragments and pages.
+
+Every problem and deck has a version in the cache, and so do the problem
+and deck lists as a whole. The receivers in `problems.signals` bump them
+once a change commits. Fragments are cached under keys that include the
+versions they were rendered at, so a change makes the old fragments
+unreachable at once, without having to find and delete them; they expire
+on their own.
+
+A version is the time in nanoseconds it was bumped (or first read, when
+missing or evicted), rather than a counter: it never goes back to a value
+stale fragments were cached under, and two processes bumping it at once
+cannot lose a bump.
+
+Only the cache is involved, so it works with the local-memory and
+file-based backends. With several processes, the cache must be shared
+between them (file-based) for every process to see the bumps.
+"""
+import hashlib
+import time
+
+# Django imports
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+PROBLEM = 'problem'
+DECK = 'deck'
+# Any problem or deck, for the pages listing several
+PROBLEM_LIST = 'problem-list'
+DECK_LIST = 'deck-list'
+# The time sketches of `problems.analytics`
+STATS = 'stats'
+
+VERSION_KEY = 'problems:version:{}:{}'
+FRAGMENT_KEY = 'problems:fragment:{}:{}'
+# Versioned fragments never go stale, the timeout only frees the space of
+# the unreachable ones
+TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def get_versions(*scopes):
+    """
+    Returns the current versions of the given (scope, ID) pairs, in order.
+    """
+    keys = [VERSION_KEY.format(scope, pk) for scope, pk in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Another process may start the version first
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key, time.time_ns())
+    return [versions[key] for key in keys]
+
+
+def get_version(scope, pk=0):
+    return get_versions((scope, pk))[0]
+
+
+def bump(scope, pk=0):
+    cache.set(VERSION_KEY.format(scope, pk), time.time_ns(), None)
+
+
+def schedule_bump(scope, pk=0):
+    """
+    Bumps a version once the current transaction commits: bumped earlier, a
+    concurrent request could cache the old data under the new version.
+    """
+    transaction.on_commit(lambda: bump(scope, pk))
+
+
+def fragment_key(name, versions, *parts):
+    digest = hashlib.md5(repr((versions, parts)).encode(), usedforsecurity=False)
+    return FRAGMENT_KEY.format(name, digest.hexdigest())
+
+
+def cached_page(request, scopes, get_response):
+    """
+    Returns the response to a GET of a page showing nothing personal, from
+    the cache if it was rendered at the current versions of `scopes` with
+    the same query string. On a miss, `get_response` is called and a
+    successful response cached.
+    """
+    key = fragment_key(request.path, get_versions(*scopes), request.GET.urlencode())
+    content = cache.get(key)
+    if content is not None:
+        return HttpResponse(content)
+    response = get_response()
+    if response.status_code == 200:
+        response.render()
+        cache.set(key, response.content, TIMEOUT)
+    return response
@@ -0,0 +1,318 @@
+# palaistra/problems/importing.py
+"""
+Bulk import of problems with their hints, solutions, tags and book sources.
+
+Records are read one at a time from JSONL or CSV and written in batches with
+`bulk_create`: a batch costs a fixed number of queries whatever its size.
+Tags and book sources are looked up in in-memory caches, created in bulk
+when missing. Problems already present, by (book source, page number,
+problem number), are skipped.
+
+Records may carry the `id` the problem had where it was exported from:
+[[problem:ID]] links to the problems of the import are then rewritten to
+their new IDs, or to the ID of the problem already present for the skipped
+ones. Links to problems not imported yet are rewritten once the last record
+is written.
+
+A JSONL record looks like:
+
+    {"body": "...", "hints": ["..."], "solutions": ["..."],
+     "tags": ["Algebra", "Easy"], "book_source": {"title": "...", "author": "..."},
+     "page_number": 12, "problem_number": "3-4", "pub_date": "2025-01-31T12:00:00+00:00",
+     "id": 42}
+
+CSV files have the same columns, with `hints` and `solutions` as JSON lists,
+`tags` comma-separated and the book source as `book_title` and `book_author`.
+Archives written by `problems.exporting` are zips of a JSONL file and the
+images it references, restored into the default storage first.
+
+Bulk inserts skip the model signals: the derived tables (deck memberships,
+search index, tag index) and the cache version of the problem list are
+updated here, once per batch.
+"""
+import csv
+import io
+import json
+from zipfile import ZipFile
+
+# Django imports
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+# Third-party imports
+from taggit.models import Tag
+
+# Local application imports
+from . import fragments, membership, search
+from .exporting import ARCHIVE_MEDIA, ARCHIVE_RECORDS
+from .links import PROBLEM_LINK_PATTERN, find_problem_ids, get_problem_snippets, save_links
+from .models import BookSource, Deck, Hint, Problem, Solution, TaggedProblem
+from .rendering import body_hash, render_body
+from .tag_index import index as tag_index
+
+BATCH_SIZE = 1000
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        record = {key: value for key, value in row.items() if value not in (None, '')}
+        for key in ('hints', 'solutions'):
+            if key in record:
+                record[key] = json.loads(record[key])
+        if 'tags' in record:
+            record['tags'] = [name.strip() for name in record['tags'].split(',') if name.strip()]
+        if 'book_title' in record:
+            record['book_source'] = {'title': record.pop('book_title'), 'author': record.pop('book_author', '')}
+        yield record
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+def _rendered(model, body, snippets, **fields):
+    return model(body=body, body_html=render_body(body, snippets), body_hash=body_hash(body), **fields)
+
+
+class ProblemImporter:
+    """
+    Buffers records and writes them `batch_size` at a time. Call `finish()`
+    once the last record was added.
+    """
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = []
+        self.imported = self.skipped = 0
+        self.tags = dict(Tag.objects.values_list('name', 'pk'))
+        self.slugs = set(Tag.objects.values_list('slug', flat=True))
+        self.book_sources = {
+            (title, author): pk for pk, title, author in BookSource.objects.values_list('pk', 'title', 'author')
+        }
+        self.seen = {
+            (book_source_id, page_number, problem_number): pk
+            for pk, book_source_id, page_number, problem_number in
+            Problem.objects.filter(book_source__isnull=False, problem_number__isnull=False)
+            .values_list('pk', 'book_source_id', 'page_number', 'problem_number')
+            .iterator()
+        }
+        self.deck_filters = membership.load_deck_filters()
+        # Exported ID -> ID here, and the (model, pk) of the texts linking
+        # to problems that were not written yet
+        self.ids = {}
+        self.unlinked = []
+
+    def add(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        records, self.pending = self.pending, []
+        if records:
+            with transaction.atomic():
+                self._write(records)
+
+    def finish(self):
+        """
+        Writes the pending records, then rewrites the links to problems that
+        were imported after the texts linking to them.
+        """
+        self.flush()
+        with transaction.atomic():
+            self._relink()
+
+    def _link(self, text):
+        """
+        Rewrites the links of a text to the problems imported so far.
+        """
+        def replace(match):
+            return f'[[problem:{self.ids.get(int(match.group(1)), match.group(1))}]]'
+        return PROBLEM_LINK_PATTERN.sub(replace, text)
+
+    def _relink(self):
+        unlinked, self.unlinked = self.unlinked, []
+        for start in range(0, len(unlinked), self.batch_size):
+            batch = unlinked[start:start + self.batch_size]
+            objs = []
+            for model, fields in ((Problem, ['body']), (Hint, ['body', 'problem_id']), (Solution, ['body', 'problem_id'])):
+                pks = [pk for m, pk in batch if m is model]
+                objs += model.objects.filter(pk__in=pks).only(*fields) if pks else []
+            for obj in objs:
+                obj.body = self._link(obj.body)
+            snippets = get_problem_snippets(find_problem_ids(*[obj.body for obj in objs]))
+            problem_ids = set()
+            for model in (Problem, Hint, Solution):
+                changed = [obj for obj in objs if type(obj) is model]
+                for obj in changed:
+                    obj.body_html, obj.body_hash = render_body(obj.body, snippets), body_hash(obj.body)
+                    problem_ids.add(obj.pk if model is Problem else obj.problem_id)
+                model.objects.bulk_update(changed, ['body', 'body_html', 'body_hash'])
+            save_links(objs)
+            search.index_problems(problem_ids)
+            # As the signals would have for saved bodies
+            Problem.objects.filter(pk__in=problem_ids).touch()
+            Deck.objects.filter(memberships__problem_id__in=problem_ids).touch()
+            for problem_id in problem_ids:
+                fragments.schedule_bump(fragments.PROBLEM, problem_id)
+        if unlinked:
+            fragments.schedule_bump(fragments.PROBLEM_LIST)
+
+    def _book_source_ids(self, records):
+        missing = {
+            (source['title'], source.get('author', ''))
+            for source in (record.get('book_source') for record in records)
+            if source and (source['title'], source.get('author', '')) not in self.book_sources
+        }
+        if missing:
+            BookSource.objects.bulk_create(
+                [BookSource(title=title, author=author) for title, author in missing], ignore_conflicts=True,
+            )
+            for pk, title, author in BookSource.objects.filter(
+                title__in={title for title, _ in missing}
+            ).values_list('pk', 'title', 'author'):
+                self.book_sources[(title, author)] = pk
+
+    def _tag_ids(self, names):
+        missing = [name for name in dict.fromkeys(names) if name not in self.tags]
+        if missing:
+            tags = []
+            for name in missing:
+                tag = Tag(name=name, slug=Tag().slugify(name))
+                # Same clash resolution as Tag.save()
+                i = 1
+                while tag.slug in self.slugs:
+                    tag.slug = Tag().slugify(name, i)
+                    i += 1
+                self.slugs.add(tag.slug)
+                tags.append(tag)
+            Tag.objects.bulk_create(tags)
+            self.tags.update(Tag.objects.filter(name__in=missing).values_list('name', 'pk'))
+        return [self.tags[name] for name in names]
+
+    def _write(self, records):
+        self._book_source_ids(records)
+        problems, children, keys, aliases = [], [], [], []
+        for record in records:
+            source = record.get('book_source')
+            book_source_id = self.book_sources[(source['title'], source.get('author', ''))] if source else None
+            page_number = int(record['page_number']) if record.get('page_number') not in (None, '') else None
+            problem_number = str(record['problem_number']) if record.get('problem_number') not in (None, '') else None
+            if book_source_id and problem_number is not None:
+                key = (book_source_id, page_number, problem_number)
+                if key in self.seen:
+                    if record.get('id') is not None:
+                        # Links to it go to the problem already present
+                        aliases.append((int(record['id']), key))
+                    self.skipped += 1
+                    continue
+                # Known once the problem is created
+                self.seen[key] = None
+            else:
+                key = None
+            fields = {
+                'book_source_id': book_source_id,
+                'page_number': page_number,
+                'problem_number': problem_number,
+            }
+            if record.get('pub_date'):
+                fields['pub_date'] = parse_datetime(record['pub_date'])
+            problems.append(fields)
+            children.append(record)
+            keys.append(key)
+        if not problems:
+            self.ids.update((old, self.seen[key]) for old, key in aliases)
+            return
+
+        # Links to the problems written before, the others are left for
+        # `finish()`
+        unlinked, linked = [], []
+        for record in children:
+            texts = [record['body'], *record.get('hints', ()), *record.get('solutions', ())]
+            unlinked.append(bool(find_problem_ids(*texts) - self.ids.keys()))
+            linked.append({
+                'body': self._link(record['body']),
+                'hints': [self._link(body) for body in record.get('hints', ())],
+                'solutions': [self._link(body) for body in record.get('solutions', ())],
+            })
+        children = [{**record, **texts} for record, texts in zip(children, linked)]
+
+        self._tag_ids([name for record in children for name in record.get('tags', ())])
+        texts = [
+            text for record in children
+            for text in [record['body'], *record.get('hints', ()), *record.get('solutions', ())]
+        ]
+        snippets = get_problem_snippets(find_problem_ids(*texts))
+        created = Problem.objects.bulk_create([
+            _rendered(Problem, record['body'], snippets, **fields) for record, fields in zip(children, problems)
+        ])
+        hints = Hint.objects.bulk_create([
+            _rendered(Hint, body, snippets, problem=problem)
+            for problem, record in zip(created, children) for body in record.get('hints', ())
+        ])
+        solutions = Solution.objects.bulk_create([
+            _rendered(Solution, body, snippets, problem=problem)
+            for problem, record in zip(created, children) for body in record.get('solutions', ())
+        ])
+        save_links(created + hints + solutions, created=True)
+        TaggedProblem.objects.bulk_create([
+            TaggedProblem(content_object=problem, tag_id=tag_id)
+            for problem, record in zip(created, children)
+            for tag_id in set(self._tag_ids(record.get('tags', ())))
+        ])
+
+        for problem, record, key in zip(created, children, keys):
+            if key is not None:
+                self.seen[key] = problem.pk
+            if record.get('id') is not None:
+                self.ids[int(record['id'])] = problem.pk
+        self.ids.update((old, self.seen[key]) for old, key in aliases)
+        linking = {problem.pk for problem, flag in zip(created, unlinked) if flag}
+        self.unlinked += [
+            (type(obj), obj.pk) for obj in created + hints + solutions
+            if (obj.pk if type(obj) is Problem else obj.problem_id) in linking and '[[problem:' in obj.body
+        ]
+
+        problem_ids = [problem.pk for problem in created]
+        membership.sync_problems(problem_ids, self.deck_filters)
+        search.index_problems(problem_ids, replace=False)
+        transaction.on_commit(tag_index.clear)
+        # The decks whose memberships changed are bumped by the sync
+        fragments.schedule_bump(fragments.PROBLEM_LIST)
+        self.imported += len(created)
+
+
+def import_problems(records, batch_size=BATCH_SIZE, progress=None):
+    """
+    Imports an iterable of records. Returns the (imported, skipped) counts.
+    """
+    importer = ProblemImporter(batch_size)
+    for record in records:
+        importer.add(record)
+        if progress and not importer.pending:
+            progress(importer.imported, importer.skipped)
+    importer.finish()
+    return importer.imported, importer.skipped
+
+
+def import_archive(file, batch_size=BATCH_SIZE, progress=None):
+    """
+    Imports an archive: restores its images that are not in the storage
+    yet, under their original names, then imports its records. Returns the
+    (imported, skipped) counts.
+    """
+    with ZipFile(file) as archive:
+        for info in archive.infolist():
+            name = info.filename[len(ARCHIVE_MEDIA):]
+            if info.filename.startswith(ARCHIVE_MEDIA) and name and not default_storage.exists(name):
+                with archive.open(info) as image:
+                    default_storage.save(name, File(image, name=name))
+        with archive.open(ARCHIVE_RECORDS) as records:
+            return import_problems(read_jsonl(io.TextIOWrapper(records, encoding='utf-8')), batch_size, progress)
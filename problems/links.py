@@ -0,0 +1,136 @@
+# palaistra/problems/links.py
+"""
+[[problem:ID]] links between problems.
+
+Links are rendered into the stored HTML of the bodies holding them, and
+stored as `ProblemLink` rows as the bodies are saved, so the bodies linking
+to a problem are found through an index when it changes.
+"""
+import re
+
+# Django imports
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.html import format_html
+
+# Local application imports
+from .models import Hint, Problem, ProblemLink, Solution
+
+PROBLEM_LINK_PATTERN = re.compile(r'\[\[problem:(\d+)\]\]')
+
+SNIPPET_LENGTH = 30
+SNIPPET_CACHE_KEY = 'problems:link-snippet:{}'
+SNIPPET_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def problem_snippet(body):
+    """
+    Returns the short text used as the label of a link to a problem.
+    """
+    return (body[:SNIPPET_LENGTH] + '...') if len(body) > SNIPPET_LENGTH else body
+
+
+def find_problem_ids(*texts):
+    """
+    Returns the set of problem IDs referenced by [[problem:ID]] links in the
+    given texts.
+    """
+    ids = set()
+    for text in texts:
+        if text:
+            ids.update(int(pk) for pk in PROBLEM_LINK_PATTERN.findall(text))
+    return ids
+
+
+def get_problem_snippets(problem_ids):
+    """
+    Returns a dict mapping each existing problem ID to its link snippet.
+
+    Snippets are read from the cache first; the misses are fetched with a
+    single `pk__in` query and written back. IDs that do not exist are left
+    out of the result.
+    """
+    problem_ids = set(problem_ids)
+    if not problem_ids:
+        return {}
+
+    keys = {SNIPPET_CACHE_KEY.format(pk): pk for pk in problem_ids}
+    cached = cache.get_many(keys)
+    snippets = {keys[key]: snippet for key, snippet in cached.items()}
+
+    missing = problem_ids - snippets.keys()
+    if missing:
+        fetched = {
+            pk: problem_snippet(body)
+            for pk, body in Problem.objects.filter(pk__in=missing).values_list('pk', 'body')
+        }
+        cache.set_many(
+            {SNIPPET_CACHE_KEY.format(pk): snippet for pk, snippet in fetched.items()},
+            SNIPPET_CACHE_TIMEOUT,
+        )
+        snippets.update(fetched)
+    return snippets
+
+
+def invalidate_problem_snippet(problem_id):
+    cache.delete(SNIPPET_CACHE_KEY.format(problem_id))
+
+
+def replace_problem_links(text, snippets):
+    """
+    Replaces every [[problem:ID]] in `text` with a link to the problem, using
+    the already resolved `snippets` as link texts.
+    """
+    def replace_link(match):
+        problem_id = int(match.group(1))
+        if problem_id not in snippets:
+            return f"[[Invalid Problem ID: {problem_id}]]"
+        url = reverse('problems:problem-detail', args=[problem_id])
+        return format_html('<a href="{}">{}</a>', url, snippets[problem_id])
+
+    return PROBLEM_LINK_PATTERN.sub(replace_link, text)
+
+
+def _source_fields(obj):
+    if isinstance(obj, Problem):
+        return {'problem_id': obj.pk}
+    if isinstance(obj, Hint):
+        return {'problem_id': obj.problem_id, 'hint_id': obj.pk}
+    return {'problem_id': obj.problem_id, 'solution_id': obj.pk}
+
+
+def save_links(objs, created=False):
+    """
+    Replaces the stored links of saved problems, hints or solutions with the
+    ones in their bodies. Pass `created=True` for objects just inserted,
+    which have none stored yet.
+    """
+    if not created:
+        for model, field in ((Problem, 'problem_id__in'), (Hint, 'hint_id__in'), (Solution, 'solution_id__in')):
+            pks = [obj.pk for obj in objs if type(obj) is model]
+            if pks:
+                links = ProblemLink.objects.filter(**{field: pks})
+                if model is Problem:
+                    links = links.filter(hint__isnull=True, solution__isnull=True)
+                links.delete()
+    ProblemLink.objects.bulk_create([
+        ProblemLink(target_id=target_id, **_source_fields(obj))
+        for obj in objs for target_id in find_problem_ids(obj.body)
+    ])
+
+
+def linking_bodies(problem_id):
+    """
+    Returns the [(model, pks)] of the problems, hints and solutions whose
+    bodies link to a problem.
+    """
+    links = ProblemLink.objects.filter(target_id=problem_id).values_list('problem_id', 'hint_id', 'solution_id')
+    sources = {Problem: set(), Hint: set(), Solution: set()}
+    for problem_id, hint_id, solution_id in links:
+        if hint_id is not None:
+            sources[Hint].add(hint_id)
+        elif solution_id is not None:
+            sources[Solution].add(solution_id)
+        else:
+            sources[Problem].add(problem_id)
+    return [(model, pks) for model, pks in sources.items() if pks]
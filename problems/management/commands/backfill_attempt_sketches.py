@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from problems import analytics
+from problems.models import TimeSketch
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the per-problem, per-tag, per-deck and per-day time sketches '
+        'from the finished attempts, reading them a chunk of problems at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=analytics.BACKFILL_CHUNK_SIZE,
+            help='Problems read per chunk.',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Backfilling attempt sketches...')
+        start = time.perf_counter()
+        with transaction.atomic():
+            total = analytics.backfill(
+                options['chunk_size'],
+                progress=lambda n: self.stdout.write(f'  {n} attempts', ending='\r'),
+            )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {total} attempts into {TimeSketch.objects.count()} sketches in {elapsed:.1f}s.'
+        ))
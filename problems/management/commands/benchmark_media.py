@@ -0,0 +1,80 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.views.static import serve as static_serve
+from problems import media, uploads
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the throughput of serving uploaded images of several sizes: "
+        "through django.views.static.serve, which served them before, and "
+        "through problems.media sending them itself, answering revalidations "
+        "and ranges, or handing them off with X-Accel-Redirect. Views are "
+        "called directly, without middleware, on files in a temporary directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='20,200,2000',
+            help='Comma-separated file sizes in KB.',
+        )
+        parser.add_argument('--seconds', type=float, default=1.0, help='Time spent on each case.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f"Invalid --sizes: {options['sizes']!r}")
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.stdout.write(f"{'size KB':>8}  {'case':<32}{'req/s':>10}{'MB/s':>10}")
+            for size in sizes:
+                name = self.write_file(media_root, size * 1024)
+                for case, view, headers, overrides in self.cases(media_root, name):
+                    with override_settings(**overrides):
+                        rate, transferred = self.throughput(view, name, headers, options['seconds'])
+                    self.stdout.write(f"{size:>8}  {case:<32}{rate:>10.0f}{transferred / 1e6:>10.1f}")
+
+    def write_file(self, media_root, size):
+        content = os.urandom(size)
+        name = uploads.content_name(hashlib.sha256(content).hexdigest(), 'png')
+        os.makedirs(os.path.join(media_root, uploads.UPLOAD_DIR), exist_ok=True)
+        with open(os.path.join(media_root, name), 'wb') as f:
+            f.write(content)
+        return name
+
+    def cases(self, media_root, name):
+        def previous(request, name):
+            return static_serve(request, name, document_root=media_root)
+
+        etag = media.serve(RequestFactory().get('/'), name)['ETag']
+        last_modified = previous(RequestFactory().get('/'), name)['Last-Modified']
+        return [
+            ('static.serve', previous, {}, {}),
+            ('static.serve If-Modified-Since', previous, {'If-Modified-Since': last_modified}, {}),
+            ('media.serve', media.serve, {}, {}),
+            ('media.serve If-None-Match', media.serve, {'If-None-Match': etag}, {}),
+            ('media.serve Range 64 KB', media.serve, {'Range': 'bytes=0-65535'}, {}),
+            ('media.serve X-Accel-Redirect', media.serve, {}, {'MEDIA_SENDFILE_HEADER': 'X-Accel-Redirect'}),
+        ]
+
+    def throughput(self, view, name, headers, seconds):
+        """
+        Requests the file for `seconds`, reading every response through.
+        Returns the requests and the bytes sent per second.
+        """
+        factory = RequestFactory()
+        requests = transferred = 0
+        start = time.perf_counter()
+        while (elapsed := time.perf_counter() - start) < seconds:
+            response = view(factory.get('/', headers=headers), name)
+            content = response.streaming_content if response.streaming else [response.content]
+            transferred += sum(len(chunk) for chunk in content)
+            response.close()
+            requests += 1
+        return requests / elapsed, transferred / elapsed
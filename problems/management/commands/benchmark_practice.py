@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from problems import membership, practice
+from problems.benchmarks import percentile, throwaway_database
+from problems.models import Deck, DeckTagFilter, Hint, Problem, Solution, TaggedProblem
+from problems.rendering import body_hash, render_body
+from taggit.models import Tag
+
+WORDS = 'integral derivative limit series matrix prime divisor triangle circle proof'.split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Steps through a deck practice session on a throwaway database, with and '
+        'without the practice card cache, and reports the latency of each step '
+        '(the Skip POST and the GET it redirects to). The configured database is '
+        'not touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--problems', type=int, default=1000, help='Number of problems in the deck.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            self.seed(options['problems'], random.Random(options['seed']))
+            deck = Deck.objects.get()
+            self.stdout.write(f"{'mode':<10}{'steps':>7}{'median':>9}{'p90':>9}{'queries/GET':>13}   (ms)")
+            for label, timeout, prefetch in (('no cache', 0, False), ('prefetch', 120, True)):
+                practice.CARD_CACHE_TIMEOUT = timeout
+                timings, queries = self.step_through(deck, prefetch)
+                self.stdout.write(
+                    f"{label:<10}{len(timings):>7}{statistics.median(timings):>9.2f}"
+                    f"{percentile(timings, 0.9):>9.2f}{statistics.mean(queries):>13.1f}"
+                )
+
+    def step_through(self, deck, prefetch):
+        """
+        Skips through the whole deck. When `prefetch` is set, the prefetch
+        hints of each page are requested between steps, the way a browser
+        does while the problem is on screen.
+        """
+        client = Client()
+        url = reverse('problems:deck-practice', args=[deck.pk])
+        response = client.get(url)
+        timings, queries = [], []
+        while True:
+            if prefetch:
+                for prefetch_url in response.context['prefetch_urls']:
+                    client.get(prefetch_url)
+            start = time.perf_counter()
+            response = client.post(url, {'skip_problem': ''})
+            if response.url != url:
+                return timings, queries
+            with CaptureQueriesContext(connection) as captured:
+                response = client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+
+    def seed(self, count, rng):
+        self.stdout.write(f'Seeding a deck of {count} problems...')
+
+        def rendered(model, **fields):
+            body = f"<p>{' '.join(rng.choices(WORDS, k=30))} \\(\\frac{{a}}{{b}}\\)</p>"
+            return model(body=body, body_html=render_body(body, {}), body_hash=body_hash(body), **fields)
+
+        problems = Problem.objects.bulk_create([rendered(Problem) for _ in range(count)])
+        Hint.objects.bulk_create([rendered(Hint, problem=p) for p in problems for _ in range(2)])
+        Solution.objects.bulk_create([rendered(Solution, problem=p) for p in problems for _ in range(2)])
+        tag = Tag.objects.create(name='practice', slug='practice')
+        TaggedProblem.objects.bulk_create([TaggedProblem(content_object=p, tag=tag) for p in problems])
+        # Bulk inserts skip the signals: build the memberships in one go
+        DeckTagFilter.objects.create(deck=Deck.objects.create(name='Practice'), tag=tag)
+        membership.rebuild_all()
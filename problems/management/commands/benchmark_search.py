@@ -0,0 +1,83 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from problems import search
+from problems.benchmarks import median_ms, throwaway_database
+from problems.models import Hint, Problem, Solution
+
+MATH_WORDS = (
+    'integral derivative limit series matrix vector eigenvalue polynomial root '
+    'triangle circle angle proof prime divisor sequence function continuous '
+    'convergence inequality probability expectation variance graph tree'
+).split()
+LATEX = [
+    r'\(\int_{0}^{1} x^2 dx\)',
+    r'\(\frac{a}{b} + \frac{c}{d}\)',
+    r'\(\sum_{n=1}^{\infty} \frac{1}{n^2}\)',
+    r'\(\lim_{x \to 0} \frac{\sin x}{x}\)',
+    r'\(\sqrt{2}\)',
+]
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks full-text search against LIKE scans on a throwaway database '
+        'seeded with synthetic problems. The configured database is not touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--problems', type=int, default=100_000, help='Number of problems to seed.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            'queries', nargs='*',
+            default=['integral', 'prime divisor', r'\frac', 'eigenvalue matrix'],
+            help='Search terms to time.',
+        )
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            rng = random.Random(options['seed'])
+            # A realistic vocabulary, so that the searched words are selective
+            self.words = MATH_WORDS + [
+                ''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(4, 10))) for _ in range(5000)
+            ]
+            self.seed(options['problems'], rng)
+            start = time.perf_counter()
+            search.rebuild()
+            self.stdout.write(f"Indexed {options['problems']} problems in {time.perf_counter() - start:.1f}s.")
+
+            # Top 20 is what the search page shows, the count is what the
+            # admin changelist computes for its search results.
+            self.stdout.write(
+                f"{'query':<24}{'matches':>9}{'fts top20':>11}{'like top20':>12}"
+                f"{'fts count':>11}{'like count':>12}   (ms)"
+            )
+            repeat = options['repeat']
+            for query in options['queries']:
+                fts = Problem.objects.filter(pk__in=search.matching_ids(query))
+                like = Problem.objects.all()
+                for term in query.split():
+                    like = like.filter(body__icontains=term)
+                self.stdout.write(
+                    f"{query:<24}{fts.count():>9}"
+                    f"{median_ms(lambda: search.search(query), repeat):>11.2f}"
+                    f"{median_ms(lambda: list(like[:20]), repeat):>12.2f}"
+                    f"{median_ms(fts.count, repeat):>11.2f}"
+                    f"{median_ms(like.count, repeat):>12.2f}"
+                )
+
+    def seed(self, count, rng):
+        self.stdout.write(f'Seeding {count} problems...')
+        batch_size = 5000
+        for start in range(0, count, batch_size):
+            problems = Problem.objects.bulk_create([
+                Problem(body=f"<p>{' '.join(rng.choices(self.words, k=20))} {rng.choice(LATEX)}</p>")
+                for _ in range(min(batch_size, count - start))
+            ])
+            Hint.objects.bulk_create([
+                Hint(problem=problem, body=f"<p>{' '.join(rng.choices(self.words, k=8))}</p>") for problem in problems
+            ])
+            Solution.objects.bulk_create([
+                Solution(problem=problem, body=f"<p>{' '.join(rng.choices(self.words, k=30))}</p>") for problem in problems
+            ])
@@ -0,0 +1,203 @@
+import io
+import json
+import platform
+import sqlite3
+import statistics
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from problems.benchmarks import (
+    invalidate_cached_pages, last_problem_list_page_url, peak_memory_kb, percentile, throwaway_database,
+)
+from problems.models import Deck, Problem
+
+# Per view: the most queries a request may run, and its median latency in
+# ms. Query budgets do not depend on the dataset size: a view whose query
+# count grows with the data has an N+1 problem.
+BUDGETS = {
+    'problem-list': {'queries': 2, 'median_ms': 100},
+    'problem-list-last-page': {'queries': 2, 'median_ms': 150},
+    'problem-detail': {'queries': 2, 'median_ms': 50},
+    # The deck pages read their validators before rendering
+    'deck-list': {'queries': 3, 'median_ms': 50},
+    'deck-detail': {'queries': 5, 'median_ms': 100},
+    'deck-practice-step': {'queries': 8, 'median_ms': 50},
+    'admin-problem-changelist': {'queries': 8, 'median_ms': 300},
+    'admin-deck-changelist': {'queries': 8, 'median_ms': 150},
+    'admin-booksource-changelist': {'queries': 8, 'median_ms': 150},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds throwaway databases of several sizes with generate_problems and '
+        'measures the main views through the test client: median and p90 wall '
+        'time, queries and peak memory per request. Results can be written as '
+        'JSON to compare runs; the command fails when a view exceeds its budget. '
+        'Cached pages are measured as rendered after a change, not read from the '
+        'cache. The configured database is not touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000',
+            help='Comma-separated numbers of problems, e.g. 1000,100000,1000000.',
+        )
+        parser.add_argument('--attempts-per-problem', type=int, default=2)
+        parser.add_argument('--repeat', type=int, default=10, help='Requests timed per view.')
+        parser.add_argument('--steps', type=int, default=20, help='Deck practice steps timed.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--budgets', help='JSON file of budgets overriding the defaults, by view.')
+
+    def handle(self, *args, **options):
+        budgets = {view: dict(budget) for view, budget in BUDGETS.items()}
+        if options['budgets']:
+            with open(options['budgets']) as f:
+                for view, budget in json.load(f).items():
+                    budgets.setdefault(view, {}).update(budget)
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f"Invalid --sizes: {options['sizes']!r}")
+
+        results = []
+        with throwaway_database():
+            for size in sizes:
+                self.seed(size, options)
+                self.stdout.write(f"{'view':<30}{'median':>9}{'p90':>9}{'queries':>9}{'peak KB':>10}   (ms)")
+                for view, timings, queries, peak_kb in self.measure_all(options):
+                    budget = budgets.get(view, {})
+                    result = {
+                        'size': size,
+                        'view': view,
+                        'median_ms': round(statistics.median(timings), 3),
+                        'p90_ms': round(percentile(timings, 0.9), 3),
+                        'queries': queries,
+                        'peak_kb': round(peak_kb, 1),
+                        'budget': budget,
+                    }
+                    result['over_budget'] = [
+                        key for key, limit in budget.items() if result[key] > limit
+                    ]
+                    results.append(result)
+                    self.stdout.write(
+                        f"{view:<30}{result['median_ms']:>9.2f}{result['p90_ms']:>9.2f}"
+                        f"{queries:>9}{peak_kb:>10.0f}"
+                        + (self.style.ERROR(f"   over budget: {', '.join(result['over_budget'])}")
+                           if result['over_budget'] else '')
+                    )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'environment': self.environment(options), 'results': results}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        failures = [f"{r['view']} ({r['size']} problems)" for r in results if r['over_budget']]
+        if failures:
+            raise CommandError(f"Over budget: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('All views within budget.'))
+
+    def environment(self, options):
+        return {
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'sqlite': sqlite3.sqlite_version if connection.vendor == 'sqlite' else None,
+            'repeat': options['repeat'],
+            'steps': options['steps'],
+            'seed': options['seed'],
+            'attempts_per_problem': options['attempts_per_problem'],
+        }
+
+    def seed(self, size, options):
+        self.stdout.write(f'Seeding {size} problems...')
+        start = time.perf_counter()
+        call_command(
+            'generate_problems',
+            problems=size,
+            attempts=size * options['attempts_per_problem'],
+            tags=max(9, size // 500),
+            decks=max(3, min(100, size // 1000)),
+            seed=options['seed'],
+            stdout=io.StringIO(),
+        )
+        if not User.objects.filter(username='benchmark').exists():
+            User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+        self.stdout.write(f'  seeded in {time.perf_counter() - start:.1f}s')
+
+    def urls(self):
+        """
+        Returns the (view, url) pairs measured with plain GETs.
+        """
+        problem_ids = Problem.objects.order_by('pk').values_list('pk', flat=True)
+        deck = Deck.objects.with_problem_count().order_by('-problem_count', 'pk').first()
+        return [
+            ('problem-list', reverse('problems:problem-list')),
+            ('problem-list-last-page', last_problem_list_page_url()),
+            ('problem-detail', reverse('problems:problem-detail', args=[problem_ids[problem_ids.count() // 2]])),
+            ('deck-list', reverse('problems:deck-list')),
+            ('deck-detail', reverse('problems:deck-detail', args=[deck.pk])),
+            ('admin-problem-changelist', reverse('admin:problems_problem_changelist')),
+            ('admin-deck-changelist', reverse('admin:problems_deck_changelist')),
+            ('admin-booksource-changelist', reverse('admin:problems_booksource_changelist')),
+        ]
+
+    def measure_all(self, options):
+        """
+        Yields (view, timings in ms, queries, peak KB) for every view.
+        """
+        client = Client()
+        client.force_login(User.objects.get(username='benchmark'))
+        for view, url in self.urls():
+            yield (view, *self.measure(client, url, options['repeat']))
+        yield ('deck-practice-step', *self.step_through(client, options['steps']))
+
+    def measure(self, client, url, repeat):
+        def get():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"GET {url} returned {response.status_code}")
+
+        # The first request warms the caches, as in a running server, but
+        # for the cached pages, which would be measured reading the cache
+        get()
+        timings, queries = [], 0
+        for _ in range(repeat):
+            invalidate_cached_pages()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                get()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(captured))
+        invalidate_cached_pages()
+        return timings, queries, peak_memory_kb(get)
+
+    def step_through(self, client, steps):
+        """
+        Skips through the largest deck, timing the Skip POST and the GET it
+        redirects to; queries and memory are those of the GET.
+        """
+        deck = Deck.objects.with_problem_count().order_by('-problem_count', 'pk').first()
+        url = reverse('problems:deck-practice', args=[deck.pk])
+        client.get(url)
+        timings, queries = [], 0
+        for _ in range(steps):
+            start = time.perf_counter()
+            response = client.post(url, {'skip_problem': ''})
+            if response.url != url:
+                break
+            with CaptureQueriesContext(connection) as captured:
+                client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(captured))
+        client.post(url, {'skip_problem': ''})
+        return timings, queries, peak_memory_kb(lambda: client.get(url))
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from problems import uploads
+from problems.models import Hint, Problem, Solution
+
+class Command(BaseCommand):
+    help = (
+        'Moves the images uploaded before content-addressed storage to names '
+        'derived from their content, so that duplicates share a single file, '
+        'and rewrites the problems, hints and solutions referencing them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report without changing anything.')
+
+    def handle(self, *args, **options):
+        renamed, targets, freed = {}, set(), 0
+        # Older uploads were stored at the root of the storage
+        for name in self.walk(''):
+            if uploads.is_content_name(name):
+                continue
+            with default_storage.open(name) as f:
+                extension = uploads.image_extension(f)
+                if extension is None:
+                    continue
+                target = uploads.content_name(uploads.file_digest(f), extension)
+                if target in targets or default_storage.exists(target):
+                    freed += default_storage.size(name)
+                elif not options['dry_run']:
+                    default_storage.save(target, f)
+            renamed[name] = target
+            targets.add(target)
+            self.stdout.write(f'  {name} -> {target}')
+
+        if options['dry_run']:
+            self.stdout.write(f'Would move {len(renamed)} images, freeing {freed / 1024:.0f} KB.')
+            return
+        with transaction.atomic():
+            updated = self.rewrite_references(renamed)
+        for name in renamed:
+            default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {len(renamed)} images, freed {freed / 1024:.0f} KB and updated {updated} bodies.'
+        ))
+
+    def walk(self, directory):
+        directories, files = default_storage.listdir(directory)
+        prefix = f'{directory}/' if directory else ''
+        for file_name in files:
+            yield prefix + file_name
+        for subdirectory in directories:
+            yield from self.walk(prefix + subdirectory)
+
+    def rewrite_references(self, renamed):
+        """
+        Points the bodies at the new names. Saving re-renders them and lets
+        the signal receivers update the derived data.
+        """
+        urls = {default_storage.url(old): default_storage.url(new) for old, new in renamed.items()}
+        updated = 0
+        for model in (Problem, Hint, Solution):
+            # Listed first: the rows change while going through them
+            for obj in list(model.objects.filter(body__contains=settings.MEDIA_URL)):
+                body = obj.body
+                for old, new in urls.items():
+                    body = body.replace(f'"{old}"', f'"{new}"')
+                if body != obj.body:
+                    obj.body = body
+                    obj.save()
+                    updated += 1
+        return updated
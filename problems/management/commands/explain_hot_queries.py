@@ -0,0 +1,154 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from problems import membership
+from problems.benchmarks import invalidate_cached_pages, last_problem_list_page_url
+from problems.models import Deck, Problem
+
+# Tables that stay small whatever the size of the problem bank: scanning or
+# sorting them is not worth an index
+SMALL_TABLES = {'problems_deck', 'problems_decktagfilter', 'problems_booksource', 'taggit_tag'}
+
+# Findings known and accepted, by (view, start of the plan line), with why
+ACCEPTED = {
+    ('problem-list', 'SCAN problems_problem USING COVERING INDEX'):
+        'The approximate count of the paginator, cached between requests.',
+    ('problem-search', 'USE TEMP B-TREE FOR ORDER BY'):
+        'Ranking the full-text matches by relevance.',
+    ('deck-detail', 'USE TEMP B-TREE FOR ORDER BY'):
+        "Sorting the deck's problems by date for the preview, "
+        'proportional to the size of the deck.',
+    ('admin-problem-changelist', 'SCAN problems_problem USING COVERING INDEX'):
+        'The result count of the changelist.',
+    ('admin-problem-changelist', 'USE TEMP B-TREE FOR DISTINCT'):
+        "taggit's prefetch of the tags of the page's problems.",
+}
+
+_TABLE_PATTERN = re.compile(r'^(?:SCAN|SEARCH) (\w+)')
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the queries of the hot views and write paths against the current "
+        "database, inside a transaction rolled back at the end, and explains "
+        "each with EXPLAIN QUERY PLAN. Flags full scans and temporary B-trees "
+        "(sorts) outside small tables and the findings in ACCEPTED; fails when "
+        "any is flagged. SQLite only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Show the plan of every query.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN is SQLite-specific.')
+        if not Problem.objects.exists() or not Deck.objects.exists():
+            raise CommandError('There are no problems or decks to run the views on.')
+
+        # On an empty cache, so that the pages cached before are queried
+        empty_cache = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'explain_hot_queries',
+        }}
+        with transaction.atomic(), override_settings(CACHES=empty_cache):
+            flagged = []
+            for view, queries in self.run_views():
+                for sql, params in queries:
+                    plan = self.explain(sql, params)
+                    findings = self.findings(view, sql, plan)
+                    if findings or options['all']:
+                        self.report(view, sql, plan, findings)
+                    flagged += [(view, line) for line, reason in findings if reason is None]
+            transaction.set_rollback(True)
+
+        if flagged:
+            raise CommandError(
+                'Unaccepted query plans: ' + '; '.join(f'{view}: {line}' for view, line in flagged)
+            )
+        self.stdout.write(self.style.SUCCESS('No unaccepted scans or sorts.'))
+
+    def run_views(self):
+        """
+        Yields (view, [(sql, params)]) with the statements each view ran.
+        """
+        user = User.objects.create_superuser('explain_hot_queries', 'explain@example.com', None)
+        client = Client()
+        client.force_login(user)
+        problem = Problem.objects.order_by('pk')[Problem.objects.count() // 2]
+        deck = Deck.objects.with_problem_count().order_by('-problem_count', 'pk').first()
+        practice_url = reverse('problems:deck-practice', args=[deck.pk])
+        last_page_url = last_problem_list_page_url()
+        views = [
+            ('problem-list', lambda: client.get(reverse('problems:problem-list'))),
+            ('problem-list-last-page', lambda: client.get(last_page_url)),
+            ('problem-detail', lambda: client.get(reverse('problems:problem-detail', args=[problem.pk]))),
+            ('problem-search', lambda: client.get(f"{reverse('problems:problem-search')}?q=proof")),
+            ('deck-list', lambda: client.get(reverse('problems:deck-list'))),
+            ('deck-detail', lambda: client.get(reverse('problems:deck-detail', args=[deck.pk]))),
+            ('deck-practice', lambda: client.get(practice_url)),
+            ('deck-practice-start', lambda: client.post(practice_url, {'start_attempt': ''})),
+            ('deck-practice-finish', lambda: client.post(practice_url, {'finish_attempt': ''})),
+            ('deck-review', lambda: client.get(reverse('problems:deck-review', args=[deck.pk]))),
+            ('practice-card', lambda: client.get(reverse('problems:practice-card', args=[problem.pk]))),
+            ('attempt-stats', lambda: client.get(reverse('problems:attempt-stats'))),
+            ('admin-problem-changelist', lambda: client.get(reverse('admin:problems_problem_changelist'))),
+            ('admin-deck-changelist', lambda: client.get(reverse('admin:problems_deck_changelist'))),
+            ('deck-rebuild', lambda: membership.rebuild_deck(deck)),
+        ]
+        for view, run in views:
+            queries = []
+
+            def record(execute, sql, params, many, context):
+                if not many and sql.lstrip().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    queries.append((sql, params))
+                return execute(sql, params, many, context)
+
+            # Rendered, not read from the page cache
+            invalidate_cached_pages()
+            with connection.execute_wrapper(record):
+                run()
+            yield view, queries
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[3] for row in cursor.fetchall()]
+
+    def findings(self, view, sql, plan):
+        """
+        Returns the (plan line, accepted reason or None) of the full scans
+        and sorts of a plan. Index walks stopped early by a LIMIT are fine,
+        unless the rows are sorted afterwards: the walk then reads them all.
+        """
+        tables = {match.group(1) for line in plan if (match := _TABLE_PATTERN.match(line))}
+        sorted_afterwards = any('TEMP B-TREE' in line for line in plan)
+        findings = []
+        for line in plan:
+            if line.startswith('SCAN '):
+                table = _TABLE_PATTERN.match(line).group(1)
+                if table in SMALL_TABLES or 'VIRTUAL TABLE' in line:
+                    continue
+                if ' INDEX ' in line and ' LIMIT ' in sql and not sorted_afterwards:
+                    continue
+            elif 'TEMP B-TREE' in line:
+                if tables <= SMALL_TABLES:
+                    continue
+            else:
+                continue
+            reason = next((reason for (v, prefix), reason in ACCEPTED.items()
+                           if v == view and line.startswith(prefix)), None)
+            findings.append((line, reason))
+        return findings
+
+    def report(self, view, sql, plan, findings):
+        self.stdout.write(f'{view}: {sql[:120]}')
+        for line in plan:
+            self.stdout.write(f'    {line}')
+        for line, reason in findings:
+            if reason is None:
+                self.stdout.write(self.style.ERROR(f'  ! {line}'))
+            else:
+                self.stdout.write(f'  accepted: {line} ({reason})')
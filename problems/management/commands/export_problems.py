@@ -0,0 +1,46 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from problems import exporting
+
+class Command(BaseCommand):
+    help = (
+        'Exports every problem with its hints, solutions, tags, book source and '
+        'attempt statistics as JSONL, streamed a chunk at a time. With --images, '
+        'writes a zip archive that also holds the uploaded images the problems '
+        'reference. import_problems reads both back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for standard output.')
+        parser.add_argument(
+            '--images', action='store_true',
+            help='Write a zip archive including the referenced images.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=exporting.CHUNK_SIZE,
+            help='Problems read per query.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if options['images'] and path == '-':
+            raise CommandError('Archives cannot be written to standard output.')
+
+        start = time.perf_counter()
+        if options['images']:
+            with open(path, 'wb') as f:
+                for data in exporting.archive_chunks(options['chunk_size']):
+                    f.write(data)
+        else:
+            stream = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+            try:
+                for record in exporting.export_records(options['chunk_size']):
+                    stream.write(exporting.to_jsonl(record))
+            finally:
+                if stream is not sys.stdout:
+                    stream.close()
+        if path != '-':
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(f'Exported the problems to {path} in {elapsed:.1f}s.'))
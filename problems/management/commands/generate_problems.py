@@ -1,105 +1,229 @@
+import math
 import random
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
-from problems.models import Problem, Solution, Hint, Deck, DeckTagFilter, BookSource
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+from problems import analytics, fragments, membership, scheduling, search, stats
+from problems.models import (
+    Attempt, BookSource, Deck, DeckMembership, DeckTagFilter, Hint, Problem, ProblemStats,
+    ReviewSchedule, Solution, TaggedProblem, TimeSketch,
+)
+from problems.rendering import body_hash, render_body
+from problems.tag_index import index as tag_index
 from taggit.models import Tag
 
+# Sample LaTeX expressions for problem bodies
+LATEX_EXPRESSIONS = [
+    r"Solve for \(x\): \(ax^2 + bx + c = 0\). The solution is given by the quadratic formula: \[x = \frac{-b \pm \sqrt{b^2-4ac}}{2a}\]",
+    r"What is the value of the integral \(\int_{0}^{\infty} e^{-x^2} dx\)? This is the Gaussian integral, and its value is \(\frac{\sqrt{\pi}}{2}\).",
+    r"Prove Euler's identity: \(e^{i\pi} + 1 = 0\). This beautiful equation connects five fundamental mathematical constants.",
+    r"Find the derivative of \(f(x) = \sin(x^2)\). Using the chain rule, we get \(f'(x) = \cos(x^2) \cdot 2x\).",
+    r"What is the statement of the Pythagorean theorem? For a right-angled triangle with sides a, b, and hypotenuse c, it is \(a^2 + b^2 = c^2\).",
+    r"Calculate the limit: \(\lim_{x \to 0} \frac{\sin(x)}{x}\). This fundamental limit in calculus is equal to 1.",
+    r"The Fourier Transform of a function \(f(t)\) is given by \[\hat{f}(\omega) = \int_{-\infty}^{\infty} f(t) e^{-i\omega t} dt\]"
+]
+SUBJECTS = ['Algebra', 'Calculus', 'Geometry']
+DIFFICULTIES = ['Easy', 'Medium', 'Hard']
+PROBLEM_TYPES = ['Proof', 'Calculation', 'Theory']
+DECK_CONFIGS = [
+    {'name': 'Easy Calculus', 'include': ['Easy', 'Calculus'], 'exclude': ['Geometry']},
+    {'name': 'Hard Problems', 'include': ['Hard'], 'exclude': []},
+    {'name': 'All except Algebra', 'include': [], 'exclude': ['Algebra']},
+]
+# Tables emptied before generating, children first
+TABLES = [
+    Attempt, ProblemStats, TimeSketch, ReviewSchedule, DeckMembership, DeckTagFilter, Deck,
+    TaggedProblem, Hint, Solution, Problem, BookSource, Tag,
+]
+# Generated text is drawn from pools of Faker sentences, rendered once
+POOL_SIZE = 2000
+
 class Command(BaseCommand):
-    help = 'Generates sample problems, solutions, hints, tags, and decks.'
+    help = (
+        'Generates a reproducible synthetic dataset of problems, solutions, hints, '
+        'tags, book sources, decks and attempts, replacing the existing data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--problems', type=int, default=50)
+        parser.add_argument('--tags', type=int, default=9, help='Total number of tags, at least 9.')
+        parser.add_argument('--decks', type=int, default=3, help='Total number of decks, at least 3.')
+        parser.add_argument('--attempts', type=int, default=0, help='Finished attempts, spread over the last year.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
 
     def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        self.batch_size = options['batch_size']
+
         # Clean up old data to prevent duplicates
-        self.stdout.write('Cleaning old data...')
-        Problem.objects.all().delete()
-        BookSource.objects.all().delete()
-        Solution.objects.all().delete()
-        Hint.objects.all().delete()
-        Deck.objects.all().delete()
-        DeckTagFilter.objects.all().delete()
-        Tag.objects.all().delete() # Must be last if tags are used in other models
+        self.step('Cleaning old data', self.wipe)
 
         self.stdout.write('Creating new data...')
+        with transaction.atomic():
+            self.step('Tags', self.create_tags, options['tags'])
+            self.step('Book sources', self.create_book_sources, max(3, options['problems'] // 1000))
+            self.step('Problems, hints and solutions', self.create_problems, options['problems'])
+            self.step('Decks', self.create_decks, options['decks'])
+            self.step('Attempts', self.create_attempts, options['attempts'])
 
-        # 1. Create Tags
-        subjects = ['Algebra', 'Calculus', 'Geometry']
-        difficulties = ['Easy', 'Medium', 'Hard']
-        problem_types = ['Proof', 'Calculation', 'Theory']
-        
-        for tag_list in [subjects, difficulties, problem_types]:
-            for tag_name in tag_list:
-                Tag.objects.create(name=tag_name)
-        self.stdout.write(f'  - Created {Tag.objects.count()} tags.')
-
-        # Sample LaTeX expressions for problem bodies
-        latex_expressions = [
-            r"Solve for \(x\): \(ax^2 + bx + c = 0\). The solution is given by the quadratic formula: \[x = \frac{-b \pm \sqrt{b^2-4ac}}{2a}\]",
-            r"What is the value of the integral \(\int_{0}^{\infty} e^{-x^2} dx\)? This is the Gaussian integral, and its value is \(\frac{\sqrt{\pi}}{2}\).",
-            r"Prove Euler's identity: \(e^{i\pi} + 1 = 0\). This beautiful equation connects five fundamental mathematical constants.",
-            r"Find the derivative of \(f(x) = \sin(x^2)\). Using the chain rule, we get \(f'(x) = \cos(x^2) \cdot 2x\).",
-            r"What is the statement of the Pythagorean theorem? For a right-angled triangle with sides a, b, and hypotenuse c, it is \(a^2 + b^2 = c^2\).",
-            r"Calculate the limit: \(\lim_{x \to 0} \frac{\sin(x)}{x}\). This fundamental limit in calculus is equal to 1.",
-            r"The Fourier Transform of a function \(f(t)\) is given by \[\hat{f}(\omega) = \int_{-\infty}^{\infty} f(t) e^{-i\omega t} dt\]"
-        ]
-        
-        # Pre-generate some book sources
-        book_sources = [
-            BookSource.objects.create(title="Calculus: Early Transcendentals", author="James Stewart"),
-            BookSource.objects.create(title="Linear Algebra and Its Applications", author="David C. Lay"),
-            BookSource.objects.create(title="Principles of Mathematical Analysis", author="Walter Rudin"),
-        ]
-        self.stdout.write(f'  - Created {len(book_sources)} book sources.')
-        
-        # 2. Create Problems
-        num_problems = 50
-        for i in range(num_problems):
-            subject = random.choice(subjects)
-            difficulty = random.choice(difficulties)
-            problem_type = random.choice(problem_types)
-            
-            # Randomly assign a book source and details
-            problem_data = {
-                'body': f"This is the body for a {difficulty} {subject} {problem_type} problem.\n\n{random.choice(latex_expressions)}"
-            }
-            if random.random() > 0.3: # 70% chance to have a book source
-                problem_data['book_source'] = random.choice(book_sources)
-                problem_data['page_number'] = random.randint(20, 500)
-                problem_data['problem_number'] = f"{random.randint(1, 15)}-{random.randint(1, 10)}"
-
-            problem = Problem.objects.create(
-                **problem_data
-            )
-            problem.tags.add(subject, difficulty, problem_type)
-
-            # Create 1 to 3 hints for each problem
-            for j in range(random.randint(1, 3)):
-                Hint.objects.create(problem=problem, body=f"This is hint #{j+1} for problem #{problem.pk}.")
-            # Create 1 or 2 solutions for each problem
-            for j in range(random.randint(1, 2)):
-                Solution.objects.create(problem=problem, body=f"This is a detailed solution ({j+1}) for problem #{problem.pk}.")
-
-        self.stdout.write(f'  - Created {num_problems} problems.')
-
-        # 3. Create Decks
-        deck_configs = [
-            {'name': 'Easy Calculus', 'include': ['Easy', 'Calculus'], 'exclude': ['Geometry']},
-            {'name': 'Hard Problems', 'include': ['Hard'], 'exclude': []},
-            {'name': 'All except Algebra', 'include': [], 'exclude': ['Algebra']},
-        ]
-
-        for config in deck_configs:
-            deck = Deck.objects.create(name=config['name'])
-            for tag_name in config['include']:
-                tag = Tag.objects.get(name=tag_name)
-                DeckTagFilter.objects.create(deck=deck, tag=tag, filter_type=DeckTagFilter.FilterType.INCLUDE)
-            for tag_name in config['exclude']:
-                tag = Tag.objects.get(name=tag_name)
-                DeckTagFilter.objects.create(deck=deck, tag=tag, filter_type=DeckTagFilter.FilterType.EXCLUDE)
-            
-            self.stdout.write(f"  - Created Deck '{deck.name}'")
-            problems = deck.problems
-            self.stdout.write(f"    Problems in deck ({problems.count()}):")
-            for problem in problems[:3]: # Show a few examples
-                self.stdout.write(f"    - Problem #{problem.pk} (Tags: {', '.join(t.name for t in problem.tags.all())})")
-            if problems.count() > 3:
-                self.stdout.write(f"    - ... and {problems.count() - 3} more.")
+        # The planner needs fresh statistics for the queries below
+        self.step('Planner statistics', self.analyze)
+        # Bulk inserts skip the signals: build the derived tables in one go
+        self.step('Deck memberships', lambda: transaction.atomic()(membership.rebuild_all)())
+        self.step('Search index', lambda: transaction.atomic()(search.rebuild)())
+        self.step('Attempt statistics', lambda: transaction.atomic()(stats.recompute)())
+        self.step('Attempt sketches', lambda: transaction.atomic()(analytics.backfill)())
+        self.step('Review schedules', scheduling.reschedule)
+        tag_index.clear()
 
+        for deck in Deck.objects.with_problem_count()[:10]:
+            self.stdout.write(f"  - Deck '{deck.name}': {deck.problem_count} problems")
         self.stdout.write(self.style.SUCCESS('Successfully generated sample data.'))
+
+    def step(self, label, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f'  - {label}: {time.perf_counter() - start:.1f}s')
+        return result
+
+    def wipe(self):
+        """
+        Empties the tables with the backend's flush statements (TRUNCATE
+        where available) instead of collecting cascades in memory.
+        """
+        tables = [model._meta.db_table for model in TABLES]
+        connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, reset_sequences=True))
+        search.clear()
+        cache.clear()
+
+    def analyze(self):
+        """
+        Without statistics SQLite walks the (very unselective) tag index for
+        every problem when matching the deck filters, which is quadratic.
+        """
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def create_tags(self, count):
+        names = SUBJECTS + DIFFICULTIES + PROBLEM_TYPES
+        # Tag.save() computes the slugs, bulk inserts have to
+        slugs = {Tag().slugify(name): name for name in names}
+        while len(slugs) < count:
+            name = ' '.join(self.fake.words(2)).title()
+            slugs.setdefault(Tag().slugify(name), name)
+        self.topic_names = list(slugs.values())[len(names):]
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slug) for slug, name in slugs.items()], batch_size=self.batch_size,
+        )
+        self.tag_ids = dict(Tag.objects.values_list('name', 'pk'))
+
+    def create_book_sources(self, count):
+        BookSource.objects.bulk_create(
+            [BookSource(title=f"{self.fake.catch_phrase()} ({i + 1})", author=self.fake.name()) for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        self.book_source_ids = list(BookSource.objects.values_list('pk', flat=True))
+
+    def pool(self, make):
+        """
+        Returns a list of (html, rendered html) pairs.
+        """
+        pool = []
+        for _ in range(POOL_SIZE):
+            html = make()
+            pool.append((html, render_body(html, {})))
+        return pool
+
+    def create_problems(self, count):
+        sentences = self.pool(lambda: f"<p>{self.fake.paragraph(nb_sentences=2)}</p>")
+        latex = [(f"<p>{expression}</p>", render_body(f"<p>{expression}</p>", {})) for expression in LATEX_EXPRESSIONS]
+        hints = self.pool(lambda: f"<p>{self.fake.sentence()}</p>")
+        solutions = self.pool(lambda: f"<p>{self.fake.paragraph(nb_sentences=4)}</p>")
+        now = timezone.now()
+
+        def rendered(model, parts, **fields):
+            body = ''.join(html for html, _ in parts)
+            # Sanitizing works tag by tag: the rendered parts add up
+            return model(body=body, body_html=''.join(html for _, html in parts), body_hash=body_hash(body), **fields)
+
+        for start in range(0, count, self.batch_size):
+            problems, tag_lists = [], []
+            for _ in range(min(self.batch_size, count - start)):
+                fields = {'pub_date': now - timedelta(seconds=self.rng.randrange(2 * 365 * 24 * 3600))}
+                if self.rng.random() > 0.3: # 70% chance to have a book source
+                    fields['book_source_id'] = self.rng.choice(self.book_source_ids)
+                    fields['page_number'] = self.rng.randint(20, 500)
+                    fields['problem_number'] = f"{self.rng.randint(1, 15)}-{self.rng.randint(1, 10)}"
+                problems.append(rendered(Problem, [self.rng.choice(sentences), self.rng.choice(latex)], **fields))
+                tags = [self.rng.choice(SUBJECTS), self.rng.choice(DIFFICULTIES), self.rng.choice(PROBLEM_TYPES)]
+                if self.topic_names:
+                    tags += self.rng.sample(self.topic_names, min(len(self.topic_names), self.rng.randint(0, 2)))
+                tag_lists.append(tags)
+            problems = Problem.objects.bulk_create(problems)
+            Hint.objects.bulk_create([
+                rendered(Hint, [self.rng.choice(hints)], problem=problem)
+                for problem in problems for _ in range(self.rng.randint(1, 3))
+            ])
+            Solution.objects.bulk_create([
+                rendered(Solution, [self.rng.choice(solutions)], problem=problem)
+                for problem in problems for _ in range(self.rng.randint(1, 2))
+            ])
+            TaggedProblem.objects.bulk_create([
+                TaggedProblem(content_object=problem, tag_id=self.tag_ids[name])
+                for problem, names in zip(problems, tag_lists) for name in names
+            ])
+            fragments.schedule_bump(fragments.PROBLEM_LIST)
+            self.stdout.write(f'    {start + len(problems)} problems', ending='\r')
+
+    def create_decks(self, count):
+        configs = list(DECK_CONFIGS)
+        while len(configs) < count:
+            include = self.rng.sample(self.topic_names or SUBJECTS, 1)
+            exclude = self.rng.sample(DIFFICULTIES, self.rng.randint(0, 1))
+            configs.append({'name': f"{include[0]} ({len(configs) + 1})", 'include': include, 'exclude': exclude})
+        decks = Deck.objects.bulk_create([Deck(name=config['name']) for config in configs])
+        DeckTagFilter.objects.bulk_create([
+            DeckTagFilter(deck=deck, tag_id=self.tag_ids[name], filter_type=filter_type)
+            for deck, config in zip(decks, configs)
+            for key, filter_type in (('include', DeckTagFilter.FilterType.INCLUDE), ('exclude', DeckTagFilter.FilterType.EXCLUDE))
+            for name in config[key]
+        ])
+        fragments.schedule_bump(fragments.DECK_LIST)
+
+    def create_attempts(self, count):
+        """
+        Inserts finished attempts with executemany: bulk_create would replace
+        their start times with the current time (auto_now_add).
+        """
+        ids = Problem.objects.order_by('pk').values_list('pk', flat=True)
+        if not count or not ids.exists():
+            return
+        first_id, last_id = ids.first(), ids.last()
+        fields = [Attempt._meta.get_field(name) for name in ('problem', 'start_time', 'end_time', 'time_taken')]
+        sql = (
+            f"INSERT INTO {connection.ops.quote_name(Attempt._meta.db_table)} "
+            f"({', '.join(connection.ops.quote_name(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))})"
+        )
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            for start in range(0, count, self.batch_size):
+                rows = []
+                for _ in range(min(self.batch_size, count - start)):
+                    # Log-normal solving times, around ten minutes
+                    time_taken = timedelta(seconds=min(6 * 3600, math.exp(self.rng.gauss(6.4, 0.8))))
+                    end_time = now - timedelta(seconds=self.rng.randrange(365 * 24 * 3600))
+                    values = (self.rng.randint(first_id, last_id), end_time - time_taken, end_time, time_taken)
+                    rows.append([field.get_db_prep_save(value, connection) for field, value in zip(fields, values)])
+                cursor.executemany(sql, rows)
+                self.stdout.write(f'    {start + len(rows)} attempts', ending='\r')
@@ -0,0 +1,57 @@
+import sys
+import time
+from functools import partial
+from zipfile import BadZipFile
+
+from django.core.management.base import BaseCommand, CommandError
+from problems import importing
+
+class Command(BaseCommand):
+    help = (
+        'Imports problems with their hints, solutions, tags and book sources from '
+        'a JSONL or CSV file, or an archive written by export_problems, in bulk. '
+        'Problems already present (same book source, page and problem number) are '
+        'skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input.')
+        parser.add_argument(
+            '--format', choices=sorted([*importing.READERS, 'zip']),
+            help='Input format. Guessed from the file extension by default.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=importing.BATCH_SIZE,
+            help='Problems written per batch.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format == 'zip':
+            if path == '-':
+                raise CommandError('Archives cannot be read from standard input.')
+            stream = open(path, 'rb')
+            run = partial(importing.import_archive, stream)
+        elif file_format in importing.READERS:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+            run = partial(importing.import_problems, importing.READERS[file_format](stream))
+        else:
+            raise CommandError('Cannot guess the format, pass --format jsonl, csv or zip.')
+
+        start = time.perf_counter()
+        try:
+            imported, skipped = run(
+                options['batch_size'],
+                progress=lambda imported, skipped: self.stdout.write(f'  {imported} problems', ending='\r'),
+            )
+        except (ValueError, KeyError, BadZipFile) as e:
+            raise CommandError(f'Invalid record: {e!r}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} problems ({skipped} duplicates skipped) in {elapsed:.1f}s, '
+            f'{imported / elapsed if elapsed else 0:.0f} problems/s.'
+        ))
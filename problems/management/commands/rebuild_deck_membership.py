@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from problems import membership
+from problems.models import Deck, DeckMembership
+
+class Command(BaseCommand):
+    help = 'Rebuilds the materialized deck membership table, or checks it against the live tag filters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare the table against the tag filters and report the differences.',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            self.check_table()
+            return
+
+        self.stdout.write('Rebuilding deck membership...')
+        with transaction.atomic():
+            membership.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {DeckMembership.objects.count()} memberships for {Deck.objects.count()} decks.'
+        ))
+
+    def check_table(self):
+        inconsistent = membership.check_consistency()
+        for deck in Deck.objects.filter(pk__in=inconsistent):
+            missing, extra = inconsistent[deck.pk]
+            self.stdout.write(
+                f"  - Deck '{deck.name}' (#{deck.pk}): {len(missing)} missing, {len(extra)} extra"
+            )
+        if inconsistent:
+            raise CommandError(
+                f'{len(inconsistent)} decks are out of sync, run rebuild_deck_membership to fix them.'
+            )
+        self.stdout.write(self.style.SUCCESS('Deck membership is consistent.'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from problems import search
+from problems.models import Problem
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of problems, hints and solutions.'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Full-text search needs an SQLite database with FTS5.')
+
+        self.stdout.write('Rebuilding the search index...')
+        start = time.perf_counter()
+        with transaction.atomic():
+            search.rebuild()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {Problem.objects.count()} problems in {elapsed:.1f}s.'
+        ))
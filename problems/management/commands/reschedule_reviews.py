@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from problems import scheduling
+from problems.models import ReviewSchedule
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the spaced repetition schedule of every problem by replaying '
+        'its finished attempts, in batches of one transaction each.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=scheduling.BATCH_SIZE,
+            help='Problems rescheduled per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rescheduling reviews...')
+        start = time.perf_counter()
+        total = scheduling.reschedule(
+            options['batch_size'],
+            progress=lambda n: self.stdout.write(f'  {n} problems', ending='\r'),
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Rescheduled {total} problems ({ReviewSchedule.objects.count()} reviewed) in {elapsed:.1f}s.'
+        ))
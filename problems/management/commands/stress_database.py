@@ -0,0 +1,135 @@
+import io
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.urls import reverse
+from problems.benchmarks import percentile, throwaway_database
+from problems.models import Deck, Problem
+
+# Database settings compared: Django's SQLite defaults (rollback journal,
+# deferred transactions, a connection per request) and the production ones
+PROFILES = {
+    'default': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}},
+    'production': settings.SQLITE_CONCURRENT,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs concurrent practice traffic against a throwaway SQLite database '
+        'file with each database profile: reader threads browse problems and '
+        'decks while writer threads start and finish attempts, which also saves '
+        'their sessions. Reports the throughput, latency and failed requests of '
+        'each. The configured database is not touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=10.0, help='Duration of each run.')
+        parser.add_argument('--problems', type=int, default=2000)
+        parser.add_argument(
+            '--profiles', default=','.join(PROFILES),
+            help=f"Comma-separated profiles to run, among {', '.join(PROFILES)}.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('The configured database is not SQLite; nothing to compare.')
+            return
+        self.stdout.write(
+            f"{'profile':<12}{'kind':<8}{'req/s':>8}{'median':>9}{'p90':>9}{'max':>9}{'failed':>8}   (ms)"
+        )
+        for profile in options['profiles'].split(','):
+            with tempfile.TemporaryDirectory() as directory, self.profile(PROFILES[profile], directory):
+                with throwaway_database():
+                    self.seed(options['problems'])
+                    results = self.run(options)
+            for kind, (timings, failures) in results.items():
+                self.stdout.write(
+                    f"{profile:<12}{kind:<8}{len(timings) / options['seconds']:>8.0f}"
+                    f"{statistics.median(timings) if timings else 0:>9.1f}"
+                    f"{percentile(timings, 0.9) if timings else 0:>9.1f}"
+                    f"{max(timings, default=0):>9.1f}{failures:>8}"
+                )
+
+    def profile(self, profile, directory):
+        """
+        Applies the settings of `profile` to the default database, whose
+        test database becomes a file in `directory`, as in-memory databases
+        cannot be shared between threads.
+        """
+        settings_dict = connection.settings_dict
+        saved = {key: settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS', 'OPTIONS', 'TEST')}
+
+        class Profile:
+            def __enter__(self):
+                settings_dict.update(profile)
+                settings_dict['TEST'] = {**saved['TEST'], 'NAME': os.path.join(directory, 'stress.sqlite3')}
+
+            def __exit__(self, *exc_info):
+                settings_dict.update(saved)
+
+        return Profile()
+
+    def seed(self, problems):
+        call_command(
+            'generate_problems', problems=problems, attempts=problems, decks=5, stdout=io.StringIO(),
+        )
+        close_old_connections()
+
+    def run(self, options):
+        problem_ids = list(Problem.objects.values_list('pk', flat=True))
+        deck_ids = list(Deck.objects.values_list('pk', flat=True))
+        connection.close()
+        stop = threading.Event()
+        results = {'read': ([], [0]), 'write': ([], [0])}
+
+        def read(client, rng):
+            if rng.random() < 0.8:
+                return client.get(reverse('problems:problem-detail', args=[rng.choice(problem_ids)]))
+            return client.get(reverse('problems:deck-detail', args=[rng.choice(deck_ids)]))
+
+        def write(client, rng):
+            url = reverse('problems:deck-practice', args=[rng.choice(deck_ids)])
+            client.post(url, {'start_attempt': ''})
+            return client.post(url, {'finish_attempt': ''})
+
+        def worker(kind, action, seed):
+            timings, failures = results[kind]
+            client, rng = Client(), random.Random(seed)
+            try:
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        action(client, rng)
+                    except Exception:
+                        failures[0] += 1
+                    else:
+                        timings.append((time.perf_counter() - start) * 1000)
+                    # The end of a request, as for a WSGI server
+                    close_old_connections()
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=('read', read, i)) for i in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=('write', write, -i - 1)) for i in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return {kind: (timings, failures[0]) for kind, (timings, failures) in results.items()}
@@ -0,0 +1,176 @@
+# palaistra/problems/media.py
+"""
+Serving of the uploaded media files.
+
+Behind nginx or Apache, `MEDIA_SENDFILE_HEADER` hands a file off to the
+front proxy (X-Accel-Redirect or X-Sendfile), which sends it itself, with
+its own conditional and range handling, so no worker is tied up copying
+bytes. Otherwise the file is sent from Django with an ETag and
+Last-Modified, answering conditional requests with 304 and single byte
+ranges with 206.
+
+Content-addressed uploads (see `problems.uploads`) never change, so they
+are cached for a year as immutable; other files are revalidated. Variants
+not generated yet redirect to their original image, uncached.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+# Django imports
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+# Local application imports
+from . import uploads
+
+IMMUTABLE_CACHE_CONTROL = f'public, max-age={365 * 24 * 60 * 60}, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+# Ranges are read from disk this many bytes at a time
+RANGE_BLOCK_SIZE = 64 * 1024
+
+_RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def media_path(name):
+    """
+    Returns the normalized name of a media file and its absolute path,
+    raising Http404 for names outside MEDIA_ROOT.
+    """
+    name = posixpath.normpath(name).lstrip('/')
+    try:
+        return name, safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid media path.')
+
+
+def _etag(name, immutable, file_stat):
+    if immutable:
+        # The name is the hash of the content
+        return '"%s"' % posixpath.splitext(posixpath.basename(name))[0]
+    return f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Returns the (start, end) byte positions, end inclusive, requested by a
+    single-range Range header, 'unsatisfiable' if none of them exists, or
+    None to send the whole file: without a header, with an invalid one or
+    with several ranges, which are not worth a multipart response here.
+    """
+    match = _RANGE_PATTERN.fullmatch(header.replace(' ', '')) if header else None
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # A suffix: the last bytes of the file
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(RANGE_BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _sendfile_response(name, path):
+    header = settings.MEDIA_SENDFILE_HEADER
+    response = HttpResponse(content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if header == 'X-Accel-Redirect':
+        response[header] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+    else:
+        response[header] = path
+    return response
+
+
+def _pending_variant_response(name, path):
+    """
+    Returns a redirect to the original of a variant that is not written
+    yet, or None.
+    """
+    if os.path.exists(path):
+        return None
+    original = uploads.original_name(name)
+    if original is None:
+        return None
+    response = HttpResponseRedirect(default_storage.url(original))
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def serve(request, name):
+    """
+    Returns the response for the media file `name`.
+    """
+    name, path = media_path(name)
+    if response := _pending_variant_response(name, path):
+        return response
+    immutable = uploads.is_content_name(name)
+    cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    if getattr(settings, 'MEDIA_SENDFILE_HEADER', None):
+        response = _sendfile_response(name, path)
+        response['Cache-Control'] = cache_control
+        return response
+
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        raise Http404('Media file not found.')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('Media file not found.')
+    size = file_stat.st_size
+    etag, last_modified = _etag(name, immutable, file_stat), int(file_stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        requested = parse_range(request.headers.get('Range'), size)
+        if requested is not None and not _if_range_matches(request, etag, last_modified):
+            requested = None
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if requested is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        elif requested == 'unsatisfiable':
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        else:
+            start, end = requested
+            response = StreamingHttpResponse(
+                _read_range(path, start, end - start + 1), status=206, content_type=content_type,
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,208 @@
+# palaistra/problems/membership.py
+"""
+Maintenance of the materialized `DeckMembership` table.
+
+Changes to tags and deck filters only schedule the problems and decks they
+affect; the table is updated once per transaction, after it commits, so an
+admin save touching many inline rows costs a single update.
+"""
+import threading
+from collections import defaultdict
+
+# Django imports
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Local application imports
+from . import fragments
+from .models import Deck, DeckMembership, DeckTagFilter, Problem, TaggedProblem
+from .scheduling import copy_due_dates
+
+BATCH_SIZE = 1000
+
+_pending = threading.local()
+
+
+def _pending_ids(name):
+    if not hasattr(_pending, name):
+        setattr(_pending, name, set())
+    return getattr(_pending, name)
+
+
+def _schedule(name, pk):
+    _pending_ids(name).add(pk)
+    # Every callback flushes whatever is pending, the later ones find
+    # nothing left to do.
+    transaction.on_commit(flush_pending)
+
+
+def schedule_problem_sync(problem_id):
+    _schedule('problem_ids', problem_id)
+
+
+def schedule_deck_rebuild(deck_id):
+    _schedule('deck_ids', deck_id)
+
+
+def flush_pending():
+    deck_ids = _pending_ids('deck_ids')
+    problem_ids = _pending_ids('problem_ids')
+    _pending.deck_ids, _pending.problem_ids = set(), set()
+    if not deck_ids and not problem_ids:
+        return
+
+    with transaction.atomic():
+        for deck in Deck.objects.filter(pk__in=deck_ids):
+            rebuild_deck(deck)
+        sync_problems(problem_ids)
+
+
+def load_deck_filters():
+    """
+    Returns a dict mapping every deck ID to its (include, exclude) tag ID sets.
+    """
+    filters = {pk: (set(), set()) for pk in Deck.objects.values_list('pk', flat=True)}
+    for deck_id, tag_id, filter_type in DeckTagFilter.objects.values_list('deck_id', 'tag_id', 'filter_type'):
+        include, exclude = filters[deck_id]
+        (include if filter_type == DeckTagFilter.FilterType.INCLUDE else exclude).add(tag_id)
+    return filters
+
+
+def matches(tag_ids, include, exclude):
+    """
+    Mirrors `Deck.match_problems` for a single problem's tag IDs.
+    """
+    return (not include or not include.isdisjoint(tag_ids)) and exclude.isdisjoint(tag_ids)
+
+
+def sync_problems(problem_ids, deck_filters=None):
+    """
+    Recomputes the deck memberships of the given problems. Problems that no
+    longer exist simply lose their memberships.
+    """
+    problem_ids = list(problem_ids)
+    if not problem_ids:
+        return
+    if deck_filters is None:
+        deck_filters = load_deck_filters()
+
+    for start in range(0, len(problem_ids), BATCH_SIZE):
+        batch = problem_ids[start:start + BATCH_SIZE]
+        tags = defaultdict(set)
+        for problem_id, tag_id in TaggedProblem.objects.filter(
+            content_object_id__in=batch
+        ).values_list('content_object_id', 'tag_id'):
+            tags[problem_id].add(tag_id)
+
+        wanted = {
+            (deck_id, problem_id)
+            for problem_id in Problem.objects.filter(pk__in=batch).values_list('pk', flat=True)
+            for deck_id, (include, exclude) in deck_filters.items()
+            if matches(tags[problem_id], include, exclude)
+        }
+        existing = dict(
+            ((deck_id, problem_id), pk)
+            for pk, deck_id, problem_id in DeckMembership.objects.filter(
+                problem_id__in=batch
+            ).values_list('pk', 'deck_id', 'problem_id')
+        )
+        _apply(wanted, existing)
+
+
+def rebuild_deck(deck):
+    """
+    Recomputes the memberships of a deck from its tag filters, writing only
+    the differences.
+    """
+    wanted = {(deck.pk, pk) for pk in deck.match_problems().values_list('pk', flat=True).iterator()}
+    existing = dict(
+        ((deck.pk, problem_id), pk)
+        for pk, problem_id in deck.memberships.values_list('pk', 'problem_id').iterator()
+    )
+    _apply(wanted, existing)
+
+
+def assign_positions(memberships):
+    """
+    Sets the positions of new memberships, reserving them on their decks.
+    """
+    by_deck = defaultdict(list)
+    for deck_membership in memberships:
+        by_deck[deck_membership.deck_id].append(deck_membership)
+    for deck_id, batch in by_deck.items():
+        with transaction.atomic():
+            Deck.objects.filter(pk=deck_id).update(next_position=F('next_position') + len(batch))
+            end = Deck.objects.filter(pk=deck_id).values_list('next_position', flat=True).get()
+        for position, deck_membership in enumerate(batch, start=end - len(batch)):
+            deck_membership.position = position
+
+
+def _apply(wanted, existing):
+    stale = [(key, pk) for key, pk in existing.items() if key not in wanted]
+    missing = wanted - existing.keys()
+    for start in range(0, len(stale), BATCH_SIZE):
+        DeckMembership.objects.filter(pk__in=[pk for _, pk in stale[start:start + BATCH_SIZE]]).delete()
+    created = [DeckMembership(deck_id=deck_id, problem_id=problem_id) for deck_id, problem_id in missing]
+    assign_positions(created)
+    DeckMembership.objects.bulk_create(created, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    # New memberships take the problem's due date
+    missing = list(missing)
+    for start in range(0, len(missing), BATCH_SIZE):
+        batch = missing[start:start + BATCH_SIZE]
+        copy_due_dates(DeckMembership.objects.filter(
+            deck_id__in={deck_id for deck_id, _ in batch},
+            problem_id__in={problem_id for _, problem_id in batch},
+            problem__schedule__isnull=False,
+        ))
+    changed_decks = {deck_id for (deck_id, _), _ in stale} | {deck_id for deck_id, _ in missing}
+    bump_versions(changed_decks)
+
+
+def bump_versions(deck_ids):
+    if deck_ids:
+        Deck.objects.filter(pk__in=deck_ids).update(
+            membership_version=F('membership_version') + 1, updated_at=timezone.now(),
+        )
+        # Their problem counts and previews
+        for deck_id in deck_ids:
+            fragments.schedule_bump(fragments.DECK, deck_id)
+        fragments.schedule_bump(fragments.DECK_LIST)
+
+
+def rebuild_all():
+    """
+    Wipes and refills the whole table from the tag filters, in bulk. The
+    positions start again from 0, dropping the gaps left by removals.
+    """
+    DeckMembership.objects.all().delete()
+    Deck.objects.update(
+        membership_version=F('membership_version') + 1, next_position=0, updated_at=timezone.now(),
+    )
+    for deck in Deck.objects.all():
+        fragments.schedule_bump(fragments.DECK, deck.pk)
+        batch, position = [], 0
+        for problem_id in deck.match_problems().values_list('pk', flat=True).iterator(chunk_size=BATCH_SIZE):
+            batch.append(DeckMembership(deck=deck, problem_id=problem_id, position=position))
+            position += 1
+            if len(batch) == BATCH_SIZE:
+                DeckMembership.objects.bulk_create(batch)
+                batch = []
+        DeckMembership.objects.bulk_create(batch)
+        Deck.objects.filter(pk=deck.pk).update(next_position=position)
+    copy_due_dates(DeckMembership.objects.filter(problem__schedule__isnull=False))
+    fragments.schedule_bump(fragments.DECK_LIST)
+
+
+def check_consistency():
+    """
+    Compares the table against the live tag filters. Returns a dict mapping
+    the ID of every inconsistent deck to its (missing, extra) problem ID sets.
+    """
+    inconsistent = {}
+    for deck in Deck.objects.all():
+        live = set(deck.match_problems().values_list('pk', flat=True).iterator())
+        stored = set(deck.memberships.values_list('problem_id', flat=True).iterator())
+        if live != stored:
+            inconsistent[deck.pk] = (live - stored, stored - live)
+    return inconsistent
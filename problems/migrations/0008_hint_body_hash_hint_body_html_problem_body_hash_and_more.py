@@ -0,0 +1,172 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:11
+
+import hashlib
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+from django.utils.html import format_html
+
+# Frozen copy of the body rendering of problems.links and problems.rendering,
+# so that later changes to those modules do not change what this migration
+# does.
+
+PROBLEM_LINK_PATTERN = re.compile(r'\[\[problem:(\d+)\]\]')
+SNIPPET_LENGTH = 30
+
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'hr', 'i', 'img', 'li', 'mark', 'ol', 'p', 'pre', 's', 'span',
+    'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'u',
+    'ul',
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+DROPPED_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+ALLOWED_ATTRIBUTES = {
+    '*': {'class', 'title'},
+    'a': {'href', 'target', 'rel'},
+    'img': {'src', 'alt', 'width', 'height', 'srcset', 'sizes'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+    'ol': {'start'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+_URL_IGNORED_CHARACTERS = re.compile(r'[\x00-\x20\x7f]+')
+
+
+def problem_snippet(body):
+    return (body[:SNIPPET_LENGTH] + '...') if len(body) > SNIPPET_LENGTH else body
+
+
+def replace_problem_links(text, snippets):
+    def replace_link(match):
+        problem_id = int(match.group(1))
+        if problem_id not in snippets:
+            return f"[[Invalid Problem ID: {problem_id}]]"
+        return format_html('<a href="{}">{}</a>', f'/problems/{problem_id}/', snippets[problem_id])
+
+    return PROBLEM_LINK_PATTERN.sub(replace_link, text)
+
+
+def is_safe_url(url):
+    return urlsplit(_URL_IGNORED_CHARACTERS.sub('', url)).scheme.lower() in ALLOWED_URL_SCHEMES
+
+
+class Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES['*'] | ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name == 'srcset':
+                candidates = [candidate.strip() for candidate in value.split(',') if candidate.strip()]
+                value = ', '.join(c for c in candidates if is_safe_url(c.split()[0]))
+                if not value:
+                    continue
+            elif name in URL_ATTRIBUTES and not is_safe_url(value):
+                continue
+            rendered.append(f' {name}="{escape(value)}"')
+        self.parts.append(f"<{tag}{''.join(rendered)}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.parts.append(f"</{self.open_tags.pop()}>")
+        return ''.join(self.parts)
+
+
+def render_body(body, snippets):
+    sanitizer = Sanitizer()
+    sanitizer.feed(replace_problem_links(body, snippets))
+    return sanitizer.close()
+
+
+def render_bodies(apps, schema_editor):
+    Problem = apps.get_model('problems', 'Problem')
+    snippets = {pk: problem_snippet(body) for pk, body in Problem.objects.values_list('pk', 'body')}
+    for model_name in ('Problem', 'Hint', 'Solution'):
+        model = apps.get_model('problems', model_name)
+        objects = list(model.objects.only('body'))
+        for obj in objects:
+            obj.body_html = render_body(obj.body, snippets)
+            obj.body_hash = hashlib.sha256(obj.body.encode('utf-8')).hexdigest()
+        model.objects.bulk_update(objects, ['body_html', 'body_hash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0007_problem_page_number_problem_problem_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hint',
+            name='body_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='hint',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='body_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='solution',
+            name='body_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='solution',
+            name='body_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(render_bodies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_memberships(apps, schema_editor):
+    Deck = apps.get_model('problems', 'Deck')
+    DeckMembership = apps.get_model('problems', 'DeckMembership')
+    DeckTagFilter = apps.get_model('problems', 'DeckTagFilter')
+    Problem = apps.get_model('problems', 'Problem')
+    for deck in Deck.objects.all():
+        filters = DeckTagFilter.objects.filter(deck=deck)
+        qs = Problem.objects.all()
+        include = [f.tag_id for f in filters if f.filter_type == 'INCLUDE']
+        if include:
+            qs = qs.filter(tags__in=include).distinct()
+        exclude = [f.tag_id for f in filters if f.filter_type == 'EXCLUDE']
+        if exclude:
+            qs = qs.exclude(tags__in=exclude)
+        DeckMembership.objects.bulk_create(
+            [DeckMembership(deck=deck, problem_id=pk) for pk in qs.values_list('pk', flat=True)],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0008_hint_body_hash_hint_body_html_problem_body_hash_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeckMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deck', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='problems.deck')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deck_memberships', to='problems.problem')),
+            ],
+            options={
+                'unique_together': {('deck', 'problem')},
+            },
+        ),
+        migrations.RunPython(fill_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0009_deckmembership'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='problem',
+            options={'ordering': ['-pub_date', '-id'], 'verbose_name': 'problem', 'verbose_name_plural': 'problems'},
+        ),
+        migrations.AddIndex(
+            model_name='problem',
+            index=models.Index(fields=['-pub_date', '-id'], name='problem_pub_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+from collections import defaultdict
+from html.parser import HTMLParser
+
+from django.db import migrations
+
+# Frozen copy of the table and text extraction of problems.search, so that
+# later changes to that module do not change what this migration does.
+SEARCH_TABLE = 'problems_problemsearch'
+CREATE_SEARCH_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+    "USING fts5(body, hints, solutions, tokenize = \"unicode61 tokenchars '\\'\")"
+)
+
+
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        self.parts.append(' ')
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def strip_html(html):
+    extractor = TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ' '.join(''.join(extractor.parts).split())
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Problem = apps.get_model('problems', 'Problem')
+    Hint = apps.get_model('problems', 'Hint')
+    Solution = apps.get_model('problems', 'Solution')
+
+    hints, solutions = defaultdict(list), defaultdict(list)
+    for problem_id, body in Hint.objects.values_list('problem_id', 'body'):
+        hints[problem_id].append(strip_html(body))
+    for problem_id, body in Solution.objects.values_list('problem_id', 'body'):
+        solutions[problem_id].append(strip_html(body))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_SEARCH_TABLE)
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, body, hints, solutions) VALUES (%s, %s, %s, %s)",
+            [
+                (pk, strip_html(body), '\n'.join(hints[pk]), '\n'.join(solutions[pk]))
+                for pk, body in Problem.objects.values_list('pk', 'body')
+            ],
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0010_alter_problem_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
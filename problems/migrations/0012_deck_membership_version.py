@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0011_problem_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='membership_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
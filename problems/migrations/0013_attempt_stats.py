@@ -0,0 +1,66 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:31
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+
+
+def close_duplicate_attempts(apps, schema_editor):
+    """
+    Keeps only the latest attempt in progress of each problem, which the new
+    constraint requires.
+    """
+    Attempt = apps.get_model('problems', 'Attempt')
+    open_attempts = Attempt.objects.filter(end_time__isnull=True)
+    duplicated = open_attempts.values('problem').annotate(n=Count('pk'), latest=Max('pk')).filter(n__gt=1)
+    for row in duplicated:
+        open_attempts.filter(problem=row['problem']).exclude(pk=row['latest']).delete()
+
+
+def fill_stats(apps, schema_editor):
+    Attempt = apps.get_model('problems', 'Attempt')
+    ProblemStats = apps.get_model('problems', 'ProblemStats')
+    finished = Q(end_time__isnull=False)
+    rows = Attempt.objects.order_by().values('problem_id').annotate(
+        attempt_count=Count('pk'),
+        completed_count=Count('pk', filter=finished),
+        total_time=Sum('time_taken', filter=finished),
+        min_time=Min('time_taken', filter=finished),
+        max_time=Max('time_taken', filter=finished),
+    )
+    ProblemStats.objects.bulk_create(
+        [ProblemStats(**{**row, 'total_time': row['total_time'] or datetime.timedelta(0)}) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0012_deck_membership_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemStats',
+            fields=[
+                ('problem', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='problems.problem')),
+                ('attempt_count', models.PositiveIntegerField(default=0)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('total_time', models.DurationField(default=datetime.timedelta(0))),
+                ('min_time', models.DurationField(blank=True, null=True)),
+                ('max_time', models.DurationField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'problem statistics',
+                'verbose_name_plural': 'problem statistics',
+            },
+        ),
+        migrations.RunPython(close_duplicate_attempts, migrations.RunPython.noop),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attempt',
+            constraint=models.UniqueConstraint(condition=models.Q(('end_time__isnull', True)), fields=('problem',), name='attempt_one_active_per_problem'),
+        ),
+    ]
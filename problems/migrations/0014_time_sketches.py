@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0013_attempt_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('all', 'All problems'), ('problem', 'Problem'), ('tag', 'Tag'), ('deck', 'Deck'), ('day', 'Day')], max_length=7)),
+                ('key', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('data', models.JSONField(default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', '-count'], name='timesketch_scope_count_idx')],
+                'unique_together': {('scope', 'key')},
+            },
+        ),
+    ]
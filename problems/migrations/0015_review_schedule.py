@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0014_time_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewSchedule',
+            fields=[
+                ('problem', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='schedule', serialize=False, to='problems.problem')),
+                ('ease', models.FloatField(default=2.5)),
+                ('interval', models.PositiveIntegerField(default=0, help_text='Days until the next review.')),
+                ('repetitions', models.PositiveIntegerField(default=0, help_text='Successful reviews in a row.')),
+                ('lapses', models.PositiveIntegerField(default=0)),
+                ('last_reviewed', models.DateTimeField(blank=True, null=True)),
+                ('next_due', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='grade',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Again'), (3, 'Hard'), (4, 'Good'), (5, 'Easy')], null=True),
+        ),
+        migrations.AddField(
+            model_name='deckmembership',
+            name='next_due',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='deckmembership',
+            index=models.Index(fields=['deck', 'next_due', 'problem'], name='membership_deck_due_idx'),
+        ),
+    ]
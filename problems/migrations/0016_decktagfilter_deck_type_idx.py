@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0015_review_schedule'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='decktagfilter',
+            index=models.Index(fields=['deck', 'filter_type', 'tag'], name='decktagfilter_deck_type_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0016_decktagfilter_deck_type_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='problemstats',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
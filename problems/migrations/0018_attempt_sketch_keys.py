@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0017_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='sketch_keys',
+            field=models.JSONField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:09
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of problems.links.PROBLEM_LINK_PATTERN
+PROBLEM_LINK_PATTERN = re.compile(r'\[\[problem:(\d+)\]\]')
+
+
+def store_links(apps, schema_editor):
+    ProblemLink = apps.get_model('problems', 'ProblemLink')
+    for model_name, source in (('Problem', None), ('Hint', 'hint_id'), ('Solution', 'solution_id')):
+        model = apps.get_model('problems', model_name)
+        owner = 'pk' if source is None else 'problem_id'
+        links = []
+        for obj in model.objects.filter(body__contains='[[problem:').only('body', owner).iterator():
+            fields = {'problem_id': getattr(obj, owner)}
+            if source is not None:
+                fields[source] = obj.pk
+            links += [
+                ProblemLink(target_id=target_id, **fields)
+                for target_id in {int(match) for match in PROBLEM_LINK_PATTERN.findall(obj.body)}
+            ]
+        ProblemLink.objects.bulk_create(links, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0018_attempt_sketch_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_id', models.PositiveIntegerField(db_index=True)),
+                ('hint', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='problems.hint')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outgoing_links', to='problems.problem')),
+                ('solution', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='problems.solution')),
+            ],
+        ),
+        migrations.RunPython(store_links, migrations.RunPython.noop),
+    ]
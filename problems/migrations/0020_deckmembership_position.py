@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+def number_memberships(apps, schema_editor):
+    Deck = apps.get_model('problems', 'Deck')
+    DeckMembership = apps.get_model('problems', 'DeckMembership')
+    for deck_id in Deck.objects.values_list('pk', flat=True):
+        memberships = list(DeckMembership.objects.filter(deck_id=deck_id).order_by('pk').only('pk'))
+        for position, deck_membership in enumerate(memberships):
+            deck_membership.position = position
+        DeckMembership.objects.bulk_update(memberships, ['position'], batch_size=500)
+        Deck.objects.filter(pk=deck_id).update(next_position=len(memberships))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problems', '0019_problemlink'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='next_position',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='deckmembership',
+            name='position',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_memberships, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='deckmembership',
+            index=models.Index(fields=['deck', 'position'], name='membership_deck_position_idx'),
+        ),
+    ]
@@ -1,5 +1,9 @@
+# Standard library imports
+from datetime import timedelta
+
 # Django imports
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
@@ -8,14 +12,72 @@ from taggit.managers import TaggableManager
 from taggit.models import Tag, TaggedItemBase
 
 # Create your models here.
+class RenderedBodyModel(models.Model):
+    """
+    Keeps `body_html`, the sanitized HTML served to readers, in sync with the
+    Tiptap HTML in `body`. It is rendered on save, and only when the body
+    actually changed.
+    """
+    body_html = models.TextField(blank=True, editable=False)
+    body_hash = models.CharField(max_length=64, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def render_body(self, snippets=None):
+        from .rendering import render_body
+        self.body_html = render_body(self.body, snippets)
+
+    def save(self, *args, **kwargs):
+        from .links import save_links
+        from .rendering import body_hash
+        new_hash = body_hash(self.body)
+        self.body_changed = new_hash != self.body_hash
+        if self.body_changed:
+            self.body_hash = new_hash
+            self.render_body()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'body_html', 'body_hash'}
+        super().save(*args, **kwargs)
+        if self.body_changed:
+            save_links([self])
+
 class TaggedProblem(TaggedItemBase):
     content_object = models.ForeignKey('Problem', on_delete=models.CASCADE)
 
-class Problem(models.Model):
+class ProblemQuerySet(models.QuerySet):
+    def with_attempt_count(self):
+        """
+        Annotates `attempt_count`, read from the problem's `ProblemStats` row
+        instead of counting its attempts.
+        """
+        return self.annotate(
+            attempt_count=Coalesce('stats__attempt_count', 0)
+        )
+
+    def touch(self):
+        """
+        Marks the problems as modified now, when something they show changed
+        without saving them.
+        """
+        return self.update(updated_at=timezone.now())
+
+    def last_modified(self, pk):
+        """
+        Returns the times a problem and its statistics were last modified,
+        for conditional requests, or None if it does not exist.
+        """
+        return self.filter(pk=pk).values_list('updated_at', 'stats__updated_at').first()
+
+class Problem(RenderedBodyModel):
     body = models.TextField()
     pub_date = models.DateTimeField("date published", default=timezone.now)
+    # Also touched when its hints, solutions or tags change
+    updated_at = models.DateTimeField(auto_now=True)
     tags = TaggableManager(through=TaggedProblem)
 
+    objects = ProblemQuerySet.as_manager()
+
     # Book Source Information
     book_source = models.ForeignKey(
         'BookSource',
@@ -28,7 +90,11 @@ class Problem(models.Model):
     class Meta:
         verbose_name = "problem"
         verbose_name_plural = "problems"
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            # Keyset pagination of the problem list
+            models.Index(fields=['-pub_date', '-id'], name='problem_pub_date_id_idx'),
+        ]
 
     def __str__(self):
         return (self.body[:75] + '...') if len(self.body) > 75 else self.body
@@ -45,29 +111,151 @@ class BookSource(models.Model):
         unique_together = ('title', 'author')
         ordering = ['title']
 
-class Solution(models.Model):
+class Solution(RenderedBodyModel):
     body = models.TextField()
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='solutions')
 
     def __str__(self):
         return f"Solution for Problem #{self.problem.pk}"
 
-class Hint(models.Model):
+class Hint(RenderedBodyModel):
     body = models.TextField()
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='hints')
 
     def __str__(self):
         return f"Hint for Problem #{self.problem.pk}"
 
+class ProblemLink(models.Model):
+    """
+    A [[problem:ID]] link in the body of a problem, or of one of its hints or
+    solutions, stored as the body is rendered (see `problems.links`). The
+    index on `target_id` finds the bodies to render again when the linked
+    problem changes.
+    """
+    # The problem whose body, or hint or solution, holds the link
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='outgoing_links')
+    hint = models.ForeignKey(Hint, on_delete=models.CASCADE, null=True, related_name='+')
+    solution = models.ForeignKey(Solution, on_delete=models.CASCADE, null=True, related_name='+')
+    # Not a foreign key: a link to a problem that does not exist is rendered
+    # again if a problem is created with that ID
+    target_id = models.PositiveIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"Link from Problem #{self.problem_id} to #{self.target_id}"
+
+class AttemptQuerySet(models.QuerySet):
+    def active(self):
+        """
+        Attempts in progress, looked up through the partial unique index on
+        open attempts.
+        """
+        return self.filter(end_time__isnull=True)
+
+    def active_for(self, problem_id):
+        """
+        Returns the attempt in progress on a problem, or None. There is at
+        most one, so unlike `first()` it does not order by ID, which made
+        SQLite sort the result of the index lookup.
+        """
+        return next(iter(self.active().filter(problem_id=problem_id)[:1]), None)
+
+    def start(self, problem_id):
+        """
+        Starts an attempt on a problem, unless one is already in progress.
+        Returns the attempt in progress.
+        """
+        try:
+            return self.create(problem_id=problem_id)
+        except IntegrityError:
+            # Another request started one first
+            return self.active().get(problem_id=problem_id)
+
 class Attempt(models.Model):
+    class Grade(models.IntegerChoices):
+        # SM-2 response qualities
+        AGAIN = 1, 'Again'
+        HARD = 3, 'Hard'
+        GOOD = 4, 'Good'
+        EASY = 5, 'Easy'
+
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='attempts')
     start_time = models.DateTimeField(auto_now_add=True)
     end_time = models.DateTimeField(null=True, blank=True)
     time_taken = models.DurationField(null=True, blank=True)
+    # How well it went, as graded when finishing it, if it was
+    grade = models.PositiveSmallIntegerField(choices=Grade.choices, null=True, blank=True)
+    # The [scope, key] of the tag and deck sketches it is counted in (see
+    # `problems.analytics`), None while it is not counted
+    sketch_keys = models.JSONField(null=True, editable=False)
+
+    objects = AttemptQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # At most one attempt in progress per problem
+            models.UniqueConstraint(
+                fields=['problem'],
+                condition=models.Q(end_time__isnull=True),
+                name='attempt_one_active_per_problem',
+            ),
+        ]
 
     def __str__(self):
         return f"Attempt for Problem #{self.problem.pk}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_state = instance.stats_state()
+        return instance
+
+    def stats_state(self):
+        """
+        What this attempt contributes to the statistics: when it finished
+        (None while in progress), and the time it took.
+        """
+        return (self.end_time, self.time_taken)
+
+    def finish(self, grade=None):
+        self.end_time = timezone.now()
+        self.time_taken = self.end_time - self.start_time
+        self.grade = grade
+        self.save()
+
+    def save(self, *args, **kwargs):
+        # The post_save receiver updating `ProblemStats` runs in the same
+        # transaction as the save
+        self.previous_state = None if self._state.adding else getattr(self, 'saved_state', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self.saved_state = self.stats_state()
+
+class ProblemStats(models.Model):
+    """
+    Aggregates of the attempts on a problem, kept up to date by the signal
+    receivers in `problems.signals` as attempts start, finish and are deleted.
+    """
+    problem = models.OneToOneField(Problem, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    attempt_count = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    total_time = models.DurationField(default=timedelta(0))
+    min_time = models.DurationField(null=True, blank=True)
+    max_time = models.DurationField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "problem statistics"
+        verbose_name_plural = "problem statistics"
+
+    def __str__(self):
+        return f"Statistics for Problem #{self.problem_id}"
+
+    @property
+    def mean_time(self):
+        if self.completed_count:
+            return self.total_time / self.completed_count
+        return None
+
 class DeckTagFilter(models.Model):
     class FilterType(models.TextChoices):
         INCLUDE = 'INCLUDE', 'Include'
@@ -83,10 +271,45 @@ class DeckTagFilter(models.Model):
 
     class Meta:
         unique_together = ('tag', 'deck') # A tag can only be used once per deck
+        indexes = [
+            # Covers reading a deck's filters, and its include or exclude tags
+            models.Index(fields=['deck', 'filter_type', 'tag'], name='decktagfilter_deck_type_idx'),
+        ]
+
+class DeckQuerySet(models.QuerySet):
+    def with_filters(self):
+        """
+        Prefetches the tag filters with their tags, for `include_tags` and
+        `exclude_tags`.
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'decktagfilter_set',
+                queryset=DeckTagFilter.objects.select_related('tag').order_by('tag__name'),
+            )
+        )
+
+    def with_problem_count(self):
+        return self.annotate(problem_count=models.Count('memberships'))
+
+    def touch(self):
+        """
+        Marks the decks as modified now, when their filters, problems or
+        the problems' statements changed.
+        """
+        return self.update(updated_at=timezone.now())
 
 class Deck(models.Model):
     name = models.CharField(max_length=200)
     tags = models.ManyToManyField(Tag, through=DeckTagFilter, related_name='decks', blank=True)
+    # Bumped whenever the deck's memberships change
+    membership_version = models.PositiveIntegerField(default=0, editable=False)
+    # Position of the next membership added to the deck
+    next_position = models.PositiveIntegerField(default=0, editable=False)
+    # Also touched when its filters, problems or their statements change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DeckQuerySet.as_manager()
 
     class Meta:
         ordering = ['name']
@@ -94,6 +317,18 @@ class Deck(models.Model):
     def __str__(self):
         return self.name 
 
+    @property
+    def include_tags(self):
+        """
+        Like `get_include_tags`, but served from the filters prefetched by
+        `DeckQuerySet.with_filters` when available.
+        """
+        return [f.tag for f in self.decktagfilter_set.all() if f.filter_type == DeckTagFilter.FilterType.INCLUDE]
+
+    @property
+    def exclude_tags(self):
+        return [f.tag for f in self.decktagfilter_set.all() if f.filter_type == DeckTagFilter.FilterType.EXCLUDE]
+
     def get_include_tags(self):
         return self.tags.filter(decktagfilter__filter_type=DeckTagFilter.FilterType.INCLUDE)
 
@@ -103,20 +338,116 @@ class Deck(models.Model):
     @property
     def problems(self):
         """
-        Returns a queryset of problems that match the deck's tag filters.
+        Returns a queryset of the problems in the deck, read from the
+        materialized `DeckMembership` table.
+        """
+        return Problem.objects.filter(deck_memberships__deck=self)
+
+    def problem_ids(self):
+        """
+        Returns the sorted IDs of the deck's problems, from the in-memory tag
+        index when it is enabled and from the membership table otherwise.
+        """
+        from .tag_index import deck_problem_ids
+        problem_ids = deck_problem_ids(self)
+        if problem_ids is None:
+            problem_ids = list(self.problems.order_by('pk').values_list('pk', flat=True))
+        return problem_ids
+
+    def match_problems(self):
+        """
+        Returns a queryset of problems that match the deck's tag filters,
+        evaluated against the live tags.
         - Must have ANY of the include_tags.
         - Must NOT have ANY of the exclude_tags.
         """
         qs = Problem.objects.all()
-        
-        include_tags = self.tags.filter(decktagfilter__filter_type=DeckTagFilter.FilterType.INCLUDE)
-        include_tag_names = [tag.name for tag in include_tags]
-        if include_tag_names:
-            qs = qs.filter(tags__name__in=include_tag_names).distinct()
-
-        exclude_tags = self.tags.filter(decktagfilter__filter_type=DeckTagFilter.FilterType.EXCLUDE)
-        exclude_tag_names = [tag.name for tag in exclude_tags]
-        if exclude_tag_names:
-            qs = qs.exclude(tags__name__in=exclude_tag_names)
-            
+
+        filters = DeckTagFilter.objects.filter(deck=self)
+        include_tag_ids = [f.tag_id for f in filters if f.filter_type == DeckTagFilter.FilterType.INCLUDE]
+        if include_tag_ids:
+            qs = qs.filter(tags__in=include_tag_ids).distinct()
+
+        exclude_tag_ids = [f.tag_id for f in filters if f.filter_type == DeckTagFilter.FilterType.EXCLUDE]
+        if exclude_tag_ids:
+            qs = qs.exclude(tags__in=exclude_tag_ids)
+
         return qs
+
+class DeckMembership(models.Model):
+    """
+    Materialized result of `Deck.match_problems`, kept up to date by the
+    signal receivers in `problems.signals` (see `problems.membership`).
+    """
+    deck = models.ForeignKey(Deck, on_delete=models.CASCADE, related_name='memberships')
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE, related_name='deck_memberships')
+    # Copy of the problem's `ReviewSchedule.next_due` (None until its first
+    # review), so that the due problems of a deck are an index range scan
+    next_due = models.DateTimeField(null=True, blank=True)
+    # Order in which the problem was added to the deck, from the deck's
+    # `next_position`. Positions are not reused, so removing a membership
+    # does not move the others (see `problems.practice`).
+    position = models.PositiveIntegerField(editable=False)
+
+    class Meta:
+        unique_together = ('deck', 'problem')
+        indexes = [
+            models.Index(fields=['deck', 'next_due', 'problem'], name='membership_deck_due_idx'),
+            models.Index(fields=['deck', 'position'], name='membership_deck_position_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.position is None:
+            from .membership import assign_positions
+            assign_positions([self])
+        super().save(*args, **kwargs)
+
+class ReviewSchedule(models.Model):
+    """
+    The SM-2 spaced repetition state of a problem, updated by
+    `problems.scheduling` as attempts on it finish.
+    """
+    problem = models.OneToOneField(Problem, on_delete=models.CASCADE, primary_key=True, related_name='schedule')
+    ease = models.FloatField(default=2.5)
+    interval = models.PositiveIntegerField(default=0, help_text="Days until the next review.")
+    repetitions = models.PositiveIntegerField(default=0, help_text="Successful reviews in a row.")
+    lapses = models.PositiveIntegerField(default=0)
+    last_reviewed = models.DateTimeField(null=True, blank=True)
+    next_due = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Schedule of Problem #{self.problem_id}"
+
+class TimeSketch(models.Model):
+    """
+    A `LogHistogram` of the times taken by the finished attempts of a
+    problem, a tag, a deck, a day or of every problem. Kept up to date by
+    `problems.analytics` as attempts finish.
+    """
+    class Scope(models.TextChoices):
+        ALL = 'all', 'All problems'
+        PROBLEM = 'problem', 'Problem'
+        TAG = 'tag', 'Tag'
+        DECK = 'deck', 'Deck'
+        DAY = 'day', 'Day'
+
+    scope = models.CharField(max_length=7, choices=Scope.choices)
+    # ID of the problem, tag or deck, the ordinal of the day, 0 for ALL
+    key = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    data = models.JSONField(default=dict)
+
+    class Meta:
+        unique_together = ('scope', 'key')
+        indexes = [
+            # The most attempted tags and decks of the stats page
+            models.Index(fields=['scope', '-count'], name='timesketch_scope_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_scope_display()} #{self.key}"
+
+    @property
+    def sketch(self):
+        from .sketches import LogHistogram
+        return LogHistogram.from_dict(self.data)
@@ -0,0 +1,132 @@
+# palaistra/problems/pagination.py
+"""
+Keyset (cursor) pagination over querysets ordered by `(-pub_date, -id)`.
+
+Instead of counting the rows and skipping an OFFSET, each page continues
+from the (pub_date, id) of the last row of the previous one, which the
+composite index on those columns turns into a range scan: every page costs
+the same as the first one.
+"""
+import base64
+import json
+
+# Django imports
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+APPROXIMATE_COUNT_TIMEOUT = 60 * 5
+
+
+def encode_cursor(obj, direction):
+    data = json.dumps({'d': direction, 'p': obj.pub_date.isoformat(), 'i': obj.pk})
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (direction, pub_date, id) encoded in a cursor, or None when
+    the cursor is missing or invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, pub_date, pk = data['d'], parse_datetime(data['p']), int(data['i'])
+    except (ValueError, TypeError, KeyError):
+        return None
+    if direction not in ('next', 'previous') or pub_date is None:
+        return None
+    return direction, pub_date, pk
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f"<KeysetPage of {len(self.object_list)} objects>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next:
+            return encode_cursor(self.object_list[-1], 'next')
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous:
+            return encode_cursor(self.object_list[0], 'previous')
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by (pub_date, id), newest first.
+
+    `approximate_count` is an optional total, cached for a few minutes
+    instead of counting the table on every request.
+    """
+    is_keyset = True
+
+    def __init__(self, queryset, per_page, count_cache_key=None):
+        self.queryset = queryset.order_by('-pub_date', '-pk')
+        self.per_page = int(per_page)
+        self.count_cache_key = count_cache_key
+
+    @property
+    def approximate_count(self):
+        if self.count_cache_key is None:
+            return None
+        count = cache.get(self.count_cache_key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(self.count_cache_key, count, APPROXIMATE_COUNT_TIMEOUT)
+        return count
+
+    def get_page(self, cursor=None):
+        """
+        Returns the page a cursor points to, or the first page when the
+        cursor is missing or invalid.
+        """
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            rows = list(self.queryset[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+
+        direction, pub_date, pk = decoded
+        if direction == 'next':
+            # Rows after the cursor, in the normal order
+            rows = list(
+                self.queryset.filter(pub_date__lte=pub_date)
+                .filter(Q(pub_date__lt=pub_date) | Q(pk__lt=pk))[:self.per_page + 1]
+            )
+            return KeysetPage(rows[:self.per_page], self, len(rows) > self.per_page, True)
+
+        # Rows before the cursor, walked backwards and put back in order
+        rows = list(
+            self.queryset.filter(pub_date__gte=pub_date)
+            .filter(Q(pub_date__gt=pub_date) | Q(pk__gt=pk))
+            .reverse()[:self.per_page + 1]
+        )
+        has_previous = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page][::-1], self, True, has_previous)
@@ -0,0 +1,219 @@
+# palaistra/problems/practice.py
+"""
+Deck practice sessions of constant size.
+
+Instead of storing the shuffled list of problem IDs, the session keeps the
+deck, how many membership positions it had when the session started (see
+`DeckMembership.position`), a random seed and a cursor. Step `i` of the
+session serves the membership at position `permute(i, span, seed)`, read
+through the deck's position index, so the order is never materialized.
+Positions are not reused, so problems leaving the deck do not move the
+others; they are skipped.
+
+Problems added to the deck during a session, whatever their ID, come after
+the shuffled ones, in the order they were added: past the span, the cursor
+is the position of the membership served.
+"""
+import hashlib
+import random
+import re
+
+# Django imports
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.template.loader import render_to_string
+
+# Local application imports
+from . import fragments
+from .models import Problem
+
+SESSION_KEY = 'practice'
+FEISTEL_ROUNDS = 4
+# Shuffled positions checked for membership per query
+LOOKAHEAD = 16
+
+CARD_CACHE_KEY = 'problems:practice-card:{}:{}'
+# Cards are cached under the version of their problem, which the receivers
+# in `problems.signals` bump when its statement, hints, solutions or attempts
+# change, for `fragments.TIMEOUT`. This is how long browsers may keep one.
+# 0 disables the cache.
+CARD_CACHE_TIMEOUT = getattr(settings, 'PRACTICE_CARD_CACHE_TIMEOUT', 120)
+
+_IMAGE_SRC_PATTERN = re.compile(r'<img[^>]*\ssrc="([^"]+)"')
+
+
+def _round(seed, round_number, value, bits):
+    digest = hashlib.blake2b(
+        f'{seed}:{round_number}:{value}'.encode(), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, 'little') & ((1 << bits) - 1)
+
+
+def permute(index, size, seed):
+    """
+    Maps `index` to its position in a pseudo-random permutation of
+    [0, size) determined by `seed`.
+
+    A balanced Feistel network is a bijection over [0, 4**k); values that
+    land outside [0, size) are fed through it again ("cycle walking") until
+    they land inside, which keeps it a bijection over [0, size).
+    """
+    if size <= 1:
+        return index
+    half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    value = index
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ _round(seed, round_number, right, half_bits)
+        value = (left << half_bits) | right
+        if value < size:
+            return value
+
+
+def render_card(problem_id):
+    """
+    Renders the practice card of a problem: its statement as shown before an
+    attempt, the full version with hints and solutions shown during one, and
+    the images both reference. Returns None if the problem does not exist.
+    """
+    problem = (
+        Problem.objects.with_attempt_count()
+        .prefetch_related('hints', 'solutions')
+        .filter(pk=problem_id)
+        .first()
+    )
+    if problem is None:
+        return None
+    full = render_to_string('problems/includes/problem_full.html', {'object': problem})
+    return {
+        'display': render_to_string('problems/includes/problem_display.html', {'object': problem}),
+        'full': full,
+        'images': list(dict.fromkeys(_IMAGE_SRC_PATTERN.findall(full))),
+    }
+
+
+def get_card(problem_id):
+    """
+    Returns the practice card of a problem from the cache, rendering and
+    caching it on a miss.
+    """
+    if not CARD_CACHE_TIMEOUT:
+        return render_card(problem_id)
+    key = _card_key(problem_id)
+    card = cache.get(key)
+    if card is None:
+        card = render_card(problem_id)
+        if card is not None:
+            cache.set(key, card, fragments.TIMEOUT)
+    return card
+
+
+def cached_card(problem_id):
+    """
+    Returns the practice card of a problem if it is cached, without rendering it.
+    """
+    return cache.get(_card_key(problem_id)) if CARD_CACHE_TIMEOUT else None
+
+
+def _card_key(problem_id):
+    return CARD_CACHE_KEY.format(problem_id, fragments.get_version(fragments.PROBLEM, problem_id))
+
+
+class PracticeSession:
+    def __init__(self, request, deck):
+        self.request = request
+        self.deck = deck
+        state = request.session.get(SESSION_KEY)
+        if not state or state['deck'] != deck.pk or 'span' not in state:
+            state = self.start()
+        self.state = state
+        self._total = None
+
+    def start(self):
+        members = self.deck.memberships.aggregate(last=Max('position'), size=Count('pk'))
+        state = {
+            'deck': self.deck.pk,
+            'version': self.deck.membership_version,
+            'seed': random.getrandbits(32),
+            'span': 0 if members['last'] is None else members['last'] + 1,
+            'size': members['size'],
+            'position': 0,
+            'cursor': 0,
+        }
+        self.request.session[SESSION_KEY] = state
+        return state
+
+    def end(self):
+        self.request.session.pop(SESSION_KEY, None)
+
+    def save(self):
+        self.request.session.modified = True
+
+    @property
+    def position(self):
+        return self.state['position']
+
+    @property
+    def total(self):
+        """
+        Number of problems in the session: the shuffled ones plus the ones
+        added to the deck since the session started.
+        """
+        if self._total is None:
+            self._total = self.state['size']
+            if self.state['version'] != self.deck.membership_version:
+                self._total += self.deck.memberships.filter(position__gte=self.state['span']).count()
+        return self._total
+
+    def find(self, cursor):
+        """
+        Returns the (cursor, problem ID) of the first problem still in the
+        deck at or after `cursor`, or None.
+        """
+        span, seed = self.state['span'], self.state['seed']
+        for start in range(cursor, span, LOOKAHEAD):
+            steps = {permute(step, span, seed): step for step in range(start, min(start + LOOKAHEAD, span))}
+            members = dict(
+                self.deck.memberships.filter(position__in=steps).values_list('position', 'problem_id')
+            )
+            found = [(steps[position], problem_id) for position, problem_id in members.items()]
+            if found:
+                return min(found)
+        if self.state['version'] == self.deck.membership_version:
+            return None
+        return (
+            self.deck.memberships.filter(position__gte=max(cursor, span))
+            .order_by('position').values_list('position', 'problem_id').first()
+        )
+
+    def next_problem_id(self):
+        """
+        Returns the ID of the problem the session moves to next, if any.
+        """
+        found = self.find(self.state['cursor'] + 1)
+        return None if found is None else found[1]
+
+    def current_problem_id(self):
+        """
+        Returns the ID of the problem at the cursor, moving it past problems
+        removed from the deck, or None when the session is over.
+        """
+        found = self.find(self.state['cursor'])
+        if found is None:
+            return None
+        if found[0] != self.state['cursor']:
+            self.state['cursor'] = found[0]
+            self.save()
+        return found[1]
+
+    def advance(self):
+        """
+        Moves to the next problem. Returns False when the session is over.
+        """
+        self.state['position'] += 1
+        self.state['cursor'] += 1
+        self.save()
+        return self.current_problem_id() is not None
@@ -0,0 +1,149 @@
+# palaistra/problems/rendering.py
+import hashlib
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+# Local application imports
+from .links import find_problem_ids, get_problem_snippets, linking_bodies, replace_problem_links
+from .models import Problem
+
+# Markup the Tiptap editor produces, everything else is dropped.
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'hr', 'i', 'img', 'li', 'mark', 'ol', 'p', 'pre', 's', 'span',
+    'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'u',
+    'ul',
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+# Elements dropped together with their content.
+DROPPED_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+ALLOWED_ATTRIBUTES = {
+    '*': {'class', 'title'},
+    'a': {'href', 'target', 'rel'},
+    'img': {'src', 'alt', 'width', 'height', 'srcset', 'sizes'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+    'ol': {'start'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+
+# Browsers ignore control characters and whitespace in a URL's scheme,
+# e.g. "java\tscript:"
+_URL_IGNORED_CHARACTERS = re.compile(r'[\x00-\x20\x7f]+')
+
+
+def is_safe_url(url):
+    return urlsplit(_URL_IGNORED_CHARACTERS.sub('', url)).scheme.lower() in ALLOWED_URL_SCHEMES
+
+
+def safe_srcset(srcset):
+    """
+    Returns the candidates of a `srcset` whose URL is safe, or None if none is.
+    """
+    candidates = [candidate.strip() for candidate in srcset.split(',') if candidate.strip()]
+    safe = [candidate for candidate in candidates if is_safe_url(candidate.split()[0])]
+    return ', '.join(safe) or None
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES['*'] | ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not is_safe_url(value):
+                continue
+            if name == 'srcset':
+                value = safe_srcset(value)
+                if value is None:
+                    continue
+            rendered.append(f' {name}="{escape(value)}"')
+        self.parts.append(f"<{tag}{''.join(rendered)}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # Close anything left open inside this element as well
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.parts.append(f"</{self.open_tags.pop()}>")
+        return ''.join(self.parts)
+
+
+def sanitize_html(html):
+    """
+    Returns `html` with every tag, attribute and URL scheme that is not
+    allowlisted removed. Text, including LaTeX, is kept as is.
+    """
+    sanitizer = _Sanitizer()
+    sanitizer.feed(html)
+    return sanitizer.close()
+
+
+def body_hash(body):
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def render_body(body, snippets=None):
+    """
+    Turns the HTML saved by the Tiptap editor into the HTML served to
+    readers: problem links are resolved and the markup sanitized.
+    """
+    if snippets is None:
+        snippets = get_problem_snippets(find_problem_ids(body))
+    return sanitize_html(replace_problem_links(body, snippets))
+
+
+def rerender_linking_bodies(problem_id):
+    """
+    Re-renders the stored HTML of every problem, hint and solution that links
+    to the given problem, found through the stored links, so the link text
+    (or its invalid marker) follows the linked problem. Uses `update()` so no
+    save signals cascade from it.
+    Returns the IDs of the problems re-rendered, or whose hints or solutions
+    were.
+    """
+    problem_ids = set()
+    for model, pks in linking_bodies(problem_id):
+        owner = 'pk' if model is Problem else 'problem_id'
+        for obj in model.objects.filter(pk__in=pks).only('body', owner).iterator():
+            obj.render_body()
+            model.objects.filter(pk=obj.pk).update(body_html=obj.body_html)
+            problem_ids.add(getattr(obj, owner))
+    return problem_ids
@@ -0,0 +1,177 @@
+# palaistra/problems/scheduling.py
+"""
+SM-2 spaced repetition over problems.
+
+Every finished attempt is a review of its problem: its grade (or, when it
+was not graded, one derived from how long it took compared to the usual
+time for the problem) moves the problem's `ReviewSchedule` forward. The
+resulting due date is copied onto the problem's deck memberships, so the
+due queue of a deck is read off the (deck, next_due) index.
+
+`reschedule` rebuilds the schedules by replaying the attempts, in batches.
+"""
+from datetime import timedelta
+
+# Django imports
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+# Local application imports
+from .models import Attempt, DeckMembership, Problem, ProblemStats, ReviewSchedule
+
+Grade = Attempt.Grade
+MIN_EASE = 1.3
+# Intervals stop growing at a hundred years, well within the date range
+MAX_INTERVAL = 36500
+BATCH_SIZE = 1000
+# How long a skipped problem stays out of the due queue
+SKIP_DELAY = timedelta(minutes=10)
+
+
+def next_state(schedule, grade, reviewed_at):
+    """
+    Applies one SM-2 review of quality `grade` to `schedule` (in place).
+    """
+    if grade < Grade.HARD:
+        schedule.repetitions = 0
+        schedule.interval = 1
+        if schedule.last_reviewed is not None:
+            schedule.lapses += 1
+    else:
+        if schedule.repetitions == 0:
+            schedule.interval = 1
+        elif schedule.repetitions == 1:
+            schedule.interval = 6
+        else:
+            schedule.interval = min(MAX_INTERVAL, round(schedule.interval * schedule.ease))
+        schedule.repetitions += 1
+    penalty = 5 - grade
+    schedule.ease = max(MIN_EASE, schedule.ease + 0.1 - penalty * (0.08 + penalty * 0.02))
+    schedule.last_reviewed = reviewed_at
+    schedule.next_due = reviewed_at + timedelta(days=schedule.interval)
+    return schedule
+
+
+def grade_from_time(time_taken, usual_time):
+    """
+    Grades an attempt that was not graded explicitly: much faster than the
+    usual time for the problem is easy, much slower is hard.
+    """
+    if time_taken is None or not usual_time:
+        return Grade.GOOD
+    ratio = time_taken / usual_time
+    if ratio <= 0.5:
+        return Grade.EASY
+    if ratio > 2:
+        return Grade.HARD
+    return Grade.GOOD
+
+
+def attempt_grade(attempt):
+    if attempt.grade is not None:
+        return attempt.grade
+    stats = ProblemStats.objects.filter(pk=attempt.problem_id).first()
+    return grade_from_time(attempt.time_taken, stats.mean_time if stats else None)
+
+
+def review(attempt):
+    """
+    Moves the schedule of the attempt's problem forward: a couple of reads
+    and writes of the problem's own rows, whatever the size of the decks.
+    """
+    schedule, _ = ReviewSchedule.objects.select_for_update().get_or_create(problem_id=attempt.problem_id)
+    next_state(schedule, attempt_grade(attempt), attempt.end_time)
+    schedule.save()
+    DeckMembership.objects.filter(problem_id=attempt.problem_id).update(next_due=schedule.next_due)
+    return schedule
+
+
+def postpone(problem_id, delay=SKIP_DELAY, now=None):
+    """
+    Moves a problem back in the due queue without reviewing it.
+    """
+    next_due = (now or timezone.now()) + delay
+    ReviewSchedule.objects.update_or_create(problem_id=problem_id, defaults={'next_due': next_due})
+    DeckMembership.objects.filter(problem_id=problem_id).update(next_due=next_due)
+
+
+def copy_due_dates(memberships):
+    """
+    Copies the due date of each problem onto the given memberships, in one
+    UPDATE.
+    """
+    schedules = ReviewSchedule.objects.filter(problem_id=OuterRef('problem_id'))
+    memberships.update(next_due=Subquery(schedules.values('next_due')[:1]))
+
+
+def due_problem_ids(deck, limit=1, now=None):
+    """
+    Returns the IDs of up to `limit` problems of a deck due for review,
+    most overdue first, then problems never reviewed.
+    """
+    now = now or timezone.now()
+    memberships = deck.memberships.order_by('next_due', 'problem_id').values_list('problem_id', flat=True)
+    due = list(memberships.filter(next_due__lte=now)[:limit])
+    if len(due) < limit:
+        new = deck.memberships.filter(next_due__isnull=True).order_by('problem_id')
+        due += list(new.values_list('problem_id', flat=True)[:limit - len(due)])
+    return due
+
+
+def is_due(deck, problem_id, now=None):
+    """
+    Whether a problem of a deck is due for review, or was never reviewed.
+    """
+    now = now or timezone.now()
+    return deck.memberships.filter(
+        Q(next_due__lte=now) | Q(next_due__isnull=True), problem_id=problem_id,
+    ).exists()
+
+
+def replay(problem_ids):
+    """
+    Rebuilds the schedules of the given problems from their finished
+    attempts, oldest first. Returns the schedules written.
+    """
+    schedules = {}
+    usual = {
+        stats.pk: stats.mean_time
+        for stats in ProblemStats.objects.filter(pk__in=problem_ids)
+    }
+    attempts = (
+        Attempt.objects.filter(problem_id__in=problem_ids, end_time__isnull=False)
+        .order_by('problem_id', 'end_time')
+        .values_list('problem_id', 'end_time', 'time_taken', 'grade')
+    )
+    for problem_id, end_time, time_taken, grade in attempts:
+        schedule = schedules.get(problem_id)
+        if schedule is None:
+            schedule = schedules[problem_id] = ReviewSchedule(problem_id=problem_id)
+        if grade is None:
+            grade = grade_from_time(time_taken, usual.get(problem_id))
+        next_state(schedule, grade, end_time)
+
+    ReviewSchedule.objects.filter(problem_id__in=problem_ids).delete()
+    ReviewSchedule.objects.bulk_create(schedules.values(), batch_size=BATCH_SIZE)
+    copy_due_dates(DeckMembership.objects.filter(problem_id__in=problem_ids))
+    return list(schedules.values())
+
+
+def reschedule(batch_size=BATCH_SIZE, progress=None):
+    """
+    Replays the schedules of every problem, walking the problems by ID in
+    batches of `batch_size`, one transaction per batch so that a long run
+    never holds the database for long. Returns the number of problems.
+    """
+    ids = Problem.objects.order_by('pk').values_list('pk', flat=True)
+    last_pk, total = 0, 0
+    while True:
+        batch = list(ids.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return total
+        with transaction.atomic():
+            replay(batch)
+        last_pk, total = batch[-1], total + len(batch)
+        if progress:
+            progress(total)
@@ -0,0 +1,176 @@
+# palaistra/problems/search.py
+"""
+Full-text search over problems, hints and solutions, backed by an SQLite
+FTS5 table with one row per problem (rowid = problem ID).
+
+Bodies are indexed as plain text: the HTML tags are stripped, while the
+unicode61 tokenizer keeps backslashes as token characters so LaTeX
+commands like `\\frac` or `\\int` stay searchable as a whole.
+
+The index is kept in sync by the signal receivers in `problems.signals`;
+`rebuild_search_index` rebuilds it from scratch. On other databases
+everything here is a no-op and search falls back to the ORM.
+"""
+import re
+from collections import defaultdict
+from html import escape
+from html.parser import HTMLParser
+
+# Django imports
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+# Local application imports
+from .models import Hint, Problem, Solution
+
+SEARCH_TABLE = 'problems_problemsearch'
+CREATE_SEARCH_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+    "USING fts5(body, hints, solutions, tokenize = \"unicode61 tokenchars '\\'\")"
+)
+BATCH_SIZE = 500
+# Column weights for bm25(): a match in the statement counts most
+RANK = f"bm25({SEARCH_TABLE}, 10.0, 2.0, 1.0)"
+HIGHLIGHT_START, HIGHLIGHT_END = '\x02', '\x03'
+
+_TERM_PATTERN = re.compile(r'[^\s"]+')
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        # Keep words of adjacent blocks apart
+        self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        self.parts.append(' ')
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def strip_html(html):
+    """
+    Returns the text content of `html`, LaTeX included.
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ' '.join(''.join(extractor.parts).split())
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def to_match_query(text):
+    """
+    Turns user input into an FTS5 query matching documents containing every
+    term, each term quoted so FTS5 operators in the input are taken literally.
+    The last term also matches as a prefix.
+    """
+    terms = _TERM_PATTERN.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def index_problems(problem_ids, replace=True):
+    """
+    (Re)indexes the given problems with their hints and solutions. Problems
+    that no longer exist are removed from the index.
+
+    Pass `replace=False` for problems known not to be indexed yet: FTS5
+    flushes its pending terms to a new segment on every delete, so bulk
+    loads that skip the deletes stay linear.
+    """
+    if not is_available():
+        return
+    problem_ids = list(problem_ids)
+    for start in range(0, len(problem_ids), BATCH_SIZE):
+        batch = problem_ids[start:start + BATCH_SIZE]
+        hints, solutions = defaultdict(list), defaultdict(list)
+        for problem_id, body in Hint.objects.filter(problem_id__in=batch).values_list('problem_id', 'body'):
+            hints[problem_id].append(strip_html(body))
+        for problem_id, body in Solution.objects.filter(problem_id__in=batch).values_list('problem_id', 'body'):
+            solutions[problem_id].append(strip_html(body))
+        rows = [
+            (pk, strip_html(body), '\n'.join(hints[pk]), '\n'.join(solutions[pk]))
+            for pk, body in Problem.objects.filter(pk__in=batch).values_list('pk', 'body')
+        ]
+        with connection.cursor() as cursor:
+            if replace:
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", batch)
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, body, hints, solutions) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+
+
+def clear():
+    """
+    Empties the index. FTS5 deletes rows one by one, leaving a delete marker
+    for every token in the index; recreating the table starts from nothing.
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+        cursor.execute(CREATE_SEARCH_TABLE)
+
+
+def rebuild():
+    """
+    Empties the index and indexes every problem again, in batches.
+    """
+    if not is_available():
+        return
+    clear()
+    batch = []
+    for pk in Problem.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=BATCH_SIZE):
+        batch.append(pk)
+        if len(batch) == BATCH_SIZE:
+            index_problems(batch, replace=False)
+            batch = []
+    index_problems(batch, replace=False)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+
+
+def matching_ids(text):
+    """
+    Returns an SQL expression selecting the IDs of the problems matching
+    `text`, to be used as `Problem.objects.filter(pk__in=...)`.
+    """
+    return RawSQL(
+        f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+        [to_match_query(text)],
+    )
+
+
+def search(text, limit=20, offset=0):
+    """
+    Returns the best ranked (problem_id, snippet) pairs for `text`. Snippets
+    are HTML, with the matched terms wrapped in <mark>.
+    """
+    query = to_match_query(text)
+    if not is_available() or query is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, snippet({SEARCH_TABLE}, -1, %s, %s, '…', 24) "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"ORDER BY {RANK} LIMIT %s OFFSET %s",
+            [HIGHLIGHT_START, HIGHLIGHT_END, query, limit, offset],
+        )
+        rows = cursor.fetchall()
+    return [
+        (pk, escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+        for pk, snippet in rows
+    ]
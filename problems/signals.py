@@ -0,0 +1,234 @@
+# Django imports
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+# Third-party imports
+from taggit.models import Tag
+
+# Local application imports
+from . import analytics, fragments
+from .links import invalidate_problem_snippet
+from .membership import schedule_deck_rebuild, schedule_problem_sync
+from .models import Attempt, Deck, DeckTagFilter, Hint, Problem, Solution, TaggedProblem
+from .rendering import rerender_linking_bodies
+from .scheduling import review
+from .search import index_problems
+from .stats import recompute as recompute_stats, record_attempt_change
+from .tag_index import index as tag_index
+
+
+@receiver(post_save, sender=Problem)
+def problem_saved(sender, instance, created, **kwargs):
+    """
+    Drops the cached link snippet of a problem when its body changes and
+    re-renders the bodies linking to it with the new text (links written
+    before the problem existed included).
+    """
+    if created:
+        # Decks without include filters take every problem
+        schedule_problem_sync(instance.pk)
+        transaction.on_commit(lambda: tag_index.add_problem(instance.pk))
+    if not instance.body_changed:
+        return
+    invalidate_problem_snippet(instance.pk)
+    _linking_problems_changed(rerender_linking_bodies(instance.pk))
+
+@receiver(post_delete, sender=Problem)
+def problem_deleted(sender, instance, **kwargs):
+    """
+    Links to a deleted problem are rendered as invalid from now on.
+    """
+    invalidate_problem_snippet(instance.pk)
+    _linking_problems_changed(rerender_linking_bodies(instance.pk))
+    transaction.on_commit(lambda: tag_index.remove_problem(instance.pk))
+
+def _linking_problems_changed(problem_ids):
+    if not problem_ids:
+        return
+    touch_problems(problem_ids)
+    for problem_id in problem_ids:
+        fragments.schedule_bump(fragments.PROBLEM, problem_id)
+    # The list shows their rendered bodies
+    fragments.schedule_bump(fragments.PROBLEM_LIST)
+
+
+def _deleted_with(origin, model):
+    """
+    Whether a cascade deletion started from instances of `model`.
+    """
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+@receiver(post_save, sender=TaggedProblem)
+def tagged_problem_saved(sender, instance, **kwargs):
+    problem_id, tag_id = instance.content_object_id, instance.tag_id
+    transaction.on_commit(lambda: tag_index.add_tag(problem_id, tag_id))
+    schedule_problem_sync(problem_id)
+
+@receiver(post_delete, sender=TaggedProblem)
+def tagged_problem_deleted(sender, instance, origin=None, **kwargs):
+    problem_id, tag_id = instance.content_object_id, instance.tag_id
+    transaction.on_commit(lambda: tag_index.remove_tag(problem_id, tag_id))
+    if _deleted_with(origin, Problem):
+        # The memberships go away with the problem
+        return
+    schedule_problem_sync(problem_id)
+
+@receiver(post_save, sender=DeckTagFilter)
+@receiver(post_delete, sender=DeckTagFilter)
+def deck_tag_filter_changed(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Deck):
+        return
+    schedule_deck_rebuild(instance.deck_id)
+
+@receiver(post_save, sender=Deck)
+def deck_saved(sender, instance, created, **kwargs):
+    if created:
+        schedule_deck_rebuild(instance.pk)
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    """
+    The deck pages show the names of their filter tags, and the statistics
+    page, under the deck list version, the most attempted ones.
+    """
+    if created:
+        return
+    deck_ids = list(Deck.objects.filter(decktagfilter__tag=instance).values_list('pk', flat=True))
+    Deck.objects.filter(pk__in=deck_ids).touch()
+    for deck_id in deck_ids:
+        fragments.schedule_bump(fragments.DECK, deck_id)
+    fragments.schedule_bump(fragments.DECK_LIST)
+
+
+
+def touch_problems(problem_ids):
+    """
+    Marks problems as modified, and the decks previewing them, for
+    conditional requests.
+    """
+    Problem.objects.filter(pk__in=problem_ids).touch()
+    Deck.objects.filter(memberships__problem_id__in=problem_ids).touch()
+
+@receiver(post_save, sender=Problem)
+def problem_modified(sender, instance, created, **kwargs):
+    if not created:
+        # New problems reach their decks through the membership sync
+        Deck.objects.filter(memberships__problem_id=instance.pk).touch()
+
+@receiver(pre_delete, sender=Problem)
+def problem_deleting(sender, instance, **kwargs):
+    """
+    The memberships are deleted with the problem, before `post_delete`.
+    """
+    Deck.objects.filter(memberships__problem_id=instance.pk).touch()
+    fragments.schedule_bump(fragments.DECK_LIST)
+
+@receiver(post_save, sender=Hint)
+@receiver(post_save, sender=Solution)
+@receiver(post_save, sender=TaggedProblem)
+@receiver(post_delete, sender=Hint)
+@receiver(post_delete, sender=Solution)
+@receiver(post_delete, sender=TaggedProblem)
+def problem_part_changed(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Problem):
+        return
+    touch_problems([instance.content_object_id if sender is TaggedProblem else instance.problem_id])
+
+@receiver(post_save, sender=DeckTagFilter)
+@receiver(post_delete, sender=DeckTagFilter)
+def deck_filter_modified(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Deck):
+        return
+    Deck.objects.filter(pk=instance.deck_id).touch()
+
+def _schedule_search_index(problem_id):
+    transaction.on_commit(lambda: index_problems([problem_id]))
+
+@receiver(post_save, sender=Problem)
+@receiver(post_save, sender=Hint)
+@receiver(post_save, sender=Solution)
+def search_document_saved(sender, instance, **kwargs):
+    if instance.body_changed:
+        _schedule_search_index(instance.pk if sender is Problem else instance.problem_id)
+
+@receiver(post_delete, sender=Problem)
+@receiver(post_delete, sender=Hint)
+@receiver(post_delete, sender=Solution)
+def search_document_deleted(sender, instance, origin=None, **kwargs):
+    if sender is not Problem and _deleted_with(origin, Problem):
+        # The problem's own receiver drops its row
+        return
+    _schedule_search_index(instance.pk if sender is Problem else instance.problem_id)
+
+
+@receiver(post_save, sender=Attempt)
+def attempt_saved(sender, instance, created, **kwargs):
+    before = None if created else instance.previous_state
+    if before is None and not created:
+        # Saved without having been loaded: the change is unknown
+        recompute_stats([instance.problem_id])
+        return
+    record_attempt_change(instance.problem_id, before, instance.stats_state())
+    analytics.record_attempt_change(instance, before, instance.stats_state())
+    if instance.end_time is not None and (before is None or before[0] is None):
+        # Finishing an attempt reviews the problem
+        review(instance)
+
+@receiver(post_delete, sender=Attempt)
+def attempt_deleted(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Problem):
+        # The statistics go away with the problem
+        return
+    record_attempt_change(instance.problem_id, instance.stats_state(), None)
+    analytics.record_attempt_change(instance, instance.stats_state(), None)
+
+@receiver(post_delete, sender=Problem)
+@receiver(post_delete, sender=Deck)
+@receiver(post_delete, sender=Tag)
+def sketch_owner_deleted(sender, instance, **kwargs):
+    """
+    Drops the time distribution of a deleted problem, deck or tag. The
+    attempts it held still count for the other sketches.
+    """
+    scope = {Problem: analytics.Scope.PROBLEM, Deck: analytics.Scope.DECK, Tag: analytics.Scope.TAG}[sender]
+    analytics.delete_sketch(scope, instance.pk)
+
+
+@receiver(post_save, sender=Problem)
+@receiver(post_save, sender=Hint)
+@receiver(post_save, sender=Solution)
+@receiver(post_save, sender=TaggedProblem)
+@receiver(post_save, sender=Attempt)
+@receiver(post_delete, sender=Problem)
+@receiver(post_delete, sender=Hint)
+@receiver(post_delete, sender=Solution)
+@receiver(post_delete, sender=TaggedProblem)
+@receiver(post_delete, sender=Attempt)
+def problem_fragments_changed(sender, instance, **kwargs):
+    """
+    Bumps the fragment version of a problem, and of the problem list, when
+    its statement, hints, solutions, tags or attempt count change. This
+    includes its practice card.
+    """
+    if sender is Problem:
+        problem_id = instance.pk
+    elif sender is TaggedProblem:
+        problem_id = instance.content_object_id
+    else:
+        problem_id = instance.problem_id
+    fragments.schedule_bump(fragments.PROBLEM, problem_id)
+    fragments.schedule_bump(fragments.PROBLEM_LIST)
+
+@receiver(post_save, sender=Deck)
+@receiver(post_save, sender=DeckTagFilter)
+@receiver(post_delete, sender=Deck)
+@receiver(post_delete, sender=DeckTagFilter)
+def deck_fragments_changed(sender, instance, **kwargs):
+    """
+    Bumps the fragment version of a deck, and of the deck list, when its
+    name or tag filters change. Changes to its problems are bumped by
+    `membership.bump_versions`.
+    """
+    fragments.schedule_bump(fragments.DECK, instance.pk if sender is Deck else instance.deck_id)
+    fragments.schedule_bump(fragments.DECK_LIST)
@@ -0,0 +1,95 @@
+# palaistra/problems/sketches.py
+"""
+Mergeable quantile sketches of durations.
+
+`LogHistogram` counts values in buckets whose bounds grow geometrically, so
+any quantile it returns is within `RELATIVE_ACCURACY` of the exact value
+(as in DDSketch). Its size depends on the spread of the values, not on how
+many were added: durations from one second to a week fit in about 350
+buckets. Two sketches merge by adding their bucket counts, and a value is
+removed by decrementing its bucket, which keeps them exact under deletions.
+"""
+import math
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+# Values are in seconds; anything shorter counts as one second
+MIN_VALUE = 1.0
+
+
+def bucket_of(value):
+    return math.ceil(math.log(max(value, MIN_VALUE)) / _LOG_GAMMA)
+
+
+def bucket_value(index):
+    """
+    The value representing a bucket, within the relative accuracy of every
+    value it holds.
+    """
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class LogHistogram:
+    def __init__(self, bins=None, count=0, total=0.0):
+        self.bins = {int(index): n for index, n in (bins or {}).items()}
+        self.count = count
+        self.total = total
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('bins'), data.get('count', 0), data.get('total', 0.0))
+
+    def to_dict(self):
+        # JSON object keys are strings
+        return {
+            'bins': {str(index): n for index, n in sorted(self.bins.items())},
+            'count': self.count,
+            'total': self.total,
+        }
+
+    def add(self, value, count=1):
+        index = bucket_of(value)
+        self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+
+    def merge(self, other):
+        for index, n in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+        return self
+
+    def subtract(self, other):
+        """
+        Takes the values of `other`, previously merged in, back out.
+        """
+        for index, n in other.bins.items():
+            remaining = self.bins.get(index, 0) - n
+            if remaining > 0:
+                self.bins[index] = remaining
+            else:
+                self.bins.pop(index, None)
+        self.count = max(0, self.count - other.count)
+        self.total = max(0.0, self.total - other.total)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        """
+        Returns the value below which a fraction `q` of the values fall, or
+        None for an empty sketch.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return bucket_value(index)
+        return bucket_value(max(self.bins))
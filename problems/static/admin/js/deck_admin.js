@@ -41,4 +41,40 @@ document.addEventListener('DOMContentLoaded', function() {
     if (addRowLink) {
         addRowLink.addEventListener('click', () => setTimeout(updateTagOptions, 50));
     }
-});
\ No newline at end of file
+});
+
+// Live "N problems match" preview of the filters being edited
+document.addEventListener('DOMContentLoaded', function() {
+    const deckTagFilterGroup = document.getElementById('decktagfilter_set-group');
+    const preview = document.getElementById('deck-match-preview');
+
+    if (!deckTagFilterGroup || !preview) {
+        return;
+    }
+
+    function updatePreview() {
+        const include = [];
+        const exclude = [];
+
+        deckTagFilterGroup.querySelectorAll('select[id$="-tag"]').forEach(function(select) {
+            const prefix = select.name.slice(0, -'tag'.length);
+            const deleted = deckTagFilterGroup.querySelector(`input[name="${prefix}DELETE"]`);
+            if (!select.value || (deleted && deleted.checked)) {
+                return;
+            }
+            const filterType = deckTagFilterGroup.querySelector(`input[name="${prefix}filter_type"]:checked`);
+            (filterType && filterType.value === 'EXCLUDE' ? exclude : include).push(select.value);
+        });
+
+        const params = new URLSearchParams({include: include.join(','), exclude: exclude.join(',')});
+        fetch(`${preview.dataset.previewUrl}?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.count !== undefined) {
+                    preview.textContent = data.count;
+                }
+            });
+    }
+
+    deckTagFilterGroup.addEventListener('change', updatePreview);
+});
@@ -3,6 +3,20 @@ import StarterKit from 'https://esm.sh/@tiptap/starter-kit'
 import Link from 'https://esm.sh/@tiptap/extension-link'
 import Image from 'https://esm.sh/@tiptap/extension-image'
 
+/**
+ * The Image extension, keeping the responsive variants the upload view
+ * returns (`srcset` and `sizes`) on the <img> tag.
+ */
+const ResponsiveImage = Image.extend({
+    addAttributes() {
+        return {
+            ...this.parent?.(),
+            srcset: { default: null },
+            sizes: { default: null },
+        };
+    },
+});
+
 /**
  * A simple function to get a cookie by name.
  * We need this to get the CSRF token.
@@ -73,7 +87,7 @@ function createImageUploadInput(uploadUrl, editor) {
             console.log('Image upload: Parsed JSON data:', data);
             if (data.url) {
                 console.log('Image upload: Success! Inserting image with URL:', data.url);
-                editor.chain().focus().setImage({ src: data.url }).run();
+                editor.chain().focus().setImage({ src: data.url, srcset: data.srcset, sizes: data.sizes }).run();
             } else {
                 throw new Error(data.error || 'JSON response did not contain a URL.');
             }
@@ -123,7 +137,7 @@ function initializeTiptapEditors() {
                     link: { openOnClick: false },
                 }),
                 // Add the Image extension here
-                Image,
+                ResponsiveImage,
             ],
             // Use the content from the hidden textarea.
             content: textarea.value,
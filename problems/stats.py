@@ -0,0 +1,100 @@
+# palaistra/problems/stats.py
+"""
+Incremental maintenance of `ProblemStats`.
+
+Every change to an attempt is applied to its problem's row as a delta, with
+a single UPDATE of F() expressions, so concurrent attempts never lose an
+increment. Only removing a finished attempt, which may take away the
+minimum or maximum time, reads the problem's attempts again.
+"""
+from datetime import timedelta
+
+# Django imports
+from django.db.models import Count, DurationField, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+# Local application imports
+from . import fragments
+from .models import Attempt, ProblemStats
+
+BATCH_SIZE = 500
+
+
+def _contribution(state):
+    """
+    Returns the (attempts, finished, time) an attempt in `state` adds to the
+    aggregates; `state` is None when the attempt does not exist.
+    """
+    if state is None:
+        return 0, 0, timedelta(0)
+    end_time, time_taken = state
+    if end_time is None:
+        return 1, 0, timedelta(0)
+    return 1, 1, time_taken or timedelta(0)
+
+
+def record_attempt_change(problem_id, before, after):
+    """
+    Applies the change of an attempt from state `before` to state `after`
+    (see `Attempt.stats_state`) to the statistics of its problem. A `before`
+    of None is a new attempt, an `after` of None a deleted one.
+    """
+    old_attempts, old_finished, old_time = _contribution(before)
+    new_attempts, new_finished, new_time = _contribution(after)
+    if (old_attempts, old_finished, old_time) == (new_attempts, new_finished, new_time):
+        return
+    ProblemStats.objects.bulk_create([ProblemStats(problem_id=problem_id)], ignore_conflicts=True)
+    changes = {
+        'attempt_count': F('attempt_count') + (new_attempts - old_attempts),
+        'completed_count': F('completed_count') + (new_finished - old_finished),
+        'total_time': F('total_time') + Value(new_time - old_time, output_field=DurationField()),
+        'updated_at': timezone.now(),
+    }
+    if old_finished:
+        # The removed time may have been the minimum or the maximum. Runs
+        # after the attempt row itself was updated or deleted.
+        changes.update(
+            Attempt.objects.filter(problem_id=problem_id, end_time__isnull=False).aggregate(
+                min_time=Min('time_taken'), max_time=Max('time_taken'),
+            )
+        )
+    elif new_finished:
+        time = Value(new_time, output_field=DurationField())
+        changes['min_time'] = Least(Coalesce('min_time', time), time)
+        changes['max_time'] = Greatest(Coalesce('max_time', time), time)
+    ProblemStats.objects.filter(pk=problem_id).update(**changes)
+
+
+def recompute(problem_ids=None):
+    """
+    Rebuilds the statistics of the given problems, or of every problem, from
+    their attempts, and bumps the cached attempt counts. Returns the number
+    of rows written.
+    """
+    fragments.schedule_bump(fragments.PROBLEM_LIST)
+    attempts = Attempt.objects.all()
+    if problem_ids is not None:
+        attempts = attempts.filter(problem_id__in=problem_ids)
+        ProblemStats.objects.filter(problem_id__in=problem_ids).delete()
+        for problem_id in problem_ids:
+            fragments.schedule_bump(fragments.PROBLEM, problem_id)
+    else:
+        ProblemStats.objects.all().delete()
+    finished = Q(end_time__isnull=False)
+    rows = (
+        attempts.order_by().values('problem_id').annotate(
+            attempt_count=Count('pk'),
+            completed_count=Count('pk', filter=finished),
+            total_time=Coalesce(Sum('time_taken', filter=finished), Value(timedelta(0))),
+            min_time=Min('time_taken', filter=finished),
+            max_time=Max('time_taken', filter=finished),
+        )
+    )
+    written, batch = 0, []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ProblemStats(**row))
+        if len(batch) == BATCH_SIZE:
+            written += len(ProblemStats.objects.bulk_create(batch))
+            batch = []
+    return written + len(ProblemStats.objects.bulk_create(batch))
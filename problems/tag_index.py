@@ -0,0 +1,325 @@
+# palaistra/problems/tag_index.py
+"""
+In-process index mapping every tag to the set of the problems tagged with
+it, used to evaluate deck filters without hitting the database.
+
+The sets are split like roaring bitmaps: problem IDs are grouped in chunks
+of 65536 by their high bits, and each chunk holds the low 16 bits of its
+IDs either as a sorted `array('H')`, 2 bytes per problem, or once it has
+more than `ARRAY_LIMIT` of them as a bitset, a Python int of at most 8KB
+whose bit N is set when the chunk has ID N. A tag on a few problems then
+takes a few bytes per problem wherever their IDs fall, and one on every
+problem takes ~130KB per million of them. Deck filters become unions and
+differences of those sets, chunk by chunk.
+
+The index warms on first use and is kept up to date by the signal
+receivers in `problems.signals`. Changes made by other processes are picked
+up when the index expires after `MAX_AGE` seconds, so it is meant for
+previews and counts; the `DeckMembership` table remains the source of truth.
+An expired index keeps answering while a background thread rebuilds it, so
+only the first use in a process waits for a build.
+"""
+import bisect
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+# Django imports
+from django.conf import settings
+from django.db import connections
+
+# Local application imports
+from .models import DeckTagFilter, Problem, TaggedProblem
+
+MAX_AGE = getattr(settings, 'TAG_INDEX_MAX_AGE', 300)
+CHUNK_BITS = 16
+LOW_MASK = (1 << CHUNK_BITS) - 1
+# Past this size an array takes more memory than the chunk's bitset
+ARRAY_LIMIT = 4096
+
+# Positions of the set bits of every byte value
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def iter_bits(bitset):
+    """
+    Yields the positions of the set bits of `bitset`, in increasing order.
+    """
+    data = bitset.to_bytes((bitset.bit_length() + 7) // 8, 'little')
+    for offset, value in enumerate(data):
+        if value:
+            base = offset * 8
+            for bit in _BYTE_BITS[value]:
+                yield base + bit
+
+
+def to_bitset(problem_ids):
+    """
+    Returns the bitset of the given IDs, built as bytes and converted once:
+    or-ing bits into an int one at a time copies it every time.
+    """
+    data = bytearray()
+    for pk in problem_ids:
+        offset = pk >> 3
+        if offset >= len(data):
+            data.extend(bytes(offset + 1 - len(data)))
+        data[offset] |= 1 << (pk & 7)
+    return int.from_bytes(data, 'little')
+
+
+def _container(lows):
+    """
+    Returns the container of a chunk's sorted low bits.
+    """
+    return array('H', lows) if len(lows) <= ARRAY_LIMIT else to_bitset(lows)
+
+
+def _compact(bitset):
+    return array('H', iter_bits(bitset)) if bitset.bit_count() <= ARRAY_LIMIT else bitset
+
+
+def _as_bitset(container):
+    return container if isinstance(container, int) else to_bitset(container)
+
+
+def _size(container):
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def _union(a, b):
+    if isinstance(a, array) and isinstance(b, array):
+        return _container(sorted(set(a).union(b)))
+    return _as_bitset(a) | _as_bitset(b)
+
+
+def _difference(a, b):
+    if isinstance(a, int):
+        return _compact(a & ~_as_bitset(b))
+    if isinstance(b, int):
+        return array('H', (low for low in a if not b >> low & 1))
+    b = set(b)
+    return array('H', (low for low in a if low not in b))
+
+
+class ProblemSet:
+    """
+    A set of problem IDs stored in chunks (see the module docstring). The
+    containers are never modified in place, so sets built from others can
+    share them.
+    """
+    __slots__ = ('chunks',)
+
+    def __init__(self, chunks=None):
+        self.chunks = {} if chunks is None else chunks
+
+    @classmethod
+    def from_ids(cls, problem_ids):
+        lows = defaultdict(set)
+        for pk in problem_ids:
+            lows[pk >> CHUNK_BITS].add(pk & LOW_MASK)
+        return cls({high: _container(sorted(values)) for high, values in lows.items()})
+
+    def copy(self):
+        return ProblemSet(dict(self.chunks))
+
+    def __len__(self):
+        return sum(_size(container) for container in self.chunks.values())
+
+    def __iter__(self):
+        for high in sorted(self.chunks):
+            base, container = high << CHUNK_BITS, self.chunks[high]
+            for low in (iter_bits(container) if isinstance(container, int) else container):
+                yield base + low
+
+    def __or__(self, other):
+        chunks = dict(self.chunks)
+        for high, container in other.chunks.items():
+            chunks[high] = _union(chunks[high], container) if high in chunks else container
+        return ProblemSet(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+        for high, container in self.chunks.items():
+            if high in other.chunks:
+                container = _difference(container, other.chunks[high])
+            if _size(container):
+                chunks[high] = container
+        return ProblemSet(chunks)
+
+    def add(self, pk):
+        high, low = pk >> CHUNK_BITS, pk & LOW_MASK
+        container = self.chunks.get(high, array('H'))
+        if isinstance(container, int):
+            self.chunks[high] = container | 1 << low
+            return
+        index = bisect.bisect_left(container, low)
+        if index == len(container) or container[index] != low:
+            self.chunks[high] = _container(container[:index] + array('H', [low]) + container[index:])
+
+    def discard(self, pk):
+        high, low = pk >> CHUNK_BITS, pk & LOW_MASK
+        if high not in self.chunks:
+            return
+        container = _difference(self.chunks[high], array('H', [low]))
+        if _size(container):
+            self.chunks[high] = container
+        else:
+            del self.chunks[high]
+
+
+class TagBitsetIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Held for a whole build, so that a single one runs at a time
+        self.build_lock = threading.Lock()
+        self.loaded_at = None
+        self.problems = ProblemSet()
+        self.tags = {}
+        # Changes made while a build reads the database, replayed on its
+        # result; None when no build is running
+        self.pending = None
+
+    @property
+    def is_warm(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < MAX_AGE
+
+    def build(self):
+        """
+        Reads the problems and their tags. Returns (problems, tags).
+        """
+        problems = ProblemSet.from_ids(Problem.objects.values_list('pk', flat=True).iterator())
+        tag_problem_ids = {}
+        for tag_id, problem_id in TaggedProblem.objects.values_list('tag_id', 'content_object_id').iterator():
+            tag_problem_ids.setdefault(tag_id, []).append(problem_id)
+        return problems, {tag_id: ProblemSet.from_ids(ids) for tag_id, ids in tag_problem_ids.items()}
+
+    def warm(self):
+        with self.build_lock:
+            with self.lock:
+                self.pending = []
+            try:
+                problems, tags = self.build()
+            except BaseException:
+                with self.lock:
+                    self.pending = None
+                raise
+            with self.lock:
+                self.problems, self.tags = problems, tags
+                for change, args in self.pending:
+                    change(*args)
+                self.pending = None
+                self.loaded_at = time.monotonic()
+
+    def ensure_warm(self):
+        if self.is_warm:
+            return
+        if self.loaded_at is None:
+            with self.build_lock:
+                cold = self.loaded_at is None
+            if cold:
+                self.warm()
+        elif not self.build_lock.locked():
+            threading.Thread(target=self._warm_in_background, daemon=True).start()
+
+    def _warm_in_background(self):
+        try:
+            if not self.is_warm:
+                self.warm()
+        finally:
+            connections.close_all()
+
+    def clear(self):
+        with self.lock:
+            self.loaded_at = None
+            self.problems, self.tags = ProblemSet(), {}
+
+    # Incremental updates, ignored while the index is cold: the next warm()
+    # reads the committed state anyway. During a build they are also kept
+    # to be replayed on its result, which may have been read before them.
+
+    def _update(self, change, *args):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((change, args))
+            if self.loaded_at is not None:
+                change(*args)
+
+    def add_problem(self, problem_id):
+        self._update(self._set_problem, problem_id, True)
+
+    def remove_problem(self, problem_id):
+        # Its tags are removed one by one as the TaggedProblem rows cascade
+        self._update(self._set_problem, problem_id, False)
+
+    def add_tag(self, problem_id, tag_id):
+        self._update(self._set_tag, problem_id, tag_id, True)
+
+    def remove_tag(self, problem_id, tag_id):
+        self._update(self._set_tag, problem_id, tag_id, False)
+
+    def _set_problem(self, problem_id, present):
+        if present:
+            self.problems.add(problem_id)
+        else:
+            self.problems.discard(problem_id)
+
+    def _set_tag(self, problem_id, tag_id, present):
+        if present:
+            self.tags.setdefault(tag_id, ProblemSet()).add(problem_id)
+        elif tag_id in self.tags:
+            self.tags[tag_id].discard(problem_id)
+
+    # Queries
+
+    def match(self, include_tag_ids=(), exclude_tag_ids=()):
+        """
+        Returns the `ProblemSet` of the problems matching the filters, with
+        the same semantics as `Deck.match_problems`.
+        """
+        self.ensure_warm()
+        with self.lock:
+            if include_tag_ids:
+                problems = ProblemSet()
+                for tag_id in include_tag_ids:
+                    problems |= self.tags.get(tag_id, ProblemSet())
+            else:
+                problems = self.problems.copy()
+            for tag_id in exclude_tag_ids:
+                problems -= self.tags.get(tag_id, ProblemSet())
+        return problems
+
+    def count(self, include_tag_ids=(), exclude_tag_ids=()):
+        return len(self.match(include_tag_ids, exclude_tag_ids))
+
+    def problem_ids(self, include_tag_ids=(), exclude_tag_ids=()):
+        return list(self.match(include_tag_ids, exclude_tag_ids))
+
+
+index = TagBitsetIndex()
+
+
+def deck_tag_ids(deck):
+    """
+    Returns the (include, exclude) tag ID lists of a deck.
+    """
+    include, exclude = [], []
+    for tag_id, filter_type in DeckTagFilter.objects.filter(deck=deck).values_list('tag_id', 'filter_type'):
+        (include if filter_type == DeckTagFilter.FilterType.INCLUDE else exclude).append(tag_id)
+    return include, exclude
+
+
+def deck_problem_ids(deck):
+    """
+    Returns the sorted IDs of the problems matching the deck's filters, or
+    None when the index is disabled with the `TAG_INDEX_ENABLED` setting.
+    """
+    if not getattr(settings, 'TAG_INDEX_ENABLED', True):
+        return None
+    return index.problem_ids(*deck_tag_ids(deck))
+
+
+def deck_count(deck):
+    if not getattr(settings, 'TAG_INDEX_ENABLED', True):
+        return None
+    return index.count(*deck_tag_ids(deck))
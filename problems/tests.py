@@ -1,3 +1,1396 @@
-from django.test import TestCase
+from datetime import timedelta
+import hashlib
+import io
+import json
+import random
+import tempfile
+import threading
+import zipfile
+from array import array
+from contextlib import nullcontext
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.utils import load_backend
+from django.db.models import Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from palaistra import middleware
+from taggit.models import Tag
+
+from . import analytics, benchmarks, exporting, importing, membership, scheduling, search, tag_index, uploads
+from .admin import ProblemAdmin
+from .links import PROBLEM_LINK_PATTERN, get_problem_snippets, problem_snippet
+from .models import (
+    Attempt, BookSource, Deck, DeckMembership, DeckTagFilter, Hint, Problem, ProblemStats,
+    ProblemLink, ReviewSchedule, Solution, TimeSketch,
+)
+from .practice import SESSION_KEY, PracticeSession, permute
+from .rendering import sanitize_html
+from .sketches import RELATIVE_ACCURACY, LogHistogram
+from .stats import recompute as recompute_stats
+from .management.commands import benchmark_views, explain_hot_queries
+from .management.commands.benchmark_views import BUDGETS as BENCHMARKED_VIEWS
+from .views import ProblemListView
+
+
+class ProblemLinkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = Problem.objects.create(body="The first problem")
+        cls.second = Problem.objects.create(body="A second problem, with a statement too long for a label")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_links_are_rendered_into_the_stored_html(self):
+        problem = Problem.objects.create(
+            body=f"See [[problem:{self.first.pk}]] and [[problem:{self.second.pk}]] or [[problem:999999]]"
+        )
+        first_url = reverse('problems:problem-detail', args=[self.first.pk])
+        self.assertIn(f'See <a href="{first_url}">The first problem</a>', problem.body_html)
+        self.assertIn(f">{problem_snippet(self.second.body)}</a>", problem.body_html)
+        self.assertIn("[[Invalid Problem ID: 999999]]", problem.body_html)
+        self.assertEqual(
+            sorted(problem.outgoing_links.values_list('target_id', flat=True)),
+            [self.first.pk, self.second.pk, 999999],
+        )
+
+    def test_linking_bodies_are_found_through_the_links_table(self):
+        linking = Problem.objects.create(body=f"See [[problem:{self.first.pk}]]")
+        hint = Hint.objects.create(problem=self.second, body=f"Like [[problem:{self.first.pk}]]")
+        Solution.objects.create(problem=self.second, body="No link")
+
+        self.first.body = "Renamed problem"
+        with CaptureQueriesContext(connection) as queries:
+            self.first.save()
+        self.assertFalse([q['sql'] for q in queries if 'LIKE' in q['sql']])
+        linking.refresh_from_db()
+        hint.refresh_from_db()
+        self.assertIn(">Renamed problem</a>", linking.body_html)
+        self.assertIn(">Renamed problem</a>", hint.body_html)
+
+        # The table follows edited and deleted bodies
+        hint.body = "Not anymore"
+        hint.save()
+        linking.delete()
+        self.assertFalse(ProblemLink.objects.filter(target_id=self.first.pk).exists())
+
+    def test_snippets_follow_the_linked_problem(self):
+        get_problem_snippets([self.first.pk])
+        self.first.body = "Renamed problem"
+        self.first.save()
+        self.assertEqual(get_problem_snippets([self.first.pk]), {self.first.pk: "Renamed problem"})
+
+
+class SanitizeHtmlTests(SimpleTestCase):
+    def test_javascript_urls_are_dropped_however_written(self):
+        for href in (
+            'javascript:alert(1)',
+            'JaVaScRiPt:alert(1)',
+            '&#106;avascript:alert(1)',
+            '&#x6A;&#x61;vascript:alert(1)',
+            'jav&#x09;ascript:alert(1)',
+            'java&#10;script:alert(1)',
+            ' &#1;javascript:alert(1)',
+            'java\x00script:alert(1)',
+        ):
+            with self.subTest(href=href):
+                self.assertEqual(sanitize_html(f'<a href="{href}">link</a>'), '<a>link</a>')
+
+    def test_event_handlers_and_active_elements_are_dropped(self):
+        self.assertEqual(
+            sanitize_html('<p onclick="alert(1)" class="x">Text<img src="a.png" onerror="alert(1)"></p>'),
+            '<p class="x">Text<img src="a.png"></p>',
+        )
+        self.assertEqual(sanitize_html('<script>alert(1)</script><style>p {}</style>$x^2$'), '$x^2$')
+        self.assertEqual(
+            sanitize_html('<svg onload="alert(1)"><script>alert(1)</script><a href="javascript:x">a</a></svg>'),
+            '<a>a</a>',
+        )
+
+    def test_data_urls_are_dropped(self):
+        self.assertEqual(sanitize_html('<img src="data:image/svg+xml;base64,PHN2Zz4=">'), '<img>')
+        self.assertEqual(sanitize_html('<a href="data:text/html,<script>x</script>">a</a>'), '<a>a</a>')
+
+    def test_every_srcset_candidate_is_checked(self):
+        self.assertEqual(
+            sanitize_html('<img src="a.png" srcset="a-480w.webp 480w, javascript:alert(1) 2x, https://x/a.webp 960w">'),
+            '<img src="a.png" srcset="a-480w.webp 480w, https://x/a.webp 960w">',
+        )
+        self.assertEqual(sanitize_html('<img src="a.png" srcset="data:image/png;base64 1x">'), '<img src="a.png">')
+
+    def test_allowed_markup_is_kept(self):
+        html = '<p>See <a href="https://example.com/?a=1&amp;b=2" title="t">this</a> &amp; <em>that</em></p>'
+        self.assertEqual(sanitize_html(html), html)
+
+
+class DeckMembershipTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.algebra, cls.geometry, cls.hard = (
+                Tag.objects.create(name=name) for name in ("algebra", "geometry", "hard")
+            )
+            cls.deck = Deck.objects.create(name="Easy algebra")
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.algebra)
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.hard, filter_type=DeckTagFilter.FilterType.EXCLUDE)
+            cls.problem = Problem.objects.create(body="Solve for x")
+
+    def members(self, deck=None):
+        return set((deck or self.deck).memberships.values_list('problem_id', flat=True))
+
+    def test_tag_changes_sync_the_problem(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.add(self.algebra)
+        self.assertEqual(self.members(), {self.problem.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.add(self.hard)
+        self.assertEqual(self.members(), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.remove(self.hard)
+        self.assertEqual(self.members(), {self.problem.pk})
+        self.assertEqual(membership.check_consistency(), {})
+
+    def test_filter_changes_rebuild_the_deck(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.add(self.geometry)
+        self.assertEqual(self.members(), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            geometry_filter = DeckTagFilter.objects.create(deck=self.deck, tag=self.geometry)
+        self.assertEqual(self.members(), {self.problem.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            geometry_filter.delete()
+        self.assertEqual(self.members(), set())
+        self.assertEqual(membership.check_consistency(), {})
+
+    def test_new_decks_and_problems_are_filled_in(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            everything = Deck.objects.create(name="Everything")
+        self.assertEqual(self.members(everything), {self.problem.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            added = Problem.objects.create(body="Another")
+        self.assertEqual(self.members(everything), {self.problem.pk, added.pk})
+
+    def test_deleted_problems_leave_their_decks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.add(self.algebra)
+            everything = Deck.objects.create(name="Everything")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.delete()
+        self.assertFalse(DeckMembership.objects.exists())
+        self.assertEqual(self.members(everything), set())
+
+    def test_check_consistency_reports_drift(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.tags.add(self.algebra)
+            other = Problem.objects.create(body="Not in the deck")
+        # Written behind the receivers' back
+        DeckMembership.objects.filter(deck=self.deck).delete()
+        DeckMembership.objects.create(deck=self.deck, problem=other)
+        self.assertEqual(
+            membership.check_consistency(), {self.deck.pk: ({self.problem.pk}, {other.pk})}
+        )
+        membership.rebuild_all()
+        self.assertEqual(membership.check_consistency(), {})
+
+
+class TagIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.algebra, cls.hard = Tag.objects.create(name="algebra"), Tag.objects.create(name="hard")
+            cls.problems = [Problem.objects.create(body=f"Problem {i}") for i in range(12)]
+            for i, problem in enumerate(cls.problems):
+                if i % 2:
+                    problem.tags.add(cls.algebra)
+                if i % 3 == 0:
+                    problem.tags.add(cls.hard)
+            cls.deck = Deck.objects.create(name="Easy algebra")
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.algebra)
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.hard, filter_type=DeckTagFilter.FilterType.EXCLUDE)
+
+    def setUp(self):
+        tag_index.index.warm()
+
+    def tearDown(self):
+        # Test data is rolled back without the index hearing of it
+        tag_index.index.clear()
+
+    def test_bitsets_round_trip(self):
+        ids = [0, 1, 7, 8, 9, 63, 64, 1000, 4097]
+        self.assertEqual(list(tag_index.iter_bits(tag_index.to_bitset(reversed(ids)))), ids)
+        self.assertEqual(tag_index.to_bitset([]), 0)
+
+    def test_problem_sets_match_python_sets(self):
+        rng = random.Random(4)
+        # A dense chunk, a sparse one and a few IDs far away
+        dense = set(rng.sample(range(1 << 16), 30000))
+        sparse = {(1 << 16) + rng.randrange(1 << 16) for _ in range(100)}
+        far = {10**6, 10**6 + 1, 3 * 10**6}
+        a = tag_index.ProblemSet.from_ids(dense | sparse)
+        b = tag_index.ProblemSet.from_ids(set(rng.sample(sorted(dense | sparse | far), 20000)) | far)
+        self.assertIsInstance(a.chunks[0], int)
+        self.assertIsInstance(a.chunks[1], array)
+        expected_a, expected_b = dense | sparse, set(b)
+        self.assertEqual(list(a), sorted(expected_a))
+        self.assertEqual(list(a | b), sorted(expected_a | expected_b))
+        self.assertEqual(list(a - b), sorted(expected_a - expected_b))
+        self.assertEqual(len(b - a), len(expected_b - expected_a))
+
+        for pk in (5, 1 << 16, 10**6 + 2, 5):
+            a.add(pk)
+            expected_a.add(pk)
+        for pk in list(dense)[:27000] + [3 * 10**6]:
+            a.discard(pk)
+            expected_a.discard(pk)
+        self.assertEqual(list(a), sorted(expected_a))
+        # The chunk emptied out of most of its IDs is an array again
+        self.assertIsInstance(a.chunks[0], array)
+
+    def test_warm_matches_the_database(self):
+        index = tag_index.TagBitsetIndex()
+        index.warm()
+        algebra, hard = [self.algebra.pk], [self.hard.pk]
+        for include, exclude in (([], []), (algebra, []), (algebra, hard), ([], hard)):
+            with self.subTest(include=include, exclude=exclude):
+                expected = Problem.objects.all()
+                if include:
+                    expected = expected.filter(tags__in=include)
+                if exclude:
+                    expected = expected.exclude(tags__in=exclude)
+                self.assertEqual(index.problem_ids(include, exclude), sorted(expected.values_list('pk', flat=True)))
+
+    def test_deck_lookups_follow_tag_changes(self):
+        self.assertEqual(self.deck.problem_ids(), sorted(self.deck.match_problems().values_list('pk', flat=True)))
+        problem = self.problems[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            problem.tags.add(self.algebra)
+            problem.tags.remove(self.hard)
+        self.assertIn(problem.pk, self.deck.problem_ids())
+        with self.captureOnCommitCallbacks(execute=True):
+            added = Problem.objects.create(body="New")
+            added.tags.add(self.algebra)
+        self.assertEqual(self.deck.problem_ids(), sorted(self.deck.match_problems().values_list('pk', flat=True)))
+        self.assertEqual(tag_index.deck_count(self.deck), self.deck.match_problems().count())
+
+    def test_changes_during_a_build_are_replayed(self):
+        index = tag_index.TagBitsetIndex()
+        problem = self.problems[1]
+        build = index.build
+
+        def build_then_change():
+            result = build()
+            # Committed after the build read the tags
+            index.remove_tag(problem.pk, self.algebra.pk)
+            index.add_tag(self.problems[0].pk, self.algebra.pk)
+            return result
+
+        with mock.patch.object(index, 'build', build_then_change):
+            index.warm()
+        algebra = index.problem_ids([self.algebra.pk])
+        self.assertNotIn(problem.pk, algebra)
+        self.assertIn(self.problems[0].pk, algebra)
+        self.assertIsNone(index.pending)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 is SQLite-specific')
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.integral = Problem.objects.create(body="<p>Integrate <strong>\\frac{1}{x}</strong> over [1, e]</p>")
+            Hint.objects.create(problem=cls.integral, body="<p>Think of the logarithm</p>")
+            cls.geometry = Problem.objects.create(body="<p>Find the area of the triangle</p>")
+
+    def found(self, text):
+        return [pk for pk, _ in search.search(text)]
+
+    def test_prefix_and_latex_terms_match(self):
+        self.assertEqual(self.found("integ"), [self.integral.pk])
+        self.assertEqual(self.found("\\frac"), [self.integral.pk])
+        self.assertEqual(self.found("logarithm"), [self.integral.pk])
+        self.assertEqual(self.found("area tri"), [self.geometry.pk])
+        self.assertEqual(self.found("area logarithm"), [])
+        _, snippet = search.search("triangle")[0]
+        self.assertIn("<mark>triangle</mark>", snippet)
+
+    def test_punctuation_only_queries_match_nothing(self):
+        for text in ('!!!', '"', '""', '(', '*', '-', 'NEAR(', 'AND'):
+            with self.subTest(text=text):
+                self.assertEqual(search.search(text), [])
+                self.assertEqual(self.client.get(reverse('problems:problem-search'), {'q': text}).status_code, 200)
+        self.assertIsNone(search.to_match_query('  "" '))
+
+    def test_index_follows_body_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            problem = Problem.objects.get(pk=self.geometry.pk)
+            problem.body = "<p>Find the volume of the cube</p>"
+            problem.save()
+            Solution.objects.create(problem=problem, body="<p>Cubing the side</p>")
+        self.assertEqual(self.found("triangle"), [])
+        self.assertEqual(self.found("volume"), [problem.pk])
+        self.assertEqual(self.found("cubing"), [problem.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            problem.delete()
+        self.assertEqual(self.found("volume"), [])
+
+    def test_admin_search_uses_the_index(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:problems_problem_changelist'), {'q': 'logarithm'})
+        self.assertEqual([problem.pk for problem in response.context['cl'].result_list], [self.integral.pk])
+
+
+class DeckViewsQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Deck membership is maintained on commit
+        with cls.captureOnCommitCallbacks(execute=True):
+            tags = [Tag.objects.create(name=f"tag-{i}") for i in range(6)]
+            for i in range(30):
+                problem = Problem.objects.create(body=f"Problem {i}")
+                problem.tags.add(tags[i % 6], tags[(i + 1) % 6])
+            for i in range(6):
+                deck = Deck.objects.create(name=f"Deck {i}")
+                DeckTagFilter.objects.create(deck=deck, tag=tags[i])
+                DeckTagFilter.objects.create(
+                    deck=deck, tag=tags[(i + 2) % 6], filter_type=DeckTagFilter.FilterType.EXCLUDE
+                )
+        cls.deck = Deck.objects.get(name="Deck 0")
+
+    def setUp(self):
+        # Rendered pages are cached
+        cache.clear()
+
+    def add_decks(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = Tag.objects.first()
+            for i in range(count):
+                deck = Deck.objects.create(name=f"Extra deck {i}")
+                DeckTagFilter.objects.create(deck=deck, tag=tag)
+
+    def test_deck_list_query_count_does_not_depend_on_deck_count(self):
+        # The validators, the decks and their filters
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('problems:deck-list'))
+        self.assertEqual(len(response.context['object_list']), 6)
+
+        self.add_decks(20)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('problems:deck-list'))
+        self.assertEqual(len(response.context['object_list']), 26)
+
+    def test_deck_list_counts_and_tags(self):
+        response = self.client.get(reverse('problems:deck-list'))
+        decks = {deck.name: deck for deck in response.context['object_list']}
+        deck = decks["Deck 0"]
+        self.assertEqual(deck.problem_count, deck.match_problems().count())
+        self.assertEqual([t.name for t in deck.include_tags], ["tag-0"])
+        self.assertEqual([t.name for t in deck.exclude_tags], ["tag-2"])
+
+    def test_deck_detail_query_count(self):
+        url = reverse('problems:deck-detail', args=[self.deck.pk])
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.context['object'].problem_count, self.deck.problems.count())
+        self.assertEqual(
+            len(response.context['problems_page']),
+            min(self.deck.problems.count(), 10),
+        )
+
+        with self.assertNumQueries(5):
+            self.client.get(url, {'page': 2})
+
+
+class ProblemListViewQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        target = Problem.objects.create(body="Linked problem")
+        for i in range(60):
+            problem = Problem.objects.create(body=f"Problem {i} links to [[problem:{target.pk}]]")
+            problem.tags.add(f"tag-{i % 4}")
+            for _ in range(i % 3):
+                Attempt.objects.create(problem=problem, end_time=timezone.now(), time_taken=timedelta(minutes=i))
+
+    def get_page(self, paginate_by, page=1):
+        request = RequestFactory().get('/problems/', {'page': page})
+        response = ProblemListView.as_view(paginate_by=paginate_by, cache_pages=False)(request)
+        response.render()
+        return response
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for paginate_by in (5, 50):
+            # The approximate total is counted once, then cached
+            cache.clear()
+            with self.subTest(paginate_by=paginate_by), self.assertNumQueries(2):
+                response = self.get_page(paginate_by)
+            self.assertEqual(len(response.context_data['problem_list']), paginate_by)
+            with self.subTest(paginate_by=paginate_by), self.assertNumQueries(1):
+                self.get_page(paginate_by)
+
+    def test_offset_pagination_query_count(self):
+        for paginate_by in (5, 50):
+            request = RequestFactory().get('/problems/', {'page': 2})
+            view = ProblemListView.as_view(
+                paginate_by=paginate_by, pagination_mode='offset', cache_pages=False,
+            )
+            with self.subTest(paginate_by=paginate_by), self.assertNumQueries(2):
+                view(request).render()
+
+    def test_keyset_pages_walk_the_whole_list(self):
+        expected = list(Problem.objects.values_list('pk', flat=True))
+        seen, cursor = [], None
+        while True:
+            request = RequestFactory().get('/problems/', {'cursor': cursor} if cursor else {})
+            page = ProblemListView.as_view(paginate_by=7, cache_pages=False)(request).context_data['page_obj']
+            seen += [problem.pk for problem in page]
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+
+        # Going back from the last page lands on the one before it
+        request = RequestFactory().get('/problems/', {'cursor': page.previous_cursor})
+        previous = ProblemListView.as_view(paginate_by=7, cache_pages=False)(request).context_data['page_obj']
+        self.assertEqual([problem.pk for problem in previous], expected[-len(page) - 7:-len(page)])
+
+    def test_attempt_counts_are_annotated(self):
+        response = self.get_page(50)
+        for problem in response.context_data['problem_list']:
+            self.assertEqual(problem.attempt_count, problem.attempts.count())
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        with cls.captureOnCommitCallbacks(execute=True):
+            tags = [Tag.objects.create(name=f"tag-{i}") for i in range(80)]
+            for i in range(120):
+                problem = Problem.objects.create(body=f"Problem {i}")
+                problem.tags.add(tags[i % 80], tags[(i + 7) % 80])
+            for i in range(30):
+                deck = Deck.objects.create(name=f"Deck {i}")
+                DeckTagFilter.objects.create(deck=deck, tag=tags[i])
+                DeckTagFilter.objects.create(
+                    deck=deck, tag=tags[i + 40], filter_type=DeckTagFilter.FilterType.EXCLUDE
+                )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def count_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_problem_changelist_query_count_does_not_depend_on_page_size(self):
+        url = reverse('admin:problems_problem_changelist')
+        counts = []
+        for per_page in (10, 100):
+            with mock.patch.object(ProblemAdmin, 'list_per_page', per_page):
+                counts.append(self.count_queries(url))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_deck_changelist_query_count_does_not_depend_on_deck_count(self):
+        url = reverse('admin:problems_deck_changelist')
+        before = self.count_queries(url)
+        Deck.objects.bulk_create([Deck(name=f"Extra {i}") for i in range(20)])
+        self.assertEqual(self.count_queries(url), before)
+
+    def test_tag_filter_switches_to_search_past_the_limit(self):
+        url = reverse('admin:problems_problem_changelist')
+        response = self.client.get(url, {'tag_q': 'tag-1'})
+        spec = next(f for f in response.context['cl'].filter_specs if f.parameter_name == 'tag')
+        self.assertTrue(spec.is_searchable)
+        self.assertTrue(all('tag-1' in name for _, name in spec.lookup_choices))
+
+    def test_tag_filter_ignores_invalid_ids(self):
+        url = reverse('admin:problems_problem_changelist')
+        for value in ('abc', '1.5', '1 OR 1=1'):
+            with self.subTest(value=value):
+                self.assertEqual(self.client.get(url, {'tag': value, 'tag_q': 'tag-1'}).status_code, 200)
+        tag = Tag.objects.get(name="tag-79")
+        response = self.client.get(url, {'tag': tag.pk, 'tag_q': 'tag-1'})
+        spec = next(f for f in response.context['cl'].filter_specs if f.parameter_name == 'tag')
+        self.assertIn((tag.pk, tag.name), spec.lookup_choices)
+
+
+class PracticeSessionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.tag = Tag.objects.create(name="practice")
+            # Older than the deck's problems
+            cls.outside = Problem.objects.create(body="Outside the deck")
+            for i in range(40):
+                Problem.objects.create(body=f"Problem {i}").tags.add(cls.tag)
+            cls.deck = Deck.objects.create(name="Practice deck")
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.tag)
+
+    def test_permute_is_a_bijection(self):
+        for size in (1, 2, 3, 17, 64, 1000):
+            with self.subTest(size=size):
+                self.assertEqual(sorted(permute(i, size, 1234) for i in range(size)), list(range(size)))
+
+    def step_through(self):
+        url = reverse('problems:deck-practice', args=[self.deck.pk])
+        seen, session_sizes = [], set()
+        while True:
+            response = self.client.get(url)
+            seen.append(response.context['problem_id'])
+            session_sizes.add(len(str(self.client.session[SESSION_KEY])))
+            response = self.client.post(url, {'skip_problem': ''})
+            if response.url != url:
+                # Back to the deck page, the session is over
+                return seen, session_sizes
+
+    def test_session_serves_every_problem_once_with_a_constant_size_state(self):
+        seen, session_sizes = self.step_through()
+        self.assertCountEqual(seen, self.deck.problems.values_list('pk', flat=True))
+        self.assertNotEqual(seen, sorted(seen))
+        # Only the position and the cursor (a 32-bit key) change
+        self.assertLessEqual(max(session_sizes) - min(session_sizes), 2 + 10)
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+    def test_problems_added_mid_session_are_served_at_the_end(self):
+        url = reverse('problems:deck-practice', args=[self.deck.pk])
+        self.client.get(url)
+        self.client.post(url, {'skip_problem': ''})
+        with self.captureOnCommitCallbacks(execute=True):
+            added = Problem.objects.create(body="Added later")
+            added.tags.add(self.tag)
+        seen, _ = self.step_through()
+        self.assertEqual(seen[-1], added.pk)
+        self.assertEqual(len(seen), 40)
+
+    def test_low_id_problems_added_mid_session_are_served_at_the_end(self):
+        url = reverse('problems:deck-practice', args=[self.deck.pk])
+        first = self.client.get(url).context['problem_id']
+        self.client.post(url, {'skip_problem': ''})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.outside.tags.add(self.tag)
+        seen, _ = self.step_through()
+        self.assertEqual(seen[-1], self.outside.pk)
+        self.assertCountEqual([first] + seen, self.deck.problems.values_list('pk', flat=True))
+
+    def test_problems_removed_mid_session_are_skipped_without_moving_the_others(self):
+        url = reverse('problems:deck-practice', args=[self.deck.pk])
+        expected = []
+        self.client.get(url)
+        # The order the session would follow without changes, on an unsaved
+        # copy of it
+        practice = PracticeSession(mock.Mock(session=self.client.session), self.deck)
+        while (problem_id := practice.current_problem_id()) is not None:
+            expected.append(problem_id)
+            practice.advance()
+        self.assertEqual(len(expected), 40)
+
+        seen = [self.client.get(url).context['problem_id']]
+        self.client.post(url, {'skip_problem': ''})
+        removed = expected[5]
+        with self.captureOnCommitCallbacks(execute=True):
+            Problem.objects.get(pk=removed).tags.remove(self.tag)
+        rest, _ = self.step_through()
+        self.assertEqual(seen + rest, [pk for pk in expected if pk != removed])
+
+    def test_steps_read_single_positions_of_the_deck(self):
+        url = reverse('problems:deck-practice', args=[self.deck.pk])
+        self.client.get(url)
+        self.client.post(url, {'skip_problem': ''})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        reads = [q['sql'] for q in queries if 'FROM "problems_deckmembership"' in q['sql']]
+        self.assertTrue(reads)
+        self.assertTrue(all('"position" IN' in sql for sql in reads), reads)
+
+        # Positions of removed memberships are not given to the next ones
+        removed = self.deck.memberships.order_by('position').last()
+        with self.captureOnCommitCallbacks(execute=True):
+            removed.problem.tags.remove(self.tag)
+        with self.captureOnCommitCallbacks(execute=True):
+            removed.problem.tags.add(self.tag)
+        self.assertEqual(self.deck.memberships.get(problem=removed.problem).position, removed.position + 1)
+
+    def test_next_card_is_prefetched_and_served_from_the_cache(self):
+        url = reverse('problems:deck-practice', args=[self.deck.pk])
+        cache.clear()
+        response = self.client.get(url)
+        card_url = response.context['prefetch_urls'][0]
+        self.assertContains(response, f'<link rel="prefetch" href="{card_url}">', html=False)
+        self.assertEqual(self.client.get(card_url).status_code, 200)
+
+        self.client.post(url, {'skip_problem': ''})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(reverse('problems:practice-card', args=[response.context['problem_id']]), card_url)
+        self.assertFalse(any('"problems_problem"' in query['sql'] for query in queries))
+
+
+class FragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.tag = Tag.objects.create(name="cached")
+            cls.problem = Problem.objects.create(body="Cached statement")
+            cls.hint = Hint.objects.create(problem=cls.problem, body="First hint")
+            cls.deck = Deck.objects.create(name="Cached deck")
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.tag)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('problems:problem-detail', args=[self.problem.pk])
+
+    def test_problem_detail_renders_from_the_cache_until_a_change_commits(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(self.url), "Cached statement")
+        self.assertFalse(any('"body_html"' in query['sql'] for query in queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            problem = Problem.objects.get(pk=self.problem.pk)
+            problem.body = "Edited statement"
+            problem.save()
+        self.assertContains(self.client.get(self.url), "Edited statement")
+
+    def test_attempt_state_is_not_cached(self):
+        self.assertContains(self.client.get(self.url), "Start Attempt")
+        self.assertNotContains(self.client.get(self.url), "First hint")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'start_attempt': ''})
+        response = self.client.get(self.url)
+        self.assertContains(response, "Finish Attempt")
+        self.assertContains(response, "First hint")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Hint.objects.create(problem=self.problem, body="Second hint")
+        self.assertContains(self.client.get(self.url), "Second hint")
+
+    def test_list_pages_are_cached_per_version(self):
+        problem_list, deck_list = reverse('problems:problem-list'), reverse('problems:deck-list')
+        self.client.get(problem_list)
+        self.client.get(deck_list)
+        with self.assertNumQueries(0):
+            self.client.get(problem_list)
+        # The validators of the deck list
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(deck_list), '>0</span>')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Problem.objects.create(body="New problem").tags.add(self.tag)
+        self.assertContains(self.client.get(problem_list), "New problem")
+        self.assertContains(self.client.get(deck_list), '>1</span>')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.tag = Tag.objects.create(name="conditional")
+            cls.problem = Problem.objects.create(body="Statement")
+            cls.problem.tags.add(cls.tag)
+            cls.deck = Deck.objects.create(name="Conditional deck")
+            cls.filter = DeckTagFilter.objects.create(deck=cls.deck, tag=cls.tag)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNotModified(self, url, response, num_queries=1):
+        with self.assertNumQueries(num_queries):
+            revalidated = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+
+    def assertModified(self, url, response):
+        revalidated = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(revalidated.status_code, 200)
+        return revalidated
+
+    def test_problem_detail_follows_its_parts_and_attempts(self):
+        url = reverse('problems:problem-detail', args=[self.problem.pk])
+        response = self.client.get(url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotModified(url, response)
+        self.assertEqual(
+            self.client.get(url, headers={'If-Modified-Since': response['Last-Modified']}).status_code, 304
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Hint.objects.create(problem=self.problem, body="A hint")
+        response = self.assertModified(url, response)
+
+        self.client.post(url, {'start_attempt': ''})
+        response = self.assertModified(url, response)
+        self.assertContains(response, "Finish Attempt")
+
+    def test_deck_pages_follow_filters_and_problems(self):
+        detail, deck_list = reverse('problems:deck-detail', args=[self.deck.pk]), reverse('problems:deck-list')
+        responses = {url: self.client.get(url) for url in (detail, deck_list)}
+        for url, response in responses.items():
+            self.assertNotModified(url, response)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            problem = Problem.objects.get(pk=self.problem.pk)
+            problem.body = "Edited statement"
+            problem.save()
+        responses[detail] = self.assertModified(detail, responses[detail])
+        self.assertContains(responses[detail], "Edited statement")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.filter.delete()
+        for url, response in responses.items():
+            self.assertModified(url, response)
+
+        # Deleting a deck leaves the latest modification time as it was
+        other = Deck.objects.create(name="Another deck")
+        Deck.objects.filter(pk=self.deck.pk).touch()
+        response = self.client.get(deck_list)
+        other.delete()
+        self.assertModified(deck_list, response)
+
+    def test_deck_pages_follow_tag_renames(self):
+        detail, deck_list = reverse('problems:deck-detail', args=[self.deck.pk]), reverse('problems:deck-list')
+        responses = {url: self.client.get(url) for url in (detail, deck_list)}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = "renamed"
+            self.tag.save()
+        for url, response in responses.items():
+            with self.subTest(url=url):
+                self.assertContains(self.assertModified(url, response), "renamed")
+
+    def test_problem_list_follows_the_list_version(self):
+        url = reverse('problems:problem-list')
+        response = self.client.get(url)
+        self.assertNotModified(url, response, num_queries=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Attempt.objects.start(self.problem.pk)
+        self.assertModified(url, response)
+
+
+class ProblemStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.problem = Problem.objects.create(body="Problem")
+
+    def finish(self, minutes):
+        attempt = Attempt.objects.start(self.problem.pk)
+        attempt.end_time = attempt.start_time + timedelta(minutes=minutes)
+        attempt.time_taken = timedelta(minutes=minutes)
+        attempt.save()
+        return attempt
+
+    def assertStatsMatchAttempts(self):
+        fields = ['problem_id', 'attempt_count', 'completed_count', 'total_time', 'min_time', 'max_time']
+        stats = list(ProblemStats.objects.values(*fields))
+        recompute_stats()
+        self.assertEqual(stats, list(ProblemStats.objects.values(*fields)))
+
+    def test_stats_follow_attempts(self):
+        short, _, long = self.finish(3), self.finish(5), self.finish(10)
+        active = Attempt.objects.start(self.problem.pk)
+        stats = ProblemStats.objects.get(problem=self.problem)
+        self.assertEqual((stats.attempt_count, stats.completed_count), (4, 3))
+        self.assertEqual((stats.min_time, stats.max_time), (timedelta(minutes=3), timedelta(minutes=10)))
+        self.assertEqual(stats.mean_time, timedelta(minutes=6))
+        self.assertStatsMatchAttempts()
+
+        active.delete()
+        short.delete()
+        Attempt.objects.filter(pk=long.pk).delete()
+        stats = ProblemStats.objects.get(problem=self.problem)
+        self.assertEqual((stats.attempt_count, stats.completed_count), (1, 1))
+        self.assertEqual((stats.min_time, stats.max_time), (timedelta(minutes=5), timedelta(minutes=5)))
+        self.assertStatsMatchAttempts()
+
+    def test_one_active_attempt_per_problem(self):
+        attempt = Attempt.objects.start(self.problem.pk)
+        # A concurrent start gets the attempt already in progress
+        self.assertEqual(Attempt.objects.start(self.problem.pk), attempt)
+        self.assertEqual(Attempt.objects.active().filter(problem=self.problem).count(), 1)
+        self.assertEqual(ProblemStats.objects.get(problem=self.problem).attempt_count, 1)
+
+
+class AttemptAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.tag = Tag.objects.create(name="algebra")
+            cls.problems = [Problem.objects.create(body=f"Problem {i}") for i in range(4)]
+            for problem in cls.problems[:2]:
+                problem.tags.add(cls.tag)
+            cls.deck = Deck.objects.create(name="Algebra")
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.tag)
+
+    def finish(self, problem, minutes):
+        attempt = Attempt.objects.start(problem.pk)
+        attempt.end_time = timezone.now()
+        attempt.time_taken = timedelta(minutes=minutes)
+        attempt.save()
+        return attempt
+
+    def stats(self, **params):
+        return self.client.get(reverse('problems:attempt-stats-json'), params).json()
+
+    def test_sketch_quantiles_are_within_the_relative_accuracy(self):
+        rng = random.Random(0)
+        values = [rng.lognormvariate(5, 1.5) for _ in range(5000)]
+        first, second = LogHistogram(), LogHistogram()
+        for i, value in enumerate(values):
+            (first if i % 2 else second).add(value)
+        merged = first.merge(second)
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(merged.quantile(q) / exact, 1, delta=RELATIVE_ACCURACY * 1.01)
+
+    def test_stats_are_revalidated_until_an_attempt_finishes(self):
+        for url in (reverse('problems:attempt-stats-json'), reverse('problems:attempt-stats')):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.finish(self.problems[0], 5)
+                response = self.client.get(url, headers={'if-none-match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_finished_attempts_are_counted_per_tag_and_deck(self):
+        for minutes in (1, 2, 3, 10):
+            self.finish(self.problems[0], minutes)
+        self.finish(self.problems[3], 60)
+        Attempt.objects.start(self.problems[1].pk)
+        discarded = self.finish(self.problems[1], 30)
+
+        discarded.delete()
+        deck = self.stats(scope='deck', id=self.deck.pk)
+        self.assertEqual(deck['count'], 4)
+        self.assertAlmostEqual(deck['p50'], 120, delta=120 * RELATIVE_ACCURACY)
+        self.assertEqual(self.stats(scope='tag', id=self.tag.pk)['count'], 4)
+        self.assertEqual(self.stats()['count'], 5)
+        self.assertEqual(self.stats(scope='problem', id=[self.problems[0].pk, self.problems[3].pk])['count'], 5)
+        self.assertEqual(self.stats(scope='day', days=1)['days'][0]['count'], 5)
+
+        # Incremental updates and the backfill agree
+        incremental = {(row.scope, row.key): row.data for row in TimeSketch.objects.all()}
+        analytics.backfill(chunk_size=2)
+        self.assertEqual({(row.scope, row.key): row.data for row in TimeSketch.objects.all()}, incremental)
+
+    def test_attempts_leave_the_sketches_they_were_counted_in(self):
+        problem = self.problems[0]
+        attempt = self.finish(problem, 5)
+        self.finish(self.problems[1], 7)
+        other = Tag.objects.create(name="geometry")
+        with self.captureOnCommitCallbacks(execute=True):
+            problem.tags.set([other])
+        self.finish(self.problems[2], 9).problem.tags.add(other)
+
+        Attempt.objects.get(pk=attempt.pk).delete()
+        self.assertEqual(self.stats(scope='tag', id=self.tag.pk)['count'], 1)
+        self.assertEqual(self.stats(scope='deck', id=self.deck.pk)['count'], 1)
+        # Counted before the problem was tagged, so not in its sketch
+        self.assertEqual(self.stats(scope='tag', id=other.pk)['count'], 0)
+        self.assertEqual(self.stats()['count'], 2)
+
+    def test_reads_do_not_depend_on_the_number_of_attempts(self):
+        self.finish(self.problems[0], 5)
+        with self.assertNumQueries(1):
+            self.stats(scope='tag', id=self.tag.pk)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('problems:attempt-stats'))
+        for i in range(20):
+            self.finish(self.problems[i % 4], i + 1)
+        with self.assertNumQueries(len(before)):
+            response = self.client.get(reverse('problems:attempt-stats'))
+        self.assertEqual(response.context['overall']['count'], 21)
+
+
+class SchedulingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.tag = Tag.objects.create(name="review")
+            cls.problems = [Problem.objects.create(body=f"Problem {i}") for i in range(5)]
+            for problem in cls.problems:
+                problem.tags.add(cls.tag)
+            cls.deck = Deck.objects.create(name="Review deck")
+            DeckTagFilter.objects.create(deck=cls.deck, tag=cls.tag)
+
+    def review(self, grade):
+        url = reverse('problems:deck-review', args=[self.deck.pk])
+        problem_id = self.client.get(url).context['problem_id']
+        self.client.post(url, {'start_attempt': '', 'problem_id': problem_id})
+        self.client.post(url, {'finish_attempt': '', 'grade': grade, 'problem_id': problem_id})
+        return problem_id
+
+    def test_actions_apply_to_the_problem_shown(self):
+        url = reverse('problems:deck-review', args=[self.deck.pk])
+        shown = self.client.get(url).context['problem_id']
+        self.client.post(url, {'start_attempt': '', 'problem_id': shown})
+        # Another problem became more overdue in the meantime
+        other = next(problem.pk for problem in self.problems if problem.pk != shown)
+        DeckMembership.objects.filter(problem_id=other).update(next_due=timezone.now() - timedelta(days=1))
+        self.client.post(url, {'finish_attempt': '', 'grade': Attempt.Grade.GOOD, 'problem_id': shown})
+        self.assertTrue(Attempt.objects.filter(problem_id=shown, end_time__isnull=False).exists())
+        self.assertFalse(Attempt.objects.filter(problem_id=other).exists())
+
+        # Problems that are not due, or not in the deck, are left alone
+        outside = Problem.objects.create(body="Not in the deck")
+        for problem_id in (shown, outside.pk, 'x'):
+            self.client.post(url, {'start_attempt': '', 'problem_id': problem_id})
+        self.assertEqual(Attempt.objects.count(), 1)
+
+    def test_reviews_schedule_the_next_due_date(self):
+        reviewed = [self.review(Attempt.Grade.GOOD) for _ in self.problems]
+        self.assertCountEqual(reviewed, [problem.pk for problem in self.problems])
+        response = self.client.get(reverse('problems:deck-review', args=[self.deck.pk]))
+        self.assertTemplateUsed(response, 'problems/no_problems.html')
+
+        schedule = ReviewSchedule.objects.get(problem_id=reviewed[0])
+        self.assertEqual((schedule.interval, schedule.repetitions), (1, 1))
+        self.assertEqual(
+            set(DeckMembership.objects.filter(problem_id=reviewed[0]).values_list('next_due', flat=True)),
+            {schedule.next_due},
+        )
+        later = timezone.now() + timedelta(days=2)
+        self.assertCountEqual(
+            scheduling.due_problem_ids(self.deck, limit=10, now=later), reviewed,
+        )
+
+    def test_replay_matches_incremental_reviews(self):
+        for grade in (Attempt.Grade.GOOD, Attempt.Grade.AGAIN, Attempt.Grade.EASY):
+            self.review(grade)
+        incremental = list(ReviewSchedule.objects.order_by('pk').values())
+        due = list(DeckMembership.objects.order_by('pk').values_list('next_due', flat=True))
+        scheduling.reschedule(batch_size=2)
+        self.assertEqual(list(ReviewSchedule.objects.order_by('pk').values()), incremental)
+        self.assertEqual(list(DeckMembership.objects.order_by('pk').values_list('next_due', flat=True)), due)
+
+    def test_intervals_stop_growing(self):
+        schedule = ReviewSchedule(problem_id=self.problems[0].pk)
+        for _ in range(40):
+            scheduling.next_state(schedule, Attempt.Grade.EASY, timezone.now())
+        self.assertEqual(schedule.interval, scheduling.MAX_INTERVAL)
+
+    def test_due_queue_is_an_index_range_scan(self):
+        plan = self.deck.memberships.filter(next_due__lte=timezone.now()).order_by(
+            'next_due', 'problem_id'
+        ).values_list('problem_id', flat=True)[:1].explain()
+        self.assertIn('membership_deck_due_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class ImportProblemsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.deck = Deck.objects.create(name="Algebra")
+            DeckTagFilter.objects.create(deck=cls.deck, tag=Tag.objects.create(name="Algebra"))
+
+    def records(self, count):
+        return [
+            {
+                'body': f"<p>Integral {i} <script>x</script></p>",
+                'hints': [f"Hint {i}"],
+                'solutions': [f"Solution {i}", "Another one"],
+                'tags': ["Algebra", f"Chapter {i % 3}"],
+                'book_source': {'title': "Analysis", 'author': "Rudin"},
+                'page_number': 10 + i // 4,
+                'problem_number': str(i % 4),
+            }
+            for i in range(count)
+        ]
+
+    def test_imports_invalidate_the_cached_list_and_deck_pages(self):
+        cache.clear()
+        list_url = reverse('problems:problem-list')
+        deck_url = reverse('problems:deck-detail', args=[self.deck.pk])
+        etag = self.client.get(list_url)['ETag']
+        self.client.get(deck_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            importing.import_problems(self.records(3))
+        self.assertContains(self.client.get(list_url, headers={'If-None-Match': etag}), "Integral 2")
+        self.assertContains(self.client.get(deck_url), "Integral 2")
+
+    def test_import_jsonl_in_batches_and_skip_duplicates(self):
+        lines = io.StringIO('\n'.join(json.dumps(record) for record in self.records(25)))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(importing.import_problems(importing.read_jsonl(lines), batch_size=10), (25, 0))
+        # A fixed number of queries per batch, not per problem
+        self.assertLess(len(queries), 25 * 3)
+
+        problem = Problem.objects.get(body__startswith="<p>Integral 7 ")
+        self.assertNotIn('<script>', problem.body_html)
+        self.assertEqual(problem.hints.count(), 1)
+        self.assertEqual(problem.solutions.count(), 2)
+        self.assertCountEqual(problem.tags.names(), ["Algebra", "Chapter 1"])
+        self.assertEqual(self.deck.problems.count(), 25)
+        if search.is_available():
+            self.assertEqual(Problem.objects.filter(pk__in=search.matching_ids("Integral")).count(), 25)
+
+        lines = io.StringIO('\n'.join(json.dumps(record) for record in self.records(30)))
+        self.assertEqual(importing.import_problems(importing.read_jsonl(lines), batch_size=10), (5, 25))
+        self.assertEqual(Tag.objects.filter(name__startswith="Chapter").count(), 3)
+
+    def test_import_csv(self):
+        stream = io.StringIO(
+            'body,hints,tags,book_title,book_author,page_number,problem_number\n'
+            '"<p>First</p>","[""A hint""]","Algebra, Geometry",Analysis,Rudin,3,1\n'
+            '<p>Second</p>,,,,,,\n'
+        )
+        self.assertEqual(importing.import_problems(importing.read_csv(stream)), (2, 0))
+        first = Problem.objects.get(body="<p>First</p>")
+        self.assertEqual(str(first.book_source), "Analysis by Rudin")
+        self.assertCountEqual(first.tags.names(), ["Algebra", "Geometry"])
+        self.assertEqual(first.hints.get().body, "A hint")
+
+
+class GenerateProblemsTests(TestCase):
+    def generate(self, **options):
+        call_command('generate_problems', stdout=io.StringIO(), **options)
+
+    def test_generates_a_reproducible_dataset(self):
+        self.generate(problems=40, tags=12, decks=4, attempts=200, seed=3, batch_size=15)
+        self.assertEqual(Problem.objects.count(), 40)
+        self.assertEqual(Tag.objects.count(), 12)
+        self.assertEqual(Deck.objects.count(), 4)
+        self.assertEqual(Attempt.objects.filter(end_time__isnull=False).count(), 200)
+        first = list(Problem.objects.order_by('pk').values_list('pk', 'body'))
+
+        # Derived tables are built as if every row went through the signals
+        self.assertEqual(membership.check_consistency(), {})
+        self.assertEqual(TimeSketch.objects.get(scope=TimeSketch.Scope.ALL).count, 200)
+        self.assertEqual(ProblemStats.objects.aggregate(n=Sum('completed_count'))['n'], 200)
+        if search.is_available():
+            self.assertEqual(Problem.objects.filter(pk__in=search.matching_ids("integral")).count(),
+                             Problem.objects.filter(body__icontains="integral").count())
+
+        # Same seed, same data, and the old data is gone
+        self.generate(problems=40, tags=12, decks=4, attempts=200, seed=3, batch_size=15)
+        self.assertEqual(Problem.objects.count(), 40)
+        self.assertEqual(list(Problem.objects.order_by('pk').values_list('pk', 'body')), first)
+
+
+class BenchmarkViewsTests(TestCase):
+    def test_last_page_url_reaches_the_last_page(self):
+        call_command('generate_problems', problems=23, attempts=0, seed=0, stdout=io.StringIO())
+        response = self.client.get(benchmarks.last_problem_list_page_url())
+        oldest = Problem.objects.order_by('pub_date', 'pk').values_list('pk', flat=True)[:3]
+        self.assertCountEqual([problem.pk for problem in response.context['problem_list']], oldest)
+        self.assertFalse(response.context['page_obj'].has_next())
+
+    def test_cached_pages_are_measured_rendering(self):
+        budgets = {view: {'median_ms': 10 ** 6} for view in BENCHMARKED_VIEWS}
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(benchmark_views, 'throwaway_database', nullcontext):
+            with open(f'{directory}/budgets.json', 'w') as f:
+                json.dump(budgets, f)
+            call_command(
+                'benchmark_views', sizes='30', repeat=2, steps=2, stdout=io.StringIO(),
+                budgets=f'{directory}/budgets.json', output=f'{directory}/results.json',
+            )
+            with open(f'{directory}/results.json') as f:
+                results = {result['view']: result for result in json.load(f)['results']}
+        self.assertEqual(set(results), set(BENCHMARKED_VIEWS))
+        for view in ('problem-list', 'problem-list-last-page', 'deck-list', 'deck-detail'):
+            with self.subTest(view=view):
+                # Read from the cache, the page would not query at all
+                self.assertGreater(results[view]['queries'], 0)
+
+
+class ExportProblemsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            source = BookSource.objects.create(title="Analysis", author="Rudin")
+            cls.problems = []
+            for i in range(7):
+                problem = Problem.objects.create(
+                    body=f'<p>Problem {i} <img src="{settings.MEDIA_URL}tiptap_uploads/figure{i % 2}.png"'
+                         + (f' srcset="{settings.MEDIA_URL}tiptap_uploads/figure1-480w.webp 480w, '
+                            f'{settings.MEDIA_URL}tiptap_uploads/figure1.png 960w"' if i % 2 else '')
+                         + '></p>',
+                    book_source=source if i % 2 else None, page_number=i, problem_number=str(i),
+                )
+                problem.tags.add("Algebra", f"Chapter {i % 3}")
+                problem.hints.create(body=f"Hint {i}")
+                problem.solutions.create(body=f"First solution {i}")
+                problem.solutions.create(body=f"Second solution {i}")
+                cls.problems.append(problem)
+            Attempt.objects.create(problem=problem, end_time=timezone.now(), time_taken=timedelta(minutes=3))
+            # A link to a problem exported later, and one to a problem
+            # exported earlier
+            first, second = cls.problems[1].solutions.order_by('pk')
+            first.body = f"First solution 1, as in [[problem:{cls.problems[6].pk}]]"
+            first.save()
+            cls.problems[5].body += f"<p>Like [[problem:{cls.problems[2].pk}]]</p>"
+            cls.problems[5].save()
+
+    def snapshot(self):
+        # Links by the number of the linked problem, which keeps it
+        numbers = dict(Problem.objects.values_list('pk', 'problem_number'))
+
+        def links(text):
+            return PROBLEM_LINK_PATTERN.sub(lambda match: f"[[#{numbers.get(int(match.group(1)))}]]", text)
+
+        return sorted(
+            (links(r['body']), [links(text) for text in r['hints']], [links(text) for text in r['solutions']],
+             r['tags'], r.get('book_source'), r['pub_date'])
+            for r in exporting.export_records()
+        )
+
+    def test_export_round_trips_through_the_importer(self):
+        with CaptureQueriesContext(connection) as queries:
+            records = list(exporting.export_records(chunk_size=3))
+        # One query for the problems, read a chunk at a time, and three
+        # prefetches per chunk
+        self.assertEqual(len(queries), 1 + 3 * 3)
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records[-1]['stats']['completed_count'], 1)
+        self.assertEqual(records[-1]['solutions'], ["First solution 6", "Second solution 6"])
+
+        before = self.snapshot()
+        self.assertIn("[[#6]]", str(before))
+        lines = io.StringIO(''.join(exporting.to_jsonl(record) for record in records))
+        Problem.objects.all().delete()
+        # The imported problems get other IDs than the exported ones
+        placeholder = Problem.objects.create(body="Placeholder")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(importing.import_problems(importing.read_jsonl(lines), batch_size=3), (7, 0))
+        placeholder.delete()
+        self.assertEqual(self.snapshot(), before)
+        linked = Problem.objects.get(problem_number="2")
+        self.assertNotEqual(linked.pk, self.problems[2].pk)
+        self.assertIn(
+            f'href="{reverse("problems:problem-detail", args=[linked.pk])}"',
+            Problem.objects.get(problem_number="5").body_html,
+        )
+        self.assertIn(
+            f'href="{reverse("problems:problem-detail", args=[Problem.objects.get(problem_number="6").pk])}"',
+            Solution.objects.get(body__startswith="First solution 1").body_html,
+        )
+
+    def test_archive_bundles_the_referenced_images(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            default_storage.save('tiptap_uploads/figure0.png', ContentFile(b'first image'))
+            default_storage.save('tiptap_uploads/figure1.png', ContentFile(b'second image'))
+            default_storage.save('tiptap_uploads/figure1-480w.webp', ContentFile(b'smaller second image'))
+            default_storage.save('tiptap_uploads/unused.png', ContentFile(b'unused'))
+            archive = b''.join(exporting.archive_chunks(chunk_size=2))
+            with zipfile.ZipFile(io.BytesIO(archive)) as f:
+                self.assertCountEqual(f.namelist(), [
+                    'problems.jsonl', 'media/tiptap_uploads/figure0.png', 'media/tiptap_uploads/figure1.png',
+                    'media/tiptap_uploads/figure1-480w.webp',
+                ])
+
+            before = self.snapshot()
+            Problem.objects.all().delete()
+            default_storage.delete('tiptap_uploads/figure1.png')
+            default_storage.delete('tiptap_uploads/figure1-480w.webp')
+            self.assertEqual(importing.import_archive(io.BytesIO(archive)), (7, 0))
+            self.assertEqual(self.snapshot(), before)
+            with default_storage.open('tiptap_uploads/figure1.png') as image:
+                self.assertEqual(image.read(), b'second image')
+            with default_storage.open('tiptap_uploads/figure1-480w.webp') as image:
+                self.assertEqual(image.read(), b'smaller second image')
+
+    def test_export_view_is_staff_only(self):
+        url = reverse('problems:problem-export')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="problems.jsonl"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['body'] for line in lines][0][:12], '<p>Problem 0')
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+class TiptapUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root.name))
+        self.addCleanup(self.media_root.cleanup)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def upload(self, name, content):
+        return self.client.post(
+            reverse('problems:tiptap-image-upload'), {'image': SimpleUploadedFile(name, content)},
+        )
+
+    def test_uploads_are_stored_once_under_their_hash(self):
+        first = self.upload('figure.png', PNG).json()
+        second = self.upload('figure copy.PNG', PNG).json()
+        digest = hashlib.sha256(PNG).hexdigest()
+        self.assertEqual(first['url'], f"{settings.MEDIA_URL}tiptap_uploads/{digest}.png")
+        self.assertEqual(second, first)
+        self.assertEqual(default_storage.listdir('tiptap_uploads'), ([], [f'{digest}.png']))
+
+    def wait_for_variants(self):
+        # The worker runs one job at a time, in order
+        uploads._executor.submit(lambda: None).result(timeout=60)
+
+    @skipUnless(uploads.Image, "Pillow is not installed")
+    def test_variants_are_generated_in_the_background(self):
+        image = io.BytesIO()
+        uploads.Image.new('RGB', (1000, 10)).save(image, 'PNG')
+        name = f"tiptap_uploads/{hashlib.sha256(image.getvalue()).hexdigest()}.png"
+        variant_url = default_storage.url(uploads.variant_name(name, 480))
+        # Holds the worker until the upload is answered
+        release = threading.Event()
+        self.addCleanup(release.set)
+        uploads._executor.submit(release.wait)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.upload('wide.png', image.getvalue()).json()
+        self.assertEqual(result['srcset'], uploads.srcset(name, [480, 960], 1000))
+        response = self.client.get(variant_url)
+        self.assertEqual((response.status_code, response['Location']), (302, default_storage.url(name)))
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+        release.set()
+        self.wait_for_variants()
+        for width in (480, 960):
+            with default_storage.open(uploads.variant_name(name, width)) as variant:
+                self.assertEqual(uploads.Image.open(variant).size[0], width)
+        self.assertEqual(self.client.get(variant_url).status_code, 200)
+
+    def test_variants_that_fail_fall_back_to_the_original(self):
+        with mock.patch.object(uploads, 'image_width', return_value=1000), \
+                mock.patch.object(uploads, 'make_variants', side_effect=OSError("Disk full")), \
+                self.assertLogs('problems.uploads', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = self.upload('wide.png', PNG).json()
+            self.wait_for_variants()
+        name = f"tiptap_uploads/{hashlib.sha256(PNG).hexdigest()}.png"
+        self.assertEqual(result['srcset'], uploads.srcset(name, [480, 960], 1000))
+        response = self.client.get(default_storage.url(uploads.variant_name(name, 480)))
+        self.assertEqual(response['Location'], default_storage.url(name))
+
+    def test_rejects_files_that_are_not_images(self):
+        self.assertEqual(self.upload('figure.png', b'<svg onload="alert(1)">').status_code, 400)
+        self.assertFalse(default_storage.exists('tiptap_uploads'))
+
+    def test_dedupe_existing_uploads(self):
+        old = [default_storage.save(f'tiptap_uploads/tiptap_uploads/figure {i}.png', ContentFile(PNG)) for i in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            problem = Problem.objects.create(body=f'<p><img src="{default_storage.url(old[1])}"></p>')
+        call_command('dedupe_uploads', stdout=io.StringIO())
+
+        new = f"tiptap_uploads/{hashlib.sha256(PNG).hexdigest()}.png"
+        self.assertEqual(default_storage.listdir('tiptap_uploads'), (['tiptap_uploads'], [new.split('/')[1]]))
+        self.assertEqual(default_storage.listdir('tiptap_uploads/tiptap_uploads'), ([], []))
+        problem.refresh_from_db()
+        self.assertIn(f'src="{default_storage.url(new)}"', problem.body_html)
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root.name))
+        self.addCleanup(self.media_root.cleanup)
+        self.name = default_storage.save(f"tiptap_uploads/{hashlib.sha256(PNG).hexdigest()}.png", ContentFile(PNG))
+        self.url = default_storage.url(self.name)
+
+    def test_content_addressed_files_are_immutable(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), PNG)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, headers={'Range': 'bytes=4-7'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 4-7/{len(PNG)}')
+        self.assertEqual(b''.join(response.streaming_content), PNG[4:8])
+
+        response = self.client.get(self.url, headers={'Range': f'bytes={len(PNG)}-'})
+        self.assertEqual(response.status_code, 416)
+
+    def test_hands_off_to_the_front_proxy(self):
+        with override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+
+    def test_paths_outside_the_media_root(self):
+        self.assertEqual(self.client.get(f'{settings.MEDIA_URL}../manage.py').status_code, 404)
+
+
+class ConcurrentSQLiteSettingsTests(SimpleTestCase):
+    def test_pragmas_are_applied_to_every_connection(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = connections.configure_settings({'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': f'{directory}/db.sqlite3',
+                **settings.SQLITE_CONCURRENT,
+            }})['default']
+            db = load_backend(config['ENGINE']).DatabaseWrapper(config, alias='concurrent')
+            try:
+                with db.cursor() as cursor:
+                    pragmas = {}
+                    for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store'):
+                        cursor.execute(f'PRAGMA {pragma}')
+                        pragmas[pragma] = cursor.fetchone()[0]
+            finally:
+                db.close()
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2})
+        self.assertEqual(db.transaction_mode, 'IMMEDIATE')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite-specific')
+class ExplainHotQueriesTests(TestCase):
+    def test_hot_queries_do_not_scan_or_sort(self):
+        call_command('generate_problems', problems=150, attempts=300, seed=0, stdout=io.StringIO())
+        # Fails with the unaccepted plans
+        call_command('explain_hot_queries', stdout=io.StringIO())
+        self.assertFalse(User.objects.exists())
+
+    def test_limited_index_walks_are_flagged_when_sorted_afterwards(self):
+        findings = explain_hot_queries.Command().findings
+        sql = 'SELECT * FROM "problems_attempt" ORDER BY "end_time" LIMIT 5'
+        walk = 'SCAN problems_attempt USING INDEX problems_attempt_problem_id'
+        self.assertEqual(findings('view', sql, [walk]), [])
+        self.assertEqual(findings('view', sql, [walk, 'USE TEMP B-TREE FOR ORDER BY']), [
+            (walk, None), ('USE TEMP B-TREE FOR ORDER BY', None),
+        ])
+        self.assertEqual(findings('view', sql.replace(' LIMIT 5', ''), [walk]), [(walk, None)])
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        Problem.objects.create(body="<p>Integrate</p>")
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('problems:problem-list'))
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'tpl', 'app'})
+        self.assertIn(f'desc="{len(captured)} queries"', timings['db'])
+
+    def test_slow_requests_are_logged(self):
+        with mock.patch.object(middleware, 'SLOW_REQUEST_MS', 0), \
+                self.assertLogs('palaistra.performance', 'WARNING') as logs:
+            self.client.get(reverse('problems:problem-list'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['path'], record['status'], record['sampled']), ('/problems/', 200, True))
+        self.assertEqual(len(record['top_queries']), min(record['queries'], middleware.TOP_QUERIES))
+
+    def test_unsampled_requests_are_only_timed(self):
+        with mock.patch.object(middleware, 'SAMPLE_RATE', 0):
+            response = self.client.get(reverse('problems:problem-list'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=\d+\.\d$')
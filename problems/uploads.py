@@ -0,0 +1,206 @@
+# palaistra/problems/uploads.py
+"""
+Content-addressed storage of the images uploaded from the Tiptap editor.
+
+`HashingUploadHandler` hashes an upload while Django streams it to its
+temporary file, so the content is read only once. The image is then stored
+as `tiptap_uploads/<sha256>.<ext>`: uploading the same image again finds
+it already stored and writes nothing.
+
+When Pillow is installed, WebP variants of smaller widths are generated by
+a background worker once the upload commits, off the request thread, and
+`srcset` lists them so browsers download the smallest one that fits.
+Until a variant is written, `problems.media` redirects its URL to the
+original image. Without Pillow, images are served as uploaded.
+"""
+import hashlib
+import io
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Django imports
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'tiptap_uploads'
+VARIANT_WIDTHS = getattr(settings, 'UPLOAD_VARIANT_WIDTHS', (480, 960, 1600))
+VARIANT_QUALITY = 80
+# Images are shown at most this wide in problem bodies
+SIZES = '(max-width: 960px) 100vw, 960px'
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+# Magic numbers of the accepted image types
+_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+_CONTENT_NAME_PATTERN = re.compile(rf'{UPLOAD_DIR}/[0-9a-f]{{64}}(-\d+w)?\.\w+')
+_VARIANT_NAME_PATTERN = re.compile(rf'({UPLOAD_DIR}/[0-9a-f]{{64}})-\d+w\.webp')
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-variants')
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Passes every chunk on to the next handler unchanged, keeping the
+    SHA-256 digest of each uploaded file in `digests`, by field name.
+    """
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self.hash.hexdigest()
+
+
+def image_extension(file):
+    """
+    Returns the extension of the image type of `file`, from its first
+    bytes, or None if it is not an accepted image.
+    """
+    file.seek(0)
+    head = file.read(12)
+    file.seek(0)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in _SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def content_name(digest, extension):
+    return f"{UPLOAD_DIR}/{digest}.{extension}"
+
+
+def is_content_name(name):
+    return bool(_CONTENT_NAME_PATTERN.fullmatch(name))
+
+
+def file_digest(file):
+    file.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def variant_name(name, width):
+    return f"{name.rsplit('.', 1)[0]}-{width}w.webp"
+
+
+def original_name(name):
+    """
+    Returns the name of the stored image a variant name was derived from,
+    or None if `name` is not a variant name or the image is not stored.
+    """
+    match = _VARIANT_NAME_PATTERN.fullmatch(name)
+    if match is None:
+        return None
+    for extension in dict.fromkeys(['webp', *(extension for _, extension in _SIGNATURES)]):
+        if default_storage.exists(f"{match.group(1)}.{extension}"):
+            return f"{match.group(1)}.{extension}"
+    return None
+
+
+def image_width(file):
+    """
+    Returns the width of an image as displayed, read from its header, or
+    None without Pillow.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(file) as image:
+            if image.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+                return image.height
+            return image.width
+    except Exception:
+        return None
+    finally:
+        file.seek(0)
+
+
+def make_variants(name, widths):
+    """
+    Writes the missing WebP variants of a stored image.
+    """
+    with default_storage.open(name) as f, Image.open(f) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+        for width in widths:
+            variant = variant_name(name, width)
+            if default_storage.exists(variant):
+                continue
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, 'WEBP', quality=VARIANT_QUALITY)
+            default_storage.save(variant, ContentFile(buffer.getvalue()))
+
+
+def _make_variants_logged(name, widths):
+    try:
+        make_variants(name, widths)
+    except Exception:
+        logger.exception("Could not generate the variants of %s", name)
+
+
+def srcset(name, widths, width):
+    return ', '.join(
+        [f"{default_storage.url(variant_name(name, w))} {w}w" for w in widths]
+        + [f"{default_storage.url(name)} {width}w"]
+    )
+
+
+def store_upload(file, digest):
+    """
+    Stores an uploaded image under its content hash and schedules its
+    missing variants. Returns a dict with its `url`, plus `srcset` and
+    `sizes` when it has variants, or None if `file` is not an accepted
+    image.
+    """
+    extension = image_extension(file)
+    if extension is None:
+        return None
+    name = content_name(digest, extension)
+    # GIFs are left alone, they may be animated
+    width = image_width(file) if extension != 'gif' else None
+    if not default_storage.exists(name):
+        saved = default_storage.save(name, file)
+        if saved != name:
+            # Stored meanwhile by a concurrent upload of the same image
+            default_storage.delete(saved)
+    result = {'url': default_storage.url(name)}
+    widths = [w for w in VARIANT_WIDTHS if width and w < width]
+    missing = [w for w in widths if not default_storage.exists(variant_name(name, w))]
+    if missing:
+        transaction.on_commit(lambda: _executor.submit(_make_variants_logged, name, missing))
+    if widths:
+        result['srcset'] = srcset(name, widths, width)
+        result['sizes'] = SIZES
+    return result
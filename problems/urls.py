@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -7,6 +8,10 @@ urlpatterns = [
     # problems
     # ex: /problems/
     path("problems/", views.ProblemListView.as_view(), name="problem-list"),
+    # ex: /problems/search/?q=integral
+    path("problems/search/", views.problem_search, name="problem-search"),
+    # ex: /problems/export/?images=1
+    path("problems/export/", views.problem_export, name="problem-export"),
     # ex: /problems/5/
     path("problems/<int:pk>/", views.problem_detail, name="problem-detail"),
 
@@ -17,17 +22,22 @@ urlpatterns = [
     path("decks/<int:pk>/", views.DeckDetailView.as_view(), name="deck-detail"),
     # ex /decks/5/practice/
     path('decks/<int:deck_id>/practice/', views.deck_practice, name='deck-practice'),
+    # ex /decks/5/review/
+    path('decks/<int:deck_id>/review/', views.deck_review, name='deck-review'),
+    # ex /practice/cards/5/
+    path('practice/cards/<int:problem_id>/', views.practice_card, name='practice-card'),
+
+    # statistics
+    # ex: /stats/
+    path('stats/', views.attempt_stats, name='attempt-stats'),
+    # ex: /stats/json/?scope=tag&id=3
+    path('stats/json/', views.attempt_stats_json, name='attempt-stats-json'),
 
     # tiptap
     path('tiptap/image-upload/', views.tiptap_image_upload, name='tiptap-image-upload'),
-    
-]
 
-from django.conf.urls.static import static
-from django.conf import settings
-# --- Add this section ---
-# This is for serving media files during development.
-# It is not needed in production, as your web server (e.g., Nginx)
-# should be configured to serve media files directly.
-#if settings.DEBUG:
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # media
+    # ex: /tiptap_uploads/tiptap_uploads/<sha256>.png
+    # Handed off to the front proxy when MEDIA_SENDFILE_HEADER is set
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:name>", views.media_file, name='media-file'),
+]
@@ -1,145 +1,375 @@
-import random
+from functools import partial
 
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils import timezone
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_GET, require_safe
 from django.views.generic import DetailView, ListView
-from .models import Attempt, Deck, Problem
+from taggit.models import Tag
+from .conditional import (
+    conditional, deck_list_validators, deck_validators, problem_list_validators, problem_validators,
+    stats_validators,
+)
+from .models import Attempt, Deck, Problem, TimeSketch
+from .pagination import KeysetPaginator
+from .practice import CARD_CACHE_TIMEOUT, PracticeSession, cached_card, get_card
+from . import analytics, exporting, fragments, media, scheduling, search, uploads
 
+STATS_DAYS = 30
+STATS_TOP_TAGS = 50
+
+# Private: the page holds a CSRF token
+@conditional(lambda request, pk: problem_validators(pk), private=True, no_cache=True)
 def problem_detail(request, pk):
-    problem = get_object_or_404(Problem, pk=pk)
-    active_attempt = Attempt.objects.filter(problem=problem, end_time__isnull=True).first()
+    # The rendered problem is cached, the attempt state around it is not
+    card = get_card(pk)
+    if card is None:
+        raise Http404('No problem matches the given query.')
+    active_attempt = Attempt.objects.active_for(pk)
 
     if request.method == 'POST':
         if 'start_attempt' in request.POST:
-            # Ensure no other attempt is active for this problem before creating a new one
+            # At most one attempt is active per problem, even for concurrent requests
             if not active_attempt:
-                Attempt.objects.create(problem=problem)
+                Attempt.objects.start(pk)
             # Redirect to the same page to show the new state (e.g., active attempt timer)
-            return redirect('problems:problem-detail', pk=problem.pk)
+            return redirect('problems:problem-detail', pk=pk)
         elif 'finish_attempt' in request.POST:
             if active_attempt:
-                active_attempt.end_time = timezone.now()
-                active_attempt.time_taken = active_attempt.end_time - active_attempt.start_time
-                active_attempt.save()
-                return redirect('problems:problem-detail', pk=problem.pk)
+                active_attempt.finish()
+                return redirect('problems:problem-detail', pk=pk)
 
     context = {
-        'problem': problem,
+        'card': card,
         'active_attempt': active_attempt,
     }
     return render(request, 'problems/problem_detail.html', context)
 
+@method_decorator(conditional(lambda request: problem_list_validators(), no_cache=True), name='get')
 class ProblemListView(ListView):
     model = Problem
     paginate_by = 5
     context_object_name = 'problem_list'
     template_name = 'problems/problem_list.html'
-        
+    # 'keyset' pages with opaque cursors at a constant cost whatever the
+    # depth, 'offset' uses Django's numbered pages.
+    pagination_mode = 'keyset'
+    approximate_total = True
+    # Whole pages are cached under the version of the problem list
+    cache_pages = True
+
+    def get(self, request, *args, **kwargs):
+        if not self.cache_pages:
+            return super().get(request, *args, **kwargs)
+        return fragments.cached_page(
+            request, [(fragments.PROBLEM_LIST, 0)], partial(super().get, request, *args, **kwargs),
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.pagination_mode != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(
+            queryset,
+            page_size,
+            count_cache_key='problems:problem-list-count' if self.approximate_total else None,
+        )
+        page = paginator.get_page(self.request.GET.get('cursor'))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_queryset(self):
+        # The list only shows the rendered body and the attempt count
+        return (
+            Problem.objects.with_attempt_count()
+            .only('pk', 'pub_date', 'body_html')
+        )
+
+def problem_search(request):
+    """
+    Full-text search over problems, hints and solutions, best matches first.
+    """
+    query = request.GET.get('q', '').strip()
+    page_size = 20
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    # One row more than needed tells whether there is a next page
+    hits = search.search(query, limit=page_size + 1, offset=(page - 1) * page_size) if query else []
+    has_next = len(hits) > page_size
+
+    context = {
+        'query': query,
+        'results': hits[:page_size],
+        'page': page,
+        'has_next': has_next,
+    }
+    return render(request, 'problems/problem_search.html', context)
+
+@method_decorator(conditional(lambda request: deck_list_validators(), no_cache=True), name='get')
 class DeckListView(ListView):
     model = Deck
 
+    def get(self, request, *args, **kwargs):
+        return fragments.cached_page(
+            request, [(fragments.DECK_LIST, 0)], partial(super().get, request, *args, **kwargs),
+        )
+
+    def get_queryset(self):
+        return Deck.objects.with_filters().with_problem_count()
+
+@method_decorator(conditional(lambda request, pk: deck_validators(pk), no_cache=True), name='get')
 class DeckDetailView(DetailView):
     model = Deck
+    preview_paginate_by = 10
+
+    def get(self, request, *args, **kwargs):
+        # The preview shows the problems' statements
+        return fragments.cached_page(
+            request,
+            [(fragments.DECK, kwargs['pk']), (fragments.PROBLEM_LIST, 0)],
+            partial(super().get, request, *args, **kwargs),
+        )
 
-def _advance_practice_session(request, deck_id):
+    def get_queryset(self):
+        return Deck.objects.with_filters().with_problem_count()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Paginated preview of the problems in the deck
+        paginator = Paginator(self.object.problems.order_by('-pub_date', '-id'), self.preview_paginate_by)
+        context['problems_page'] = paginator.get_page(self.request.GET.get('page'))
+        return context
+
+# The deck and tag names are shown too; renaming a tag bumps the deck list
+@conditional(lambda request: stats_validators(fragments.DECK_LIST), no_cache=True)
+def attempt_stats(request):
+    """
+    Time distributions of finished attempts: overall, over the last days,
+    per deck and for the most attempted tags. Reads sketches only.
+    """
+    tag_rows = (
+        TimeSketch.objects.filter(scope=TimeSketch.Scope.TAG)
+        .order_by('-count')[:STATS_TOP_TAGS]
+    )
+    tag_names = dict(Tag.objects.filter(pk__in=[row.key for row in tag_rows]).values_list('pk', 'name'))
+    decks = list(Deck.objects.order_by('name').values_list('pk', 'name'))
+    deck_summaries = analytics.get_summaries(TimeSketch.Scope.DECK, [pk for pk, _ in decks])
+
+    context = {
+        'overall': analytics.merged_summary(TimeSketch.Scope.ALL, [0]),
+        'days': analytics.daily_volume(STATS_DAYS),
+        'decks': [(name, deck_summaries[pk]) for pk, name in decks if pk in deck_summaries],
+        'tags': [(tag_names.get(row.key, row.key), analytics.summary(row.sketch)) for row in tag_rows],
+    }
+    return render(request, 'problems/attempt_stats.html', context)
+
+@require_GET
+@conditional(lambda request: stats_validators(), no_cache=True)
+def attempt_stats_json(request):
+    """
+    Count, mean and p50/p90 of the time taken, in seconds, for
+    `?scope=all|problem|tag|deck&id=...` (several IDs are merged), or the
+    per-day figures for `?scope=day&days=N`.
+    """
+    scope = request.GET.get('scope', TimeSketch.Scope.ALL)
+    if scope not in TimeSketch.Scope.values:
+        return JsonResponse({'error': f"Unknown scope {scope!r}."}, status=400)
+    try:
+        if scope == TimeSketch.Scope.DAY:
+            days = min(max(int(request.GET.get('days', STATS_DAYS)), 1), 366)
+            return JsonResponse({
+                'scope': scope,
+                'days': [{'date': day.isoformat(), **summary} for day, summary in analytics.daily_volume(days)],
+            })
+        ids = [0] if scope == TimeSketch.Scope.ALL else [int(pk) for pk in request.GET.getlist('id')]
+    except ValueError:
+        return JsonResponse({'error': "Invalid number."}, status=400)
+    return JsonResponse({'scope': scope, 'ids': ids, **analytics.merged_summary(scope, ids)})
+
+def _advance_practice_session(request, practice):
     """
     Helper function to advance the deck practice session to the next problem
     or end the session if all problems have been seen.
     """
-    problem_ids = request.session.get('shuffled_problems', [])
-    request.session['current_problem_index'] += 1
-
-    if request.session.get('current_problem_index', 0) < len(problem_ids):
+    deck_id = practice.deck.pk
+    if practice.advance():
         return redirect('problems:deck-practice', deck_id=deck_id)
     else:
         # End of the deck, clean up session and redirect
-        del request.session['shuffled_problems']
-        del request.session['current_problem_index']
-        del request.session['current_deck_id']
+        practice.end()
         return redirect('problems:deck-detail', pk=deck_id)
 
 def deck_practice(request, deck_id):
     deck = get_object_or_404(Deck, pk=deck_id)
+    practice = PracticeSession(request, deck)
 
-    if 'shuffled_problems' not in request.session or request.session.get('current_deck_id') != deck.id:
-        problem_ids = list(deck.problems.values_list('id', flat=True))
-        random.shuffle(problem_ids)
-        request.session['shuffled_problems'] = problem_ids
-        request.session['current_problem_index'] = 0
-        request.session['current_deck_id'] = deck.id
-
-    problem_ids = request.session.get('shuffled_problems')
-    current_index = request.session.get('current_problem_index', 0)
-
-    if not problem_ids:
+    current_problem_id = practice.current_problem_id()
+    if current_problem_id is None:
+        practice.end()
         return render(request, 'problems/no_problems.html', {'deck': deck})
 
-    current_problem_id = problem_ids[current_index]
-    problem = get_object_or_404(Problem, pk=current_problem_id)
-    
-    active_attempt = Attempt.objects.filter(
-        problem=problem,
-        end_time__isnull=True
-    ).first()
+    active_attempt = Attempt.objects.active_for(current_problem_id)
 
     if request.method == 'POST':
         if 'start_attempt' in request.POST:
             if not active_attempt:
-                Attempt.objects.create(problem=problem)
+                Attempt.objects.start(current_problem_id)
             return redirect('problems:deck-practice', deck_id=deck_id)
         
         elif 'finish_attempt' in request.POST:
             if active_attempt:
-                active_attempt.end_time = timezone.now()
-                active_attempt.time_taken = active_attempt.end_time - active_attempt.start_time
-                active_attempt.save()
-            return _advance_practice_session(request, deck_id)
+                active_attempt.finish()
+            return _advance_practice_session(request, practice)
         
         # New block for the skip button
         elif 'skip_problem' in request.POST:
             # If an attempt is in progress, end it without saving
             if active_attempt:
                 active_attempt.delete() # Or set a flag to mark it as skipped
-            return _advance_practice_session(request, deck_id)
+            return _advance_practice_session(request, practice)
+
+    card = get_card(current_problem_id)
+    if card is None:
+        raise Http404("No Problem matches the given query.")
 
-    attempts_count = problem.attempts.count()
+    # The browser fetches the next card while the current problem is being
+    # solved, which renders it into the cache: moving on is then a cache hit.
+    # Its images are prefetched too once it has been rendered.
+    prefetch_urls = []
+    next_problem_id = practice.next_problem_id()
+    if next_problem_id is not None:
+        prefetch_urls.append(reverse('problems:practice-card', args=[next_problem_id]))
+        next_card = cached_card(next_problem_id)
+        if next_card:
+            prefetch_urls += next_card['images']
 
     context = {
         'deck': deck,
-        'problem': problem,
+        'problem_id': current_problem_id,
+        'card': card,
+        'prefetch_urls': prefetch_urls,
         'active_attempt': active_attempt,
-        'current_index': current_index + 1,
-        'total_problems': len(problem_ids),
-        'attempts_count': attempts_count,
+        'current_index': practice.position + 1,
+        'total_problems': practice.total,
     }
     return render(request, 'problems/deck_practice.html', context)
 
+
+def deck_review(request, deck_id):
+    """
+    Practice of the problems of a deck due for review, most overdue first,
+    then the ones never reviewed. Finishing an attempt grades it and
+    schedules the next review.
+    """
+    deck = get_object_or_404(Deck, pk=deck_id)
+
+    if request.method == 'POST':
+        # The problem the page was showing: the due queue may have moved since
+        problem_id = request.POST.get('problem_id', '')
+        if problem_id.isdigit() and scheduling.is_due(deck, int(problem_id)):
+            _review_action(request, int(problem_id))
+        return redirect('problems:deck-review', deck_id=deck_id)
+
+    due = scheduling.due_problem_ids(deck, limit=2)
+    if not due:
+        return render(request, 'problems/no_problems.html', {'deck': deck, 'review': True})
+    current_problem_id = due[0]
+    active_attempt = Attempt.objects.active_for(current_problem_id)
+
+    card = get_card(current_problem_id)
+    if card is None:
+        raise Http404("No Problem matches the given query.")
+
+    context = {
+        'deck': deck,
+        'problem_id': current_problem_id,
+        'card': card,
+        'prefetch_urls': [reverse('problems:practice-card', args=[pk]) for pk in due[1:]],
+        'active_attempt': active_attempt,
+        'review': True,
+        'grades': Attempt.Grade.choices,
+    }
+    return render(request, 'problems/deck_practice.html', context)
+
+def _review_action(request, problem_id):
+    active_attempt = Attempt.objects.active_for(problem_id)
+    if 'start_attempt' in request.POST:
+        if not active_attempt:
+            Attempt.objects.start(problem_id)
+    elif 'finish_attempt' in request.POST:
+        if active_attempt:
+            grade = request.POST.get('grade')
+            active_attempt.finish(int(grade) if grade in map(str, Attempt.Grade.values) else None)
+    elif 'skip_problem' in request.POST:
+        if active_attempt:
+            active_attempt.delete()
+        scheduling.postpone(problem_id)
+
+@require_GET
+@conditional(lambda request, problem_id: problem_validators(problem_id), private=True, max_age=CARD_CACHE_TIMEOUT)
+def practice_card(request, problem_id):
+    """
+    Returns the statement of a problem as shown in deck practice. Requested
+    ahead of time through the practice page's prefetch hints.
+    """
+    card = get_card(problem_id)
+    if card is None:
+        raise Http404("No Problem matches the given query.")
+    return HttpResponse(card['display'])
+
 from django.contrib.admin.views.decorators import staff_member_required
-from django.core.files.storage import default_storage
-from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
+@csrf_exempt
 @staff_member_required
 def tiptap_image_upload(request):
     """
-    Handles image uploads from the Tiptap editor.
-    """
-    print("\n--- Tiptap Image Upload View ---")
-    print(f"Request method: {request.method}")
-    if request.method == 'POST' and request.FILES.get('image'):
-        print("Request is POST and contains an image file.")
-        image = request.FILES['image']
-        print(f"Image received: {image.name} ({image.size} bytes)")
-        # Define a path to save the image, e.g., 'tiptap_uploads/...'
-        file_name = default_storage.save(f"tiptap_uploads/{image.name}", image)
-        print(f"Image saved as: {file_name}")
-        # Get the URL for the saved file
-        file_url = default_storage.url(file_name)
-        print(f"Returning success JSON with URL: {file_url}")
+    Handles image uploads from the Tiptap editor. The upload is hashed as it
+    streams in, which needs the handler installed before the CSRF check
+    reads the request body.
+    """
+    hashing = uploads.HashingUploadHandler(request)
+    request.upload_handlers.insert(0, hashing)
+    return _tiptap_image_upload(request, hashing)
 
-        
-        return JsonResponse({'url': file_url})
-    print("Request failed validation (not POST or no image file).")
-    return JsonResponse(
-        {'error': 'Invalid request or no image file provided.'}, 
-        status=400
-    )
+
+@csrf_protect
+def _tiptap_image_upload(request, hashing):
+    image = request.FILES.get('image') if request.method == 'POST' else None
+    stored = uploads.store_upload(image, hashing.digests['image']) if image else None
+    if stored is None:
+        return JsonResponse({'error': 'Invalid request or no image file provided.'}, status=400)
+    return JsonResponse(stored)
+
+
+@staff_member_required
+@require_GET
+def problem_export(request):
+    """
+    Streams the whole problem bank as JSONL, or with `?images=1` as a zip
+    archive including the uploaded images (see `problems.exporting`).
+    """
+    if request.GET.get('images'):
+        response = StreamingHttpResponse(exporting.archive_chunks(), content_type='application/zip')
+        filename = 'problems.zip'
+    else:
+        response = StreamingHttpResponse(
+            (exporting.to_jsonl(record) for record in exporting.export_records()),
+            content_type='application/x-ndjson; charset=utf-8',
+        )
+        filename = 'problems.jsonl'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@require_safe
+def media_file(request, name):
+    """
+    Serves an uploaded file, or hands it off to the front proxy (see
+    `problems.media`).
+    """
+    return media.serve(request, name)